@@ -0,0 +1,70 @@
+import asyncio
+import random
+import time
+from dataclasses import dataclass
+
+
+@dataclass
+class FakeMessage:
+    content: str
+
+
+@dataclass
+class LatencyProfile:
+    """
+    Simulated model timing: time to first token is log-normal around `ttft_median`
+    (spread `ttft_sigma`), followed by `output_tokens` at `tokens_per_second`.
+    """
+    ttft_median: float = 0.8
+    ttft_sigma: float = 0.4
+    tokens_per_second: float = 40.0
+    output_tokens: int = 200
+    chunk_tokens: int = 8
+
+    def time_to_first_token(self):
+        return random.lognormvariate(0, self.ttft_sigma) * self.ttft_median
+
+    def generation_time(self):
+        return self.output_tokens / self.tokens_per_second
+
+
+class FakeChatModel:
+    """
+    Local stand-in for ChatTongyi with the same invoke/ainvoke/astream surface the agents
+    use, so the pipeline can be benchmarked without API keys or network access.
+    Register it with model_registry.register_provider("tongyi", FakeChatModel.factory(profile)).
+    """
+
+    def __init__(self, model="fake", temperature=0.0, profile=None):
+        self.model = model
+        self.temperature = temperature
+        self.profile = profile or LatencyProfile()
+        self.calls = 0
+
+    @classmethod
+    def factory(cls, profile):
+        return lambda model, temperature: cls(model, temperature, profile)
+
+    def _chunks(self, messages):
+        prompt = messages[-1].content if isinstance(messages, list) else str(messages)
+        word = f"[{self.model}:{len(prompt)}]"
+        for _ in range(0, self.profile.output_tokens, self.profile.chunk_tokens):
+            yield word * self.profile.chunk_tokens
+
+    def invoke(self, messages):
+        self.calls += 1
+        time.sleep(self.profile.time_to_first_token() + self.profile.generation_time())
+        return FakeMessage("".join(self._chunks(messages)))
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.profile.time_to_first_token() + self.profile.generation_time())
+        return FakeMessage("".join(self._chunks(messages)))
+
+    async def astream(self, messages):
+        self.calls += 1
+        await asyncio.sleep(self.profile.time_to_first_token())
+        delay = self.profile.chunk_tokens / self.profile.tokens_per_second
+        for chunk in self._chunks(messages):
+            yield FakeMessage(chunk)
+            await asyncio.sleep(delay)
@@ -0,0 +1,170 @@
+import inspect
+import os
+import threading
+
+from langchain_core.prompts import PromptTemplate
+
+
+def _connection_count(http_client):
+    """Best-effort count of open connections in an httpx client's pool."""
+    transport = getattr(http_client, "_transport", None)
+    pool = getattr(transport, "_pool", None)
+    return len(getattr(pool, "connections", None) or [])
+
+
+def _session_connection_count(session):
+    """Best-effort count of kept-alive connections in a requests.Session's pools."""
+    count = 0
+    for adapter in set(session.adapters.values()):  # one adapter may serve several prefixes
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        for key in list(pools.keys()) if pools is not None else []:
+            pool = pools.get(key)
+            queue = getattr(getattr(pool, "pool", None), "queue", None) or []
+            count += sum(conn is not None for conn in queue)
+    return count
+
+
+def _dashscope_accepts_session():
+    # dashscope forwards a `session` call argument to its HTTP requests since 1.2x; older
+    # releases open a new requests.Session per call and would send it as a model parameter.
+    try:
+        from dashscope.api_entities.http_request import HttpRequest
+    except ImportError:
+        return False
+    return "session" in inspect.signature(HttpRequest.__init__).parameters
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of chat models and compiled prompt templates.
+
+    Models are keyed by (provider, model, temperature), so every Agent with the same
+    settings - across roles and across reports - shares one client and its HTTP
+    connection pool instead of building a new one in __init__.
+
+    OpenAI models share httpx clients. ChatTongyi runs every call, async ones included,
+    through the synchronous DashScope SDK in a worker thread, so Tongyi models share one
+    requests.Session passed to the SDK through model_kwargs. With a DashScope release too
+    old to accept it, each call opens its own connection; stats() lists such providers
+    under "unpooled".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}
+        self._templates = {}
+        self._http_clients = {}
+        self._sessions = {}
+        self._unpooled = set()
+        self._factories = {
+            "tongyi": self._create_tongyi,
+            "openai": self._create_openai,
+        }
+        self.model_hits = 0
+        self.model_misses = 0
+        self.template_hits = 0
+        self.template_misses = 0
+
+    def register_provider(self, provider, factory):
+        """Register (or replace) the factory used to build models: factory(model, temperature)."""
+        with self._lock:
+            self._factories[provider] = factory
+            self._unpooled.discard(provider)
+            for key in [k for k in self._models if k[0] == provider]:
+                del self._models[key]
+
+    def get_model(self, provider, model, temperature):
+        key = (provider, model, float(temperature))
+        with self._lock:
+            instance = self._models.get(key)
+            if instance is not None:
+                self.model_hits += 1
+                return instance
+            self.model_misses += 1
+            instance = self._factories[provider](model, temperature)
+            self._models[key] = instance
+            return instance
+
+    def get_prompt_template(self, template):
+        with self._lock:
+            compiled = self._templates.get(template)
+            if compiled is not None:
+                self.template_hits += 1
+                return compiled
+            self.template_misses += 1
+            compiled = PromptTemplate.from_template(template)
+            self._templates[template] = compiled
+            return compiled
+
+    def _shared_http_clients(self, provider):
+        # Called with self._lock held.
+        if provider not in self._http_clients:
+            import httpx
+            limits = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+            self._http_clients[provider] = (httpx.Client(limits=limits), httpx.AsyncClient(limits=limits))
+        return self._http_clients[provider]
+
+    def _shared_session(self, provider):
+        # Called with self._lock held.
+        if provider not in self._sessions:
+            import requests
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=100)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._sessions[provider] = session
+        return self._sessions[provider]
+
+    def _create_tongyi(self, model, temperature):
+        from langchain_community.chat_models import ChatTongyi
+        model_kwargs = {}
+        if _dashscope_accepts_session():
+            model_kwargs["session"] = self._shared_session("tongyi")
+        else:
+            self._unpooled.add("tongyi")
+        return ChatTongyi(
+            dashscope_api_key=os.getenv("DASHSCOPE_API_KEY"),
+            model=model,
+            temperature=temperature,
+            model_kwargs=model_kwargs
+        )
+
+    def _create_openai(self, model, temperature):
+        from langchain_openai import ChatOpenAI
+        http_client, http_async_client = self._shared_http_clients("openai")
+        return ChatOpenAI(temperature=temperature, model=model, openai_api_key=os.getenv("OPENAI_API_KEY"),
+                          openai_organization=os.getenv("OPENAI_ORGANIZATION"),
+                          http_client=http_client, http_async_client=http_async_client)
+
+    def stats(self):
+        with self._lock:
+            connections = sum(_connection_count(sync_client) + _connection_count(async_client)
+                              for sync_client, async_client in self._http_clients.values())
+            connections += sum(_session_connection_count(session) for session in self._sessions.values())
+            return {
+                "clients": len(self._models),
+                "http_pools": len(self._http_clients) + len(self._sessions),
+                "connections": connections,
+                "unpooled": sorted(self._unpooled),
+                "templates": len(self._templates),
+                "model_hits": self.model_hits,
+                "model_misses": self.model_misses,
+                "template_hits": self.template_hits,
+                "template_misses": self.template_misses,
+            }
+
+    def close(self):
+        with self._lock:
+            for sync_client, _ in self._http_clients.values():
+                sync_client.close()
+            for session in self._sessions.values():
+                session.close()
+            # The async clients are left to the garbage collector: closing them needs the
+            # event loop they were used on, which may already be gone at shutdown.
+            self._http_clients.clear()
+            self._sessions.clear()
+            self._unpooled.clear()
+            self._models.clear()
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,230 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from Utils.QwenAgents import (Cardiologist, Psychologist, Pulmonologist, MultidisciplinaryTeam, TeamRefinement,
+                              PENDING_REPORT, FAILED_REPORT)
+
+SPECIALISTS = {
+    "Cardiologist": Cardiologist,
+    "Psychologist": Psychologist,
+    "Pulmonologist": Pulmonologist,
+}
+
+
+@dataclass
+class StreamEvent:
+    role: str
+    delta: str = ""
+    done: bool = False
+
+
+@dataclass
+class DiagnosisResult:
+    reports: dict
+    final_diagnosis: str
+    timings: dict = field(default_factory=dict)
+
+
+class DiagnosisPipeline:
+    """
+    Asyncio fan-out/fan-in over the specialist agents.
+
+    The three specialists are scheduled concurrently via Agent.arun(); the
+    MultidisciplinaryTeam step starts as soon as the last specialist report lands.
+    Many reports can be diagnosed concurrently in one event loop; `max_concurrency`
+    bounds the number of in-flight model calls across all of them. With a
+    ResponseCache, agents whose inputs were already answered are not re-run.
+
+    With `speculative=True` a draft team synthesis starts as soon as all but one
+    specialist have reported, and is reconciled with the last report when it lands
+    (see _run_speculative for the timings recorded).
+
+    `policy` (Resilience.RetryPolicy) sets per-role deadlines, retries and hedging for
+    every agent call. A specialist that still fails is passed to the team as FAILED_REPORT.
+
+    With a ReportCompactor, each specialist receives only the role-relevant sections of
+    the report within that role's token budget.
+    """
+
+    def __init__(self, max_concurrency=None, cache=None, speculative=False, policy=None, compactor=None):
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self.speculative = speculative
+        self.policy = policy
+        self.compactor = compactor
+        self.agent_options = {"cache": cache, "policy": policy}
+        self._semaphore = None
+
+    def _limiter(self):
+        # Created lazily so the semaphore binds to the running event loop.
+        if self._semaphore is None and self.max_concurrency:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _call(self, agent):
+        limiter = self._limiter()
+        if limiter is None:
+            return await agent.arun()
+        async with limiter:
+            return await agent.arun()
+
+    def _specialists(self, medical_report):
+        reports = self.compactor.compact(medical_report) if self.compactor else {}
+        return {
+            name: agent_cls(reports.get(name, medical_report), **self.agent_options)
+            for name, agent_cls in SPECIALISTS.items()
+        }
+
+    async def _run_specialist(self, name, agent, started):
+        response = await self._call(agent)
+        return name, response, time.perf_counter() - started
+
+    async def run_specialists(self, medical_report, timings=None):
+        started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._run_specialist(name, agent, started))
+            for name, agent in self._specialists(medical_report).items()
+        ]
+        responses = {}
+        for finished in asyncio.as_completed(tasks):
+            name, response, elapsed = await finished
+            responses[name] = response
+            if timings is not None:
+                timings[name] = elapsed
+        return responses
+
+    @staticmethod
+    def _report_or_placeholder(responses, role):
+        if role not in responses:
+            return PENDING_REPORT
+        return responses[role] or FAILED_REPORT
+
+    def _team_agent(self, responses):
+        return MultidisciplinaryTeam(
+            cardiologist_report=self._report_or_placeholder(responses, "Cardiologist"),
+            psychologist_report=self._report_or_placeholder(responses, "Psychologist"),
+            pulmonologist_report=self._report_or_placeholder(responses, "Pulmonologist"),
+            **self.agent_options
+        )
+
+    async def _run_speculative(self, medical_report):
+        """
+        Start the team draft on the first N-1 specialist reports, then refine it with the last one.
+
+        Timings (seconds from start): `draft_started`, `specialists_done`, `total`; durations:
+        `draft`, `refine`. `estimated_baseline` is specialists_done + draft duration, i.e. what the
+        non-speculative pipeline would have taken with a team call as long as the draft, and
+        `critical_path_saving` is that estimate minus the actual total (negative when speculation lost).
+        """
+        timings = {}
+        started = time.perf_counter()
+        tasks = [
+            asyncio.create_task(self._run_specialist(name, agent, started))
+            for name, agent in self._specialists(medical_report).items()
+        ]
+        responses = {}
+        draft_task = None
+        draft_started = None
+        pending = None
+        for finished in asyncio.as_completed(tasks):
+            name, response, elapsed = await finished
+            responses[name] = response
+            timings[name] = elapsed
+            if len(responses) == len(SPECIALISTS) - 1:
+                pending = next(role for role in SPECIALISTS if role not in responses)
+                draft_started = time.perf_counter()
+                timings["draft_started"] = draft_started - started
+                draft_task = asyncio.create_task(self._call(self._team_agent(responses)))
+        timings["specialists_done"] = time.perf_counter() - started
+
+        draft = await draft_task if draft_task is not None else None
+        draft_done = time.perf_counter()
+        if draft_task is not None:
+            timings["draft"] = draft_done - draft_started
+
+        if draft is None:
+            # Speculation failed (or there was nothing to speculate on): fall back to the full team call.
+            final_diagnosis = await self._call(self._team_agent(responses))
+            timings["MultidisciplinaryTeam"] = time.perf_counter() - draft_done
+        else:
+            refine_agent = TeamRefinement(draft, pending, self._report_or_placeholder(responses, pending),
+                                          **self.agent_options)
+            final_diagnosis = await self._call(refine_agent)
+            timings["refine"] = time.perf_counter() - draft_done
+            if final_diagnosis is None:
+                final_diagnosis = draft
+        timings["total"] = time.perf_counter() - started
+        if "draft" in timings:
+            timings["estimated_baseline"] = timings["specialists_done"] + timings["draft"]
+            timings["critical_path_saving"] = timings["estimated_baseline"] - timings["total"]
+        return DiagnosisResult(reports=responses, final_diagnosis=final_diagnosis, timings=timings)
+
+    async def run(self, medical_report):
+        if self.speculative:
+            return await self._run_speculative(medical_report)
+        timings = {}
+        started = time.perf_counter()
+        responses = await self.run_specialists(medical_report, timings)
+
+        team_started = time.perf_counter()
+        final_diagnosis = await self._call(self._team_agent(responses))
+        timings["MultidisciplinaryTeam"] = time.perf_counter() - team_started
+        timings["total"] = time.perf_counter() - started
+        return DiagnosisResult(reports=responses, final_diagnosis=final_diagnosis, timings=timings)
+
+    async def diagnose(self, medical_report):
+        result = await self.run(medical_report)
+        return result.final_diagnosis
+
+    async def _stream_agent(self, agent, events):
+        limiter = self._limiter()
+        chunks = []
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            async for delta in agent.astream():
+                chunks.append(delta)
+                await events.put(StreamEvent(agent.role, delta))
+        finally:
+            if limiter is not None:
+                limiter.release()
+            await events.put(StreamEvent(agent.role, done=True))
+        return "".join(chunks) or None
+
+    async def stream(self, medical_report):
+        """
+        Async generator of StreamEvents: specialist deltas interleaved as they arrive,
+        then the MultidisciplinaryTeam deltas. Each role ends with a `done` event.
+        """
+        events = asyncio.Queue()
+        tasks = {
+            name: asyncio.create_task(self._stream_agent(agent, events))
+            for name, agent in self._specialists(medical_report).items()
+        }
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event.done:
+                    remaining -= 1
+                yield event
+            responses = {name: task.result() for name, task in tasks.items()}
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        team_agent = self._team_agent(responses)
+        limiter = self._limiter()
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            async for delta in team_agent.astream():
+                yield StreamEvent(team_agent.role, delta)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        yield StreamEvent(team_agent.role, done=True)
+
+    async def diagnose_many(self, medical_reports):
+        return await asyncio.gather(*(self.run(report) for report in medical_reports))
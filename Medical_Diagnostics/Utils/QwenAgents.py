@@ -1,141 +1,270 @@
 import os
 
 from dotenv import load_dotenv
-from langchain_community.chat_models import ChatTongyi
 from langchain.schema import HumanMessage
-from langchain_core.prompts import PromptTemplate
 
 from api_config import api_config
+from Utils.ModelRegistry import model_registry
+from Utils.ResponseCache import ResponseCache
+from Utils.Resilience import acall_with_resilience, call_with_resilience
 
 api_key = api_config.get_api_key()
 os.environ["DASHSCOPE_API_KEY"] = os.getenv("DASHSCOPE_API_KEY")
 
+PROVIDER = "tongyi"
+MODEL_NAME = "qwen-plus"
+TEMPERATURE = 0.3
+
+# SPECIALIST_TEMPLATES = {
+#     "Cardiologist": """
+#         Act like a cardiologist. You will receive a medical report of a patient.
+#         Task: Review the patient's cardiac workup, including ECG, blood tests, Holter monitor results, and echocardiogram.
+#         Focus: Identify subtle signs of cardiac issues that could explain the patient’s symptoms.
+#         Recommendation: Provide possible causes and next steps.
+#         Medical Report: {medical_report}
+#     """,
+#     "Psychologist": """
+#         Act like a psychologist. You will receive a patient's report.
+#         Task: Identify potential mental health issues like anxiety, depression, or trauma.
+#         Recommendation: Provide insights and recommended next steps.
+#         Medical Report: {medical_report}
+#     """,
+#     "Pulmonologist": """
+#         Act like a pulmonologist. You will receive a patient's report.
+#         Task: Identify possible respiratory issues such as asthma, COPD, or lung infections.
+#         Recommendation: Suggest possible causes and further tests.
+#         Medical Report: {medical_report}
+#     """
+# }
+SPECIALIST_TEMPLATES = {
+    "Cardiologist": """
+        请用中文回答以下问题。
+        请扮演一位心脏病专家，你将收到一份病人的医学报告。
+        任务：审查患者的心脏检查结果，包括心电图、血液检查、动态心电图和超声心动图。
+        重点：识别可能解释患者症状的细微心脏问题。
+        建议：提供可能的病因和下一步建议。
+        医学报告: {medical_report}
+    """,
+    "Psychologist": """
+        请用中文回答以下问题。
+        请扮演一位心理医生，你将收到一份患者的医学报告。
+        任务：识别潜在的心理健康问题，如焦虑、抑郁或创伤。
+        建议：提供专业见解和后续建议。
+        医学报告: {medical_report}
+    """,
+    "Pulmonologist": """
+        请用中文回答以下问题。
+        请扮演一位肺病专家，你将收到一份患者的医学报告。
+        任务：识别可能的呼吸系统问题，如哮喘、慢阻肺或肺部感染。
+        建议：提出可能的病因和建议进一步检查。
+        医学报告: {medical_report}
+    """,
+    # Not part of the default three-specialist pipeline; available to rosters (see Utils/Roster.py)
+    "Neurologist": """
+        请用中文回答以下问题。
+        请扮演一位神经科专家，你将收到一份患者的医学报告。
+        任务：识别可能的神经系统问题，如偏头痛、癫痫、周围神经病变或前庭功能障碍。
+        建议：提出可能的病因和建议进一步检查。
+        医学报告: {medical_report}
+    """,
+    "Endocrinologist": """
+        请用中文回答以下问题。
+        请扮演一位内分泌科专家，你将收到一份患者的医学报告。
+        任务：识别可能的内分泌与代谢问题，如甲状腺功能异常、糖尿病或肾上腺疾病。
+        建议：提出可能的病因和建议进一步检查。
+        医学报告: {medical_report}
+    """
+}
+
+# TEAM_TEMPLATE = """
+#     Act like a multidisciplinary team of healthcare professionals.
+#     You will receive medical reports from a Cardiologist, Psychologist, and Pulmonologist.
+#     Task: Analyze the reports and generate a list of 3 possible health issues with explanations.
+#
+#     Cardiologist Report: {cardiologist_report}
+#     Psychologist Report: {psychologist_report}
+#     Pulmonologist Report: {pulmonologist_report}
+# """
+TEAM_TEMPLATE = """
+    请用中文回答以下问题。
+    请扮演一个由心脏科医生、心理医生和肺病专家组成的多学科医疗团队。
+    你将收到来自这三位专家的医学报告。
+    任务：分析这些报告，并生成3个可能的健康问题及其解释。
+
+    心脏科报告: {cardiologist_report}
+    心理科报告: {psychologist_report}
+    呼吸科报告: {pulmonologist_report}
+"""
+
+# Used by the speculative pipeline: a draft written from two specialist reports is
+# reconciled with the third one once it arrives.
+TEAM_REFINE_TEMPLATE = """
+    请用中文回答以下问题。
+    请扮演一个由心脏科医生、心理医生和肺病专家组成的多学科医疗团队。
+    你们已根据部分专家报告起草了一份初步诊断，起草时{pending_role}报告尚未完成。
+    任务：结合新到达的{pending_role}报告修订初步诊断，输出最终的3个可能的健康问题及其解释。
+
+    初步诊断: {draft_diagnosis}
+    {pending_role}报告: {pending_report}
+"""
+
+ROLE_LABELS = {
+    "Cardiologist": "心脏科",
+    "Psychologist": "心理科",
+    "Pulmonologist": "呼吸科",
+    "Neurologist": "神经科",
+    "Endocrinologist": "内分泌科",
+}
+PENDING_REPORT = "（该专科报告尚未完成）"
+FAILED_REPORT = "（该专科报告生成失败）"
+
 
 class Agent:
-    def __init__(self, medical_report=None, role=None, extra_info=None):
+    def __init__(self, medical_report=None, role=None, extra_info=None, cache=None, policy=None, template=None):
         self.medical_report = medical_report
         self.role = role
         self.extra_info = extra_info or {}
+        # Overrides the built-in template for this role (used by roster-defined roles)
+        self.template = template
+        self.cache = cache
+        # Retries, deadline and hedging for model calls; None uses Resilience.DEFAULT_POLICY
+        self.policy = policy
         self.prompt_template = self.create_prompt_template()
-        self.model = ChatTongyi(
-            dashscope_api_key=os.getenv("DASHSCOPE_API_KEY"),
-            model="qwen-plus",
-            temperature=0.3
-        )
+        # Shared across agents and reports; see Utils/ModelRegistry.py
+        self.model = model_registry.get_model(PROVIDER, MODEL_NAME, TEMPERATURE)
 
     def create_prompt_template(self):
+        if self.template is not None:
+            return model_registry.get_prompt_template(self.template)
         if self.role == "MultidisciplinaryTeam":
-            # template = """
-            #     Act like a multidisciplinary team of healthcare professionals.
-            #     You will receive medical reports from a Cardiologist, Psychologist, and Pulmonologist.
-            #     Task: Analyze the reports and generate a list of 3 possible health issues with explanations.
-            #
-            #     Cardiologist Report: {cardiologist_report}
-            #     Psychologist Report: {psychologist_report}
-            #     Pulmonologist Report: {pulmonologist_report}
-            # """
-            template = """
-                请用中文回答以下问题。
-                请扮演一个由心脏科医生、心理医生和肺病专家组成的多学科医疗团队。
-                你将收到来自这三位专家的医学报告。
-                任务：分析这些报告，并生成3个可能的健康问题及其解释。
-
-                心脏科报告: {cardiologist_report}
-                心理科报告: {psychologist_report}
-                呼吸科报告: {pulmonologist_report}
-            """
-
-            return PromptTemplate.from_template(template)
-        else:
-            # templates = {
-            #     "Cardiologist": """
-            #         Act like a cardiologist. You will receive a medical report of a patient.
-            #         Task: Review the patient's cardiac workup, including ECG, blood tests, Holter monitor results, and echocardiogram.
-            #         Focus: Identify subtle signs of cardiac issues that could explain the patient’s symptoms.
-            #         Recommendation: Provide possible causes and next steps.
-            #         Medical Report: {medical_report}
-            #     """,
-            #     "Psychologist": """
-            #         Act like a psychologist. You will receive a patient's report.
-            #         Task: Identify potential mental health issues like anxiety, depression, or trauma.
-            #         Recommendation: Provide insights and recommended next steps.
-            #         Medical Report: {medical_report}
-            #     """,
-            #     "Pulmonologist": """
-            #         Act like a pulmonologist. You will receive a patient's report.
-            #         Task: Identify possible respiratory issues such as asthma, COPD, or lung infections.
-            #         Recommendation: Suggest possible causes and further tests.
-            #         Medical Report: {medical_report}
-            #     """
-            # }
-            templates = {
-                "Cardiologist": """
-                    请用中文回答以下问题。
-                    请扮演一位心脏病专家，你将收到一份病人的医学报告。
-                    任务：审查患者的心脏检查结果，包括心电图、血液检查、动态心电图和超声心动图。
-                    重点：识别可能解释患者症状的细微心脏问题。
-                    建议：提供可能的病因和下一步建议。
-                    医学报告: {medical_report}
-                """,
-                "Psychologist": """
-                    请用中文回答以下问题。
-                    请扮演一位心理医生，你将收到一份患者的医学报告。
-                    任务：识别潜在的心理健康问题，如焦虑、抑郁或创伤。
-                    建议：提供专业见解和后续建议。
-                    医学报告: {medical_report}
-                """,
-                "Pulmonologist": """
-                    请用中文回答以下问题。
-                    请扮演一位肺病专家，你将收到一份患者的医学报告。
-                    任务：识别可能的呼吸系统问题，如哮喘、慢阻肺或肺部感染。
-                    建议：提出可能的病因和建议进一步检查。
-                    医学报告: {medical_report}
-                """
-            }
-
-            return PromptTemplate.from_template(templates[self.role])
+            return model_registry.get_prompt_template(TEAM_TEMPLATE)
+        if self.role == "TeamRefinement":
+            return model_registry.get_prompt_template(TEAM_REFINE_TEMPLATE)
+        return model_registry.get_prompt_template(SPECIALIST_TEMPLATES[self.role])
+
+    def prompt_inputs(self):
+        values = {"medical_report": self.medical_report, **self.extra_info}
+        return {name: values.get(name) or "" for name in self.prompt_template.input_variables}
+
+    def format_prompt(self):
+        return self.prompt_template.format(**self.prompt_inputs())
+
+    def cache_key(self):
+        return ResponseCache.make_key(self.role, self.prompt_template.template, MODEL_NAME, TEMPERATURE,
+                                      self.prompt_inputs())
+
+    def cached_response(self):
+        if self.cache is None:
+            return None
+        response = self.cache.get(self.cache_key())
+        if response is not None:
+            print(f"{self.role} served from cache.")
+        return response
+
+    def store_response(self, response):
+        if self.cache is not None:
+            self.cache.put(self.cache_key(), self.role, response)
 
     def run(self):
         print(f"{self.role} is running...")
+        cached = self.cached_response()
+        if cached is not None:
+            return cached
+        messages = [HumanMessage(content=self.format_prompt())]
 
-        if self.role == "MultidisciplinaryTeam":
-            formatted_prompt = self.prompt_template.format(
-                cardiologist_report=self.extra_info.get("cardiologist_report", ""),
-                psychologist_report=self.extra_info.get("psychologist_report", ""),
-                pulmonologist_report=self.extra_info.get("pulmonologist_report", "")
-            )
-        else:
-            formatted_prompt = self.prompt_template.format(medical_report=self.medical_report)
+        try:
+            response = call_with_resilience(self.role, lambda: self.model.invoke(messages), self.policy)
+            self.store_response(response.content)
+            return response.content
+        except Exception as e:
+            print("Error occurred:", e)
+            return None
+
+    async def arun(self):
+        """Async counterpart of run(): awaits the model instead of blocking a thread."""
+        print(f"{self.role} is running (async)...")
+        cached = self.cached_response()
+        if cached is not None:
+            return cached
+        messages = [HumanMessage(content=self.format_prompt())]
 
         try:
-            response = self.model.invoke([HumanMessage(content=formatted_prompt)])
+            response = await acall_with_resilience(self.role, lambda: self.model.ainvoke(messages), self.policy)
+            self.store_response(response.content)
             return response.content
         except Exception as e:
             print("Error occurred:", e)
             return None
 
+    async def astream(self):
+        """
+        Yield response text chunks as the model produces them (a cache hit yields once).
+        Failures before the first chunk are retried like arun(); once text has been
+        yielded the stream cannot be restarted, so later errors just end it.
+        """
+        print(f"{self.role} is streaming...")
+        cached = self.cached_response()
+        if cached is not None:
+            yield cached
+            return
+        messages = [HumanMessage(content=self.format_prompt())]
+
+        chunks = []
+        try:
+            async def open_stream():
+                iterator = self.model.astream(messages).__aiter__()
+                try:
+                    return iterator, await iterator.__anext__()
+                except StopAsyncIteration:
+                    return iterator, None
+
+            stream, first = await acall_with_resilience(self.role, open_stream, self.policy)
+            if first is None:
+                return
+            if first.content:
+                chunks.append(first.content)
+                yield first.content
+            async for chunk in stream:
+                if chunk.content:
+                    chunks.append(chunk.content)
+                    yield chunk.content
+        except Exception as e:
+            print("Error occurred:", e)
+            return
+        self.store_response("".join(chunks) or None)
+
 
 # Define specialized agent classes
 class Cardiologist(Agent):
-    def __init__(self, medical_report):
-        super().__init__(medical_report, "Cardiologist")
+    def __init__(self, medical_report, **kwargs):
+        super().__init__(medical_report, "Cardiologist", **kwargs)
 
 
 class Psychologist(Agent):
-    def __init__(self, medical_report):
-        super().__init__(medical_report, "Psychologist")
+    def __init__(self, medical_report, **kwargs):
+        super().__init__(medical_report, "Psychologist", **kwargs)
 
 
 class Pulmonologist(Agent):
-    def __init__(self, medical_report):
-        super().__init__(medical_report, "Pulmonologist")
+    def __init__(self, medical_report, **kwargs):
+        super().__init__(medical_report, "Pulmonologist", **kwargs)
 
 
 class MultidisciplinaryTeam(Agent):
-    def __init__(self, cardiologist_report, psychologist_report, pulmonologist_report):
+    def __init__(self, cardiologist_report, psychologist_report, pulmonologist_report, **kwargs):
         extra_info = {
             "cardiologist_report": cardiologist_report,
             "psychologist_report": psychologist_report,
             "pulmonologist_report": pulmonologist_report
         }
-        super().__init__(role="MultidisciplinaryTeam", extra_info=extra_info)
+        super().__init__(role="MultidisciplinaryTeam", extra_info=extra_info, **kwargs)
+
+
+class TeamRefinement(Agent):
+    def __init__(self, draft_diagnosis, pending_role, pending_report, **kwargs):
+        extra_info = {
+            "draft_diagnosis": draft_diagnosis,
+            "pending_role": ROLE_LABELS.get(pending_role, pending_role),
+            "pending_report": pending_report
+        }
+        super().__init__(role="TeamRefinement", extra_info=extra_info, **kwargs)
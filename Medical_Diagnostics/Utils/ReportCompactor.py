@@ -0,0 +1,121 @@
+import re
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+# Lower-case substrings; a section's relevance for a role is the number of hits.
+ROLE_KEYWORDS = {
+    "Cardiologist": [
+        "heart", "cardiac", "cardio", "ecg", "ekg", "holter", "echocardiogram", "blood pressure", "chest pain",
+        "palpitation", "troponin", "cholesterol", "arrhythmia", "tachycardia", "pulse",
+        "心脏", "心电", "心率", "心悸", "胸痛", "血压", "超声心动", "心律", "胆固醇", "肌钙蛋白",
+    ],
+    "Psychologist": [
+        "anxiety", "panic", "depress", "stress", "sleep", "insomnia", "mood", "trauma", "psychiatric", "mental",
+        "therapy", "counsel", "worry", "fear",
+        "焦虑", "惊恐", "抑郁", "压力", "睡眠", "失眠", "情绪", "心理", "创伤", "恐惧",
+    ],
+    "Pulmonologist": [
+        "lung", "pulmonary", "breath", "dyspnea", "asthma", "copd", "spirometry", "x-ray", "oxygen", "cough",
+        "wheez", "smok", "respiratory", "saturation",
+        "肺", "呼吸", "气短", "气促", "哮喘", "咳", "胸片", "血氧", "吸烟", "喘",
+    ],
+}
+
+DEFAULT_BUDGETS = {
+    "Cardiologist": 1200,
+    "Psychologist": 1200,
+    "Pulmonologist": 1200,
+}
+
+OMITTED_NOTE = "（与本专科无关的部分内容已省略）"
+
+# A heading is a short line ending in a colon ("Medical History:") or a markdown header.
+_HEADING = re.compile(r"^\s*(#{1,6}\s+\S.*|[^\n:：]{1,40}[:：]\s*)$")
+
+
+def count_tokens(text):
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    # Without tiktoken: one token per CJK character, roughly 4 characters per token otherwise.
+    cjk = len(re.findall(r"[一-鿿]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_tokens(text, budget):
+    if _ENCODING is not None:
+        return _ENCODING.decode(_ENCODING.encode(text)[:budget])
+    while text and count_tokens(text) > budget:
+        text = text[:int(len(text) * 0.9)]
+    return text
+
+
+@dataclass
+class Section:
+    index: int
+    text: str
+    tokens: int
+
+
+class ReportCompactor:
+    """
+    Shrinks a medical report to the parts each specialist needs before it is pasted into
+    three prompts. The report is split into sections and tokenized once; each role then
+    keeps the leading `keep_head` sections (patient details / chief complaint) plus the
+    sections with the most keyword hits for that role, in original order, within its
+    token budget. Reports that already fit the budget are passed through unchanged.
+    """
+
+    def __init__(self, budgets=None, keywords=None, keep_head=1):
+        self.budgets = budgets or DEFAULT_BUDGETS
+        self.keywords = keywords or ROLE_KEYWORDS
+        self.keep_head = keep_head
+
+    @staticmethod
+    def split_sections(report):
+        blocks = []
+        current = []
+        for line in report.splitlines():
+            starts_block = not line.strip() or _HEADING.match(line)
+            if starts_block and current:
+                blocks.append("\n".join(current).strip())
+                current = []
+            if line.strip():
+                current.append(line)
+        if current:
+            blocks.append("\n".join(current).strip())
+        return [Section(i, text, count_tokens(text)) for i, text in enumerate(blocks) if text]
+
+    def score(self, section, role):
+        lowered = section.text.lower()
+        return sum(lowered.count(keyword) for keyword in self.keywords.get(role, ()))
+
+    def compact_sections(self, sections, role):
+        budget = self.budgets[role]
+        head = sections[:self.keep_head]
+        rest = sorted(sections[self.keep_head:], key=lambda s: (-self.score(s, role), s.index))
+        chosen = []
+        used = 0
+        for position, section in enumerate(head + rest):
+            if used + section.tokens <= budget:
+                chosen.append((section.index, section.text))
+                used += section.tokens
+            elif position < len(head) or (position == len(head) and self.score(section, role) > 0):
+                # Never drop the header or the single most relevant section; cut it to fit instead.
+                text = truncate_tokens(section.text, max(0, budget - used))
+                if text:
+                    chosen.append((section.index, text))
+                    used += count_tokens(text)
+        chosen.sort()
+        return "\n\n".join(text for _, text in chosen) + "\n\n" + OMITTED_NOTE
+
+    def compact(self, report):
+        """Return {role: compacted report} for every role with a budget, tokenizing the report once."""
+        sections = self.split_sections(report)
+        total = sum(section.tokens for section in sections)
+        return {role: report if total <= budget else self.compact_sections(sections, role)
+                for role, budget in self.budgets.items()}
@@ -0,0 +1,156 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Total time budget per agent call, retries included (seconds).
+DEFAULT_DEADLINES = {
+    "Cardiologist": 90.0,
+    "Psychologist": 90.0,
+    "Pulmonologist": 90.0,
+    "MultidisciplinaryTeam": 150.0,
+    "TeamRefinement": 120.0,
+}
+
+
+class LatencyTracker:
+    """Rolling per-role latency samples, used to derive the hedging threshold."""
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, role, seconds):
+        with self._lock:
+            self._samples.setdefault(role, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, role, q):
+        with self._lock:
+            samples = sorted(self._samples.get(role, ()))
+        if len(samples) < self.min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+
+latency_tracker = LatencyTracker()
+
+
+@dataclass
+class RetryPolicy:
+    """
+    attempts:    max calls per agent (first try included).
+    base_delay:  backoff base; attempt n sleeps uniform(0, min(max_delay, base_delay * 2**(n-1))).
+    deadlines:   per-role total budget in seconds; roles missing here use default_deadline.
+    hedge:       send a duplicate request once the primary is slower than the role's p95.
+    hedge_after: fixed hedging threshold in seconds (overrides the p95 when set).
+    """
+    attempts: int = 3
+    base_delay: float = 1.0
+    max_delay: float = 20.0
+    deadlines: dict = field(default_factory=lambda: dict(DEFAULT_DEADLINES))
+    default_deadline: float = 120.0
+    hedge: bool = False
+    hedge_after: Optional[float] = None
+
+    def deadline_for(self, role):
+        return self.deadlines.get(role, self.default_deadline)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def hedge_delay(self, role, tracker):
+        if self.hedge_after is not None:
+            return self.hedge_after
+        if self.hedge:
+            return tracker.percentile(role, 95)
+        return None
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+async def _first_success(tasks):
+    pending = set(tasks)
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+async def _hedged(role, make_call, policy, tracker):
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(make_call())]
+    try:
+        hedge_after = policy.hedge_delay(role, tracker)
+        if hedge_after is not None:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+            if not done:
+                print(f"{role} slower than {hedge_after:.2f}s, sending hedged request...")
+                tasks.append(asyncio.create_task(make_call()))
+        result = await _first_success(tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+    tracker.record(role, time.perf_counter() - started)
+    return result
+
+
+async def acall_with_resilience(role, make_call, policy=None, tracker=latency_tracker):
+    """
+    Await make_call() (a zero-argument coroutine factory) within the role's deadline,
+    retrying failures with jittered exponential backoff and optionally hedging slow calls.
+    Raises the last error once attempts or the deadline are exhausted.
+    """
+    policy = policy or DEFAULT_POLICY
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + policy.deadline_for(role)
+    error = None
+    for attempt in range(1, policy.attempts + 1):
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+            break
+        try:
+            return await asyncio.wait_for(_hedged(role, make_call, policy, tracker), timeout=remaining)
+        except asyncio.TimeoutError:
+            error = TimeoutError(f"{role} exceeded its {policy.deadline_for(role):.0f}s deadline")
+            break
+        except Exception as e:
+            error = e
+            print(f"{role} attempt {attempt}/{policy.attempts} failed: {e}")
+        if attempt < policy.attempts:
+            await asyncio.sleep(min(policy.backoff(attempt), max(0.0, deadline - loop.time())))
+    raise error or TimeoutError(f"{role} exceeded its {policy.deadline_for(role):.0f}s deadline")
+
+
+def call_with_resilience(role, call, policy=None, tracker=latency_tracker):
+    """
+    Blocking variant for Agent.run(): retries with jittered backoff while the role's
+    deadline allows another attempt. A call already in flight cannot be interrupted.
+    """
+    policy = policy or DEFAULT_POLICY
+    deadline = time.monotonic() + policy.deadline_for(role)
+    error = None
+    for attempt in range(1, policy.attempts + 1):
+        if time.monotonic() >= deadline:
+            break
+        started = time.perf_counter()
+        try:
+            result = call()
+            tracker.record(role, time.perf_counter() - started)
+            return result
+        except Exception as e:
+            error = e
+            print(f"{role} attempt {attempt}/{policy.attempts} failed: {e}")
+        if attempt < policy.attempts:
+            time.sleep(min(policy.backoff(attempt), max(0.0, deadline - time.monotonic())))
+    raise error or TimeoutError(f"{role} exceeded its {policy.deadline_for(role):.0f}s deadline")
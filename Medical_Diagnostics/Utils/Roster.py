@@ -0,0 +1,210 @@
+import asyncio
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except Exception:
+    YAML_AVAILABLE = False
+
+from Utils.Pipeline import DiagnosisPipeline, DiagnosisResult, StreamEvent
+from Utils.QwenAgents import Agent, FAILED_REPORT, SPECIALIST_TEMPLATES
+
+# Roles Agent has a built-in prompt template for; any other role needs a `template`.
+BUILTIN_ROLES = set(SPECIALIST_TEMPLATES) | {"MultidisciplinaryTeam", "TeamRefinement"}
+
+# The built-in roster: three specialists feeding the multidisciplinary team.
+DEFAULT_ROSTER = {
+    "roles": {
+        "Cardiologist": {},
+        "Psychologist": {},
+        "Pulmonologist": {},
+        "MultidisciplinaryTeam": {"depends_on": ["Cardiologist", "Psychologist", "Pulmonologist"]},
+    },
+    "final": "MultidisciplinaryTeam",
+}
+
+
+def report_variable(role):
+    """Prompt variable carrying a role's output to its dependents: Cardiologist -> {cardiologist_report}."""
+    return re.sub(r"(?<!^)(?=[A-Z])", "_", role).lower() + "_report"
+
+
+@dataclass
+class RoleSpec:
+    name: str
+    template: Optional[str] = None
+    depends_on: list = field(default_factory=list)
+
+
+class Roster:
+    """
+    Declarative set of roles forming a DAG. Each role has an optional prompt template
+    (built-in roles fall back to the templates in QwenAgents) and the roles it depends on;
+    a dependency's output is passed in as {<role>_report}, e.g. {neurologist_report}.
+    Roles without dependencies receive {medical_report}. `final` may be omitted only when
+    exactly one role has no dependents.
+    """
+
+    def __init__(self, roles, final=None):
+        self.roles = {name: RoleSpec(name, spec.get("template"), list(spec.get("depends_on", [])))
+                      for name, spec in roles.items()}
+        missing = [name for name, spec in self.roles.items() if spec.template is None and name not in BUILTIN_ROLES]
+        if missing:
+            raise ValueError(f"Roles {missing} have no built-in prompt template; give them a `template`.")
+        self.order = self._topological_order()
+        sinks = [name for name in self.roles
+                 if not any(name in spec.depends_on for spec in self.roles.values())]
+        if final is None and len(sinks) > 1:
+            raise ValueError(f"Roster has several final candidates {sinks}; set `final` to one of them.")
+        self.final = final or sinks[-1]
+        if self.final not in self.roles:
+            raise ValueError(f"Final role {self.final!r} is not defined in the roster.")
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["roles"], data.get("final"))
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith((".yaml", ".yml")):
+                if not YAML_AVAILABLE:
+                    raise RuntimeError("PyYAML is required to load YAML rosters; use JSON or `pip install pyyaml`.")
+                return cls.from_dict(yaml.safe_load(f))
+            return cls.from_dict(json.load(f))
+
+    def _topological_order(self):
+        for spec in self.roles.values():
+            unknown = [dep for dep in spec.depends_on if dep not in self.roles]
+            if unknown:
+                raise ValueError(f"Role {spec.name!r} depends on undefined roles: {unknown}")
+        indegree = {name: len(spec.depends_on) for name, spec in self.roles.items()}
+        ready = [name for name, degree in indegree.items() if degree == 0]
+        order = []
+        while ready:
+            name = ready.pop(0)
+            order.append(name)
+            for other, spec in self.roles.items():
+                if name in spec.depends_on:
+                    indegree[other] -= 1
+                    if indegree[other] == 0:
+                        ready.append(other)
+        if len(order) != len(self.roles):
+            cyclic = sorted(set(self.roles) - set(order))
+            raise ValueError(f"Roster has a dependency cycle among: {cyclic}")
+        return order
+
+
+class RosterPipeline(DiagnosisPipeline):
+    """
+    Runs a Roster with a dependency-graph scheduler: every role whose dependencies are
+    done is started immediately, so independent specialists always run in parallel and
+    end-to-end latency follows the longest dependency chain rather than the role count.
+    Timings hold each role's wall time plus `<role>.started` offsets and the total.
+
+    Concurrency limits, caching, retries and report compaction are shared with
+    DiagnosisPipeline; speculative synthesis only applies to the fixed three-specialist
+    pipeline.
+    """
+
+    def __init__(self, roster=None, **kwargs):
+        if kwargs.get("speculative"):
+            raise ValueError("Speculative synthesis is not supported for roster pipelines.")
+        super().__init__(**kwargs)
+        self.roster = roster or Roster.from_dict(DEFAULT_ROSTER)
+
+    def _agent(self, spec, medical_report, outputs, compacted):
+        if not spec.depends_on:
+            return Agent(compacted.get(spec.name, medical_report), spec.name,
+                         template=spec.template, **self.agent_options)
+        extra_info = {report_variable(dep): outputs[dep] or FAILED_REPORT for dep in spec.depends_on}
+        return Agent(medical_report, spec.name, extra_info=extra_info,
+                     template=spec.template, **self.agent_options)
+
+    async def _run_role(self, spec, agent, started):
+        role_started = time.perf_counter()
+        response = await self._call(agent)
+        return spec.name, response, role_started - started, time.perf_counter() - role_started
+
+    async def _run_roles(self, medical_report, compacted, outputs, timings, started, hold=()):
+        """
+        Async generator: start every role whose dependencies are done (except those in `hold`
+        and their dependents) and yield each role's name once its output is in `outputs`.
+        """
+        running = set()
+        scheduled = set(hold)
+
+        def schedule_ready():
+            for name in self.roster.order:
+                spec = self.roster.roles[name]
+                if name in scheduled or not all(dep in outputs for dep in spec.depends_on):
+                    continue
+                scheduled.add(name)
+                agent = self._agent(spec, medical_report, outputs, compacted)
+                running.add(asyncio.create_task(self._run_role(spec, agent, started)))
+
+        try:
+            schedule_ready()
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                finished = []
+                for task in done:
+                    running.discard(task)
+                    name, response, offset, wall = task.result()
+                    outputs[name] = response
+                    timings[name] = wall
+                    timings[f"{name}.started"] = offset
+                    finished.append(name)
+                # Start dependents before handing control back to the consumer.
+                schedule_ready()
+                for name in finished:
+                    yield name
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def run(self, medical_report):
+        started = time.perf_counter()
+        compacted = self.compactor.compact(medical_report) if self.compactor else {}
+        outputs = {}
+        timings = {}
+        async for _ in self._run_roles(medical_report, compacted, outputs, timings, started):
+            pass
+
+        timings["total"] = time.perf_counter() - started
+        final_diagnosis = outputs.get(self.roster.final)
+        reports = {name: text for name, text in outputs.items() if name != self.roster.final}
+        return DiagnosisResult(reports=reports, final_diagnosis=final_diagnosis, timings=timings)
+
+    async def stream(self, medical_report):
+        """
+        Async generator of StreamEvents. The roles feeding `final` run as in run(); each one's
+        report arrives as a single delta followed by its `done` event as soon as it finishes.
+        The final role then streams token by token. Roles depending on `final` are not run.
+        """
+        started = time.perf_counter()
+        compacted = self.compactor.compact(medical_report) if self.compactor else {}
+        outputs = {}
+        timings = {}
+        final = self.roster.roles[self.roster.final]
+        async for name in self._run_roles(medical_report, compacted, outputs, timings, started, hold={final.name}):
+            if outputs[name]:
+                yield StreamEvent(name, outputs[name])
+            yield StreamEvent(name, done=True)
+
+        agent = self._agent(final, medical_report, outputs, compacted)
+        limiter = self._limiter()
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            async for delta in agent.astream():
+                yield StreamEvent(final.name, delta)
+        finally:
+            if limiter is not None:
+                limiter.release()
+        yield StreamEvent(final.name, done=True)
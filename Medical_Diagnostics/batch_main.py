@@ -0,0 +1,211 @@
+"""
+Batch diagnosis: stream every report in a folder (or a JSONL manifest) through the
+specialist + MultidisciplinaryTeam pipeline.
+
+- Bounded global concurrency on model calls (--concurrency) and on reports in flight (--max-in-flight).
+- The output JSONL doubles as the progress checkpoint: re-running skips reports already diagnosed.
+- A consolidated markdown file is rebuilt from the JSONL at the end of every run.
+
+Run example:
+  python batch_main.py --input "Medical Reports" --output results/batch --concurrency 16
+  python batch_main.py --input manifest.jsonl --output results/batch
+
+Manifest lines look like {"id": "...", "path": "report.txt"} or {"id": "...", "text": "..."};
+relative paths are resolved against the manifest's folder.
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import os
+import time
+from datetime import datetime
+
+from Utils.ModelRegistry import model_registry
+from Utils.Pipeline import DiagnosisPipeline, SPECIALISTS
+from Utils.ReportCompactor import ReportCompactor
+from Utils.ResponseCache import ResponseCache
+from Utils.Roster import Roster, RosterPipeline
+from Utils.Resilience import RetryPolicy
+
+
+def iter_reports(source, pattern="*.txt"):
+    """Yield (report_id, path, text) lazily; exactly one of path/text is set."""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            path = os.path.join(source, name)
+            if os.path.isfile(path) and fnmatch.fnmatch(name, pattern):
+                yield name, path, None
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, "r", encoding="utf-8") as manifest:
+        for line_no, line in enumerate(manifest, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            text = entry.get("text")
+            path = entry.get("path")
+            if path and not os.path.isabs(path):
+                path = os.path.join(base_dir, path)
+            report_id = str(entry.get("id") or (os.path.basename(path) if path else f"line-{line_no}"))
+            yield report_id, path, text
+
+
+def read_records(jsonl_path):
+    """Return the last record per report id from a results JSONL (empty if missing)."""
+    records = {}
+    if not os.path.exists(jsonl_path):
+        return records
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line; it is simply redone.
+                continue
+            records[record["id"]] = record
+    return records
+
+
+def write_markdown(records, md_path):
+    with open(md_path, "w", encoding="utf-8") as md:
+        md.write(f"# Batch Diagnosis ({datetime.now():%Y-%m-%d %H:%M:%S})\n\n")
+        for record in records.values():
+            md.write(f"## {record['id']}\n\n")
+            if record["status"] == "ok":
+                md.write("### Final Diagnosis:\n\n" + record["final_diagnosis"] + "\n\n")
+            else:
+                md.write(f"**Failed:** {record.get('error', 'unknown error')}\n\n")
+
+
+async def diagnose_one(pipeline, report_id, path, text):
+    try:
+        if text is None:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        result = await pipeline.run(text)
+        if result.final_diagnosis is None:
+            return {"id": report_id, "status": "error", "error": "team agent returned no diagnosis"}
+        return {
+            "id": report_id,
+            "status": "ok",
+            "reports": result.reports,
+            "final_diagnosis": result.final_diagnosis,
+            "timings": result.timings,
+        }
+    except Exception as e:
+        return {"id": report_id, "status": "error", "error": repr(e)}
+
+
+async def run_batch(args):
+    os.makedirs(args.output, exist_ok=True)
+    jsonl_path = os.path.join(args.output, "diagnoses.jsonl")
+    md_path = os.path.join(args.output, "diagnoses.md")
+
+    done = {rid for rid, record in read_records(jsonl_path).items() if record["status"] == "ok"}
+    if done:
+        print(f"Resuming: {len(done)} reports already diagnosed.")
+
+    # Shared with main.py by default, so reports diagnosed there (or in a failed batch) are not re-billed.
+    cache = None if args.no_cache else ResponseCache(args.cache, ttl=args.cache_ttl)
+    policy = RetryPolicy(attempts=args.attempts, hedge=args.hedge, hedge_after=args.hedge_after)
+    compactor = None
+    if args.token_budget:
+        compactor = ReportCompactor(budgets={role: args.token_budget for role in SPECIALISTS})
+    if args.roster:
+        pipeline = RosterPipeline(Roster.from_file(args.roster), max_concurrency=args.concurrency, cache=cache,
+                                  policy=policy, compactor=compactor)
+    else:
+        pipeline = DiagnosisPipeline(max_concurrency=args.concurrency, cache=cache, speculative=args.speculative,
+                                     policy=policy, compactor=compactor)
+    # Bounded queue: reports are read lazily as workers free up, never all at once.
+    queue = asyncio.Queue(maxsize=args.max_in_flight * 2)
+    counts = {"ok": 0, "error": 0}
+    savings = []
+    started = time.perf_counter()
+
+    with open(jsonl_path, "a", encoding="utf-8") as out:
+        async def worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    queue.task_done()
+                    return
+                record = await diagnose_one(pipeline, *item)
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[record["status"]] += 1
+                if "critical_path_saving" in record.get("timings", {}):
+                    savings.append(record["timings"]["critical_path_saving"])
+                finished = counts["ok"] + counts["error"]
+                if finished % args.progress_every == 0:
+                    rate = finished / (time.perf_counter() - started)
+                    print(f"[{finished}] ok={counts['ok']} error={counts['error']} ({rate:.2f} reports/s)")
+                queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(args.max_in_flight)]
+        for report_id, path, text in iter_reports(args.input, args.pattern):
+            if report_id in done:
+                continue
+            await queue.put((report_id, path, text))
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+
+    write_markdown(read_records(jsonl_path), md_path)
+    elapsed = time.perf_counter() - started
+    print(f"Done in {elapsed:.1f}s: ok={counts['ok']} error={counts['error']} skipped={len(done)}")
+    if args.speculative and savings:
+        print(f"Speculative team step: mean critical-path saving {sum(savings) / len(savings):.2f}s "
+              f"over {len(savings)} reports")
+    print(f"Model registry: {model_registry.stats()}")
+    if cache is not None:
+        print(f"Response cache: {cache.stats()}")
+        cache.close()
+    print(f"Results: {jsonl_path}\nMarkdown: {md_path}")
+    return counts
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Diagnose every medical report in a folder or JSONL manifest.")
+    ap.add_argument("--input", default="Medical Reports", help="Folder of reports or a JSONL manifest.")
+    ap.add_argument("--pattern", default="*.txt", help="Glob for report files when --input is a folder.")
+    ap.add_argument("--output", default=os.path.join("results", "batch"), help="Output folder (JSONL + markdown).")
+    ap.add_argument("--concurrency", type=int, default=16, help="Max in-flight model calls across all reports.")
+    ap.add_argument("--max-in-flight", type=int, default=8, help="Max reports processed at the same time.")
+    ap.add_argument("--cache", default=os.path.join("results", "cache", "responses.sqlite"),
+                    help="SQLite response cache shared across runs.")
+    ap.add_argument("--cache-ttl", type=float, default=7 * 24 * 3600, help="Cache entry lifetime in seconds.")
+    ap.add_argument("--no-cache", action="store_true", help="Disable the response cache.")
+    ap.add_argument("--speculative", action="store_true",
+                    help="Start a draft team synthesis once all but one specialist have reported "
+                         "(not with --roster).")
+    ap.add_argument("--attempts", type=int, default=3, help="Max attempts per agent call.")
+    ap.add_argument("--hedge", action="store_true",
+                    help="Send a duplicate request when a call is slower than that role's p95 latency.")
+    ap.add_argument("--hedge-after", type=float, default=None, help="Fixed hedging threshold in seconds.")
+    ap.add_argument("--token-budget", type=int, default=0,
+                    help="If >0, trim each specialist's copy of the report to its relevant sections within "
+                         "this many tokens.")
+    ap.add_argument("--roster", default=None,
+                    help="YAML/JSON roster of roles and dependencies (see roster_example.yaml).")
+    ap.add_argument("--progress-every", type=int, default=10, help="Print progress every N reports.")
+    args = ap.parse_args(argv)
+    if args.roster and args.speculative:
+        ap.error("--speculative only applies to the built-in pipeline, not to --roster.")
+    return args
+
+
+def main():
+    args = parse_args()
+    asyncio.run(run_batch(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Benchmark the multi-agent diagnosis pipeline against a local fake LLM (no API keys needed).
+
+Modes:
+  threaded  - the original main.py approach: a ThreadPoolExecutor per report, blocking Agent.run()
+  async     - DiagnosisPipeline (Agent.arun) with a bounded number of reports in flight
+  batch     - batch_main.run_batch over a temporary folder of reports
+
+For every mode and concurrency level it reports throughput (reports/s), p50/p95/p99
+per-report latency and peak traced Python memory.
+
+Run example:
+  python benchmark.py --reports 200 --concurrency 1 8 32 128 --ttft 0.8 --tokens-per-second 40
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# api_config refuses to load without credentials; the fake model never uses them.
+os.environ.setdefault("DASHSCOPE_API_KEY", "sk-benchmark-fake-key")
+os.environ.setdefault("DASHSCOPE_APP_ID", "benchmark-fake-app")
+
+import batch_main
+from Utils.FakeLLM import FakeChatModel, LatencyProfile
+from Utils.ModelRegistry import model_registry
+from Utils.Pipeline import DiagnosisPipeline
+from Utils.QwenAgents import Cardiologist, Psychologist, Pulmonologist, MultidisciplinaryTeam
+
+SAMPLE_REPORT = """
+Patient Name: Benchmark Patient
+Age: 45
+
+Chief Complaint:
+Recurrent chest tightness, palpitations and shortness of breath during stress.
+
+Medical History:
+Generalized anxiety disorder, mild asthma in childhood, no known cardiac disease.
+
+Recent Lab and Diagnostic Results:
+ECG normal sinus rhythm; Holter without arrhythmia; spirometry within normal limits.
+"""
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_reports(count):
+    return [f"Report #{i}\n{SAMPLE_REPORT}" for i in range(count)]
+
+
+def diagnose_threaded(medical_report):
+    # Mirrors the original main.py: one thread per specialist, then the team step.
+    started = time.perf_counter()
+    agents = {
+        "Cardiologist": Cardiologist(medical_report),
+        "Psychologist": Psychologist(medical_report),
+        "Pulmonologist": Pulmonologist(medical_report)
+    }
+    responses = {}
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(agent.run): name for name, agent in agents.items()}
+        for future in as_completed(futures):
+            responses[futures[future]] = future.result()
+    MultidisciplinaryTeam(
+        cardiologist_report=responses["Cardiologist"],
+        psychologist_report=responses["Psychologist"],
+        pulmonologist_report=responses["Pulmonologist"]
+    ).run()
+    return time.perf_counter() - started
+
+
+def run_threaded(reports, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(diagnose_threaded, reports))
+
+
+async def run_async(reports, concurrency):
+    pipeline = DiagnosisPipeline()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def one(report):
+        async with slots:
+            result = await pipeline.run(report)
+            return result.timings["total"]
+
+    return await asyncio.gather(*(one(report) for report in reports))
+
+
+def run_batch(reports, concurrency):
+    workdir = tempfile.mkdtemp(prefix="diagnosis_bench_")
+    try:
+        input_dir = os.path.join(workdir, "reports")
+        os.makedirs(input_dir)
+        for i, report in enumerate(reports):
+            with open(os.path.join(input_dir, f"report_{i:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write(report)
+        output_dir = os.path.join(workdir, "out")
+        args = batch_main.parse_args(["--input", input_dir, "--output", output_dir, "--no-cache",
+                                      "--max-in-flight", str(concurrency), "--concurrency", str(concurrency * 4),
+                                      "--progress-every", str(len(reports) + 1)])
+        asyncio.run(batch_main.run_batch(args))
+        records = batch_main.read_records(os.path.join(output_dir, "diagnoses.jsonl"))
+        return [record["timings"]["total"] for record in records.values() if record["status"] == "ok"]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+MODES = {
+    "threaded": run_threaded,
+    "async": lambda reports, concurrency: asyncio.run(run_async(reports, concurrency)),
+    "batch": run_batch,
+}
+
+
+def measure(mode, reports, concurrency):
+    tracemalloc.start()
+    started = time.perf_counter()
+    # Agents print a line per call; keep the benchmark output readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        latencies = MODES[mode](reports, concurrency)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "reports": len(latencies),
+        "seconds": elapsed,
+        "reports_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "peak_mem_mb": peak / 1024 / 1024,
+    }
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the diagnosis pipeline with a local fake LLM.")
+    ap.add_argument("--reports", type=int, default=100, help="Reports per run.")
+    ap.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Reports in flight.")
+    ap.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    ap.add_argument("--ttft", type=float, default=0.8, help="Median time to first token (seconds).")
+    ap.add_argument("--ttft-sigma", type=float, default=0.4, help="Log-normal spread of time to first token.")
+    ap.add_argument("--tokens-per-second", type=float, default=40.0, help="Simulated generation speed.")
+    ap.add_argument("--output-tokens", type=int, default=200, help="Tokens per simulated response.")
+    ap.add_argument("--json", default=None, help="Also write the results to this JSON file.")
+    return ap.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    profile = LatencyProfile(ttft_median=args.ttft, ttft_sigma=args.ttft_sigma,
+                             tokens_per_second=args.tokens_per_second, output_tokens=args.output_tokens)
+    model_registry.register_provider("tongyi", FakeChatModel.factory(profile))
+    reports = make_reports(args.reports)
+
+    results = []
+    print(f"{'mode':<9}{'conc':>6}{'reports/s':>11}{'p50':>8}{'p95':>8}{'p99':>8}{'peak MB':>9}")
+    for mode in args.modes:
+        for concurrency in args.concurrency:
+            r = measure(mode, reports, concurrency)
+            results.append(r)
+            print(f"{r['mode']:<9}{r['concurrency']:>6}{r['reports_per_sec']:>11.2f}"
+                  f"{r['p50']:>8.2f}{r['p95']:>8.2f}{r['p99']:>8.2f}{r['peak_mem_mb']:>9.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
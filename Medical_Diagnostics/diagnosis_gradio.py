@@ -0,0 +1,33 @@
+import os
+
+import gradio as gr
+
+from Utils.Pipeline import DiagnosisPipeline, SPECIALISTS
+from Utils.ResponseCache import ResponseCache
+
+pipeline = DiagnosisPipeline(max_concurrency=16,
+                             cache=ResponseCache(os.path.join("results", "cache", "responses.sqlite")))
+ROLES = list(SPECIALISTS) + ["MultidisciplinaryTeam"]
+
+
+async def diagnose(medical_report):
+    # Async generator: Gradio re-renders every yield, so the first tokens show up immediately
+    texts = {role: "" for role in ROLES}
+    async for event in pipeline.stream(medical_report):
+        texts[event.role] += event.delta
+        yield [texts[role] for role in ROLES]
+
+
+with gr.Blocks() as demo:
+    gr.Markdown("## 🩺 多学科会诊")
+
+    report = gr.Textbox(label="医学报告", lines=12, placeholder="粘贴患者的医学报告")
+    run = gr.Button("开始诊断")
+    with gr.Row():
+        specialist_outputs = [gr.Markdown(label=role) for role in SPECIALISTS]
+    team_output = gr.Markdown(label="MultidisciplinaryTeam")
+
+    run.click(diagnose, [report], specialist_outputs + [team_output])
+
+if __name__ == "__main__":
+    demo.launch(share=False, server_port=7864, debug=True)
@@ -1,44 +1,38 @@
+import asyncio
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from Utils.QwenAgents import Cardiologist, Psychologist, Pulmonologist, MultidisciplinaryTeam
+from Utils.Pipeline import DiagnosisPipeline
+from Utils.ResponseCache import ResponseCache
 
 # read the medical report
 with open("Medical Reports\Medical Rerort - Michael Johnson - Panic Attack Disorder.txt", "r") as file:
     medical_report = file.read()
 
-agents = {
-    "Cardiologist": Cardiologist(medical_report),
-    "Psychologist": Psychologist(medical_report),
-    "Pulmonologist": Pulmonologist(medical_report)
-}
 
-
-# Function to run each agent and get their response
-def get_response(agent_name, agent):
-    response = agent.run()
-    return agent_name, response
-
-
-# Run the agents concurrently and collect responses
-responses = {}
-with ThreadPoolExecutor() as executor:
-    futures = {executor.submit(get_response, name, agent): name for name, agent in agents.items()}
-
-    for future in as_completed(futures):
-        agent_name, response = future.result()
-        responses[agent_name] = response
-
-team_agent = MultidisciplinaryTeam(
-    cardiologist_report=responses["Cardiologist"],
-    psychologist_report=responses["Psychologist"],
-    pulmonologist_report=responses["Pulmonologist"]
-)
-
-# Run the MultidisciplinaryTeam agent to generate the final diagnosis
-final_diagnosis = team_agent.run()
+async def stream_diagnosis(pipeline, medical_report):
+    # Print team tokens as they arrive instead of waiting for the full multi-agent chain
+    team_chunks = []
+    async for event in pipeline.stream(medical_report):
+        if event.role != "MultidisciplinaryTeam":
+            if event.done:
+                print(f"{event.role} report ready.")
+            continue
+        if event.delta:
+            if not team_chunks:
+                print("### Final Diagnosis:\n")
+            team_chunks.append(event.delta)
+            print(event.delta, end="", flush=True)
+    print()
+    return "".join(team_chunks)
+
+
+# Run the specialist agents concurrently, then the MultidisciplinaryTeam agent as soon as
+# the last specialist report lands, to generate the final diagnosis.
+# Re-runs on an unchanged report are served from the on-disk response cache
+cache = ResponseCache(os.path.join("results", "cache", "responses.sqlite"))
+final_diagnosis = asyncio.run(stream_diagnosis(DiagnosisPipeline(cache=cache), medical_report))
+print(f"Response cache: {cache.stats()}")
 final_diagnosis_text = "### Final Diagnosis:\n\n" + final_diagnosis
-print(final_diagnosis_text)
 
 txt_output_path = f"results/final_diagnosis_{datetime.now():%Y%m%d_%H%M%S}.md"
 
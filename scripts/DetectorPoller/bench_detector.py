@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for watch_and_publish.py and serve_latest_image.py.
+
+Writes synthetic detector frames with generate_image.run() into a scratch folder
+watched by both tools, uploads to an in-process upload_server.UploadServer, and
+follows the viewer's /events stream. Every timestamp is taken in this process:
+- appear -> upload:   the file shows up in the folder .. the endpoint has all of it
+- appear -> notified: the file shows up .. the viewer announces it as the latest
+Both include the tools' --debounce, which is usually the largest part.
+
+The publisher must deliver every frame; frames it never delivers are drops. The
+viewer only ever shows the newest stable file, so frames replaced by a newer one
+before they settle are skipped by design; what matters is that the last frame is
+shown, and how quickly.
+
+Run example (200 frames at 20/s, each written in 3 pieces, viewer under uvicorn):
+  python3 bench_detector.py --count 200 --rate 20 --chunks 3 --chunk-delay 0.05 \
+      --viewer asgi --publisher-args "--workers 4 --async"
+"""
+
+from __future__ import annotations
+import argparse
+import http.client
+import json
+import logging
+import math
+import os
+import shlex
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import generate_image
+from upload_server import UploadServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+VIEWERS = {"flask": "serve_latest_image.py", "asgi": "serve_latest_image_asgi.py"}
+PREFIX = "bench"
+
+# ----------------------------- recording ---------------------------------
+
+def frame_id(name: str) -> str:
+    """Frame a file name belongs to: transforms upload e.g. <stem>.png.zst for <stem>.tif."""
+    return os.path.basename(name).split(".", 1)[0]
+
+class Timeline:
+    """When each frame appeared, finished writing, was uploaded, and was announced by the viewer."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.appeared: Dict[str, float] = {}
+        self.written: Dict[str, float] = {}
+        self.uploaded: Dict[str, float] = {}
+        self.notified: Dict[str, float] = {}
+        self.uploads = 0
+        self.last_name: Optional[str] = None
+        self.last_appeared = 0.0
+
+    def on_write(self, name: str, appeared: float, completed: float, nbytes: int) -> None:
+        name = frame_id(name)
+        with self.lock:
+            self.appeared[name] = appeared
+            self.written[name] = completed
+            if appeared >= self.last_appeared:
+                self.last_name, self.last_appeared = name, appeared
+
+    def on_upload(self, name: str) -> None:
+        now = time.monotonic()
+        if ".preview." in name:
+            return  # extra file from a preview transform; the frame itself is what counts
+        with self.lock:
+            self.uploads += 1
+            self.uploaded.setdefault(frame_id(name), now)
+
+    def on_notify(self, name: str) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.notified.setdefault(frame_id(name), now)
+
+class BenchUploadServer(UploadServer):
+    def __init__(self, address, timeline: Timeline, fail_rate: float = 0.0, delay: float = 0.0):
+        super().__init__(address, None, fail_rate, delay)
+        self.timeline = timeline
+
+    def completed(self, name: str, size: int) -> None:
+        self.timeline.on_upload(name)
+        super().completed(name, size)
+
+class EventListener(threading.Thread):
+    """Follows the viewer's /events stream and records each `latest` announcement."""
+    def __init__(self, port: int, timeline: Timeline):
+        super().__init__(daemon=True)
+        self.port = port
+        self.timeline = timeline
+        self.stopping = threading.Event()
+        self.connected = threading.Event()
+        self.conn: Optional[http.client.HTTPConnection] = None
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                # Longer than the viewer's 15 s keepalive, so a quiet stream is not a timeout.
+                self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+                self.conn.request("GET", "/events")
+                resp = self.conn.getresponse()
+                self.connected.set()
+                event = None
+                while not self.stopping.is_set():
+                    line = resp.readline()
+                    if not line:
+                        break
+                    line = line.decode().rstrip("\r\n")
+                    if line.startswith("event:"):
+                        event = line[6:].strip()
+                    elif line.startswith("data:") and event == "latest":
+                        self.timeline.on_notify(json.loads(line[5:])["name"])
+                    elif not line:
+                        event = None
+            except (OSError, http.client.HTTPException, ValueError):
+                if not self.stopping.wait(0.2):
+                    continue
+            finally:
+                if self.conn:
+                    self.conn.close()
+
+    def stop(self):
+        self.stopping.set()
+        sock = self.conn.sock if self.conn else None
+        if sock:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # unblock readline()
+            except OSError:
+                pass
+
+# ----------------------------- processes ---------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_tool(script: str, args: List[str], log_path: str) -> subprocess.Popen:
+    cmd = [sys.executable, os.path.join(HERE, script)] + args
+    logging.info("Starting %s", " ".join(shlex.quote(c) for c in cmd))
+    with open(log_path, "w") as log:
+        return subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=HERE)
+
+def stop_tool(proc: subprocess.Popen, timeout: float = 10.0) -> None:
+    if proc.poll() is not None:
+        return
+    if os.name == "nt":
+        proc.terminate()
+    else:
+        proc.send_signal(signal.SIGINT)  # let it shut down cleanly (queue, watcher threads)
+    try:
+        proc.wait(timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+def wait_http(port: int, path: str, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", path)
+            ok = conn.getresponse().status == 200
+            conn.close()
+            if ok:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+# ----------------------------- report ---------------------------------
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of already sorted `values`."""
+    return values[min(len(values), max(1, math.ceil(q / 100.0 * len(values)))) - 1]
+
+def latency_summary(start: Dict[str, float], end: Dict[str, float]) -> Optional[dict]:
+    values = sorted(end[n] - start[n] for n in end if n in start)
+    if not values:
+        return None
+    return {"n": len(values), "mean": sum(values) / len(values), "p50": percentile(values, 50),
+            "p90": percentile(values, 90), "p99": percentile(values, 99), "max": values[-1]}
+
+def format_latency(label: str, summary: Optional[dict]) -> str:
+    if not summary:
+        return f"  {label:<20} no samples"
+    return (f"  {label:<20} p50 {summary['p50'] * 1000:7.0f} ms   p90 {summary['p90'] * 1000:7.0f} ms   "
+            f"p99 {summary['p99'] * 1000:7.0f} ms   max {summary['max'] * 1000:7.0f} ms")
+
+def build_report(timeline: Timeline, gen: dict, args) -> dict:
+    with timeline.lock:
+        generated = set(timeline.appeared)
+        report = {"generated": {"files": gen["files"], "bytes": gen["bytes"], "seconds": gen["seconds"],
+                                "offered_rate": args.rate, "max_start_lag": gen["max_lag"]}}
+        if args.publisher:
+            uploaded = generated & set(timeline.uploaded)  # frame ids
+            report["publisher"] = {
+                "uploaded": len(uploaded),
+                "dropped": sorted(generated - uploaded),  # not delivered within --settle
+                "settle": args.settle,
+                "duplicates": timeline.uploads - len(timeline.uploaded),
+                "appear_to_upload": latency_summary(timeline.appeared, timeline.uploaded),
+                "written_to_upload": latency_summary(timeline.written, timeline.uploaded),
+            }
+        if args.viewer != "none":
+            notified = generated & set(timeline.notified)
+            report["viewer"] = {
+                "notified": len(notified),
+                "skipped": len(generated - notified),
+                "last_shown": timeline.last_name in notified,
+                "appear_to_notify": latency_summary(timeline.appeared, timeline.notified),
+                "written_to_notify": latency_summary(timeline.written, timeline.notified),
+            }
+    return report
+
+def print_report(report: dict) -> None:
+    gen = report["generated"]
+    print(f"Generated  {gen['files']} files, {gen['bytes'] / 1e6:.1f} MB in {gen['seconds']:.1f}s "
+          f"({gen['files'] / max(gen['seconds'], 1e-9):.1f}/s, offered {gen['offered_rate']}/s, "
+          f"max start lag {gen['max_start_lag'] * 1000:.0f} ms)")
+    pub = report.get("publisher")
+    if pub:
+        print(f"Publisher  uploaded {pub['uploaded']}/{gen['files']}, dropped {len(pub['dropped'])} "
+              f"(not delivered {pub['settle']:g}s after the last write), duplicate uploads {pub['duplicates']}")
+        print(format_latency("appear -> upload", pub["appear_to_upload"]))
+        print(format_latency("written -> upload", pub["written_to_upload"]))
+        for name in pub["dropped"][:10]:
+            print(f"  dropped: {name}")
+    view = report.get("viewer")
+    if view:
+        print(f"Viewer     notified {view['notified']}/{gen['files']} (skipped {view['skipped']} superseded), "
+              f"last frame shown: {'yes' if view['last_shown'] else 'NO'}")
+        print(format_latency("appear -> notified", view["appear_to_notify"]))
+        print(format_latency("written -> notified", view["written_to_notify"]))
+
+# ----------------------------- CLI / main -------------------------------
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="End-to-end latency benchmark for the DetectorPoller tools.")
+    ap.add_argument("--dir", default=None, help="Scratch folder (default: a new temp folder, removed afterwards)")
+    ap.add_argument("--keep", action="store_true", help="Keep the scratch folder and the tools' logs")
+    ap.add_argument("--count", type=int, default=100, help="Frames to write")
+    ap.add_argument("--rate", type=float, default=10.0, help="Frames per second")
+    ap.add_argument("--poisson", action="store_true", help="Random (exponential) gaps with the same mean rate")
+    ap.add_argument("--size", type=generate_image.parse_size, default=(512, 512), help="Frame size, WxH")
+    ap.add_argument("--format", choices=["png", "tif"], default="tif", help="Frame format")
+    ap.add_argument("--depth", type=int, choices=[8, 16], default=16, help="Bits per pixel (16: tif only)")
+    ap.add_argument("--noise", action="store_true", help="Random pixels instead of a flat frame")
+    ap.add_argument("--chunks", type=int, default=1, help="Write each frame in this many pieces")
+    ap.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between pieces")
+    ap.add_argument("--atomic", action="store_true", help="Write to a temp name, then rename into place")
+    ap.add_argument("--writers", type=int, default=4, help="Frames written concurrently when writes overlap")
+    ap.add_argument("--debounce", type=float, default=0.5, help="--debounce for both tools")
+    ap.add_argument("--no-publisher", dest="publisher", action="store_false", help="Do not run watch_and_publish.py")
+    ap.add_argument("--publisher-args", default="", help="Extra watch_and_publish.py arguments, e.g. \"--workers 4\"")
+    ap.add_argument("--viewer", choices=["flask", "asgi", "none"], default="flask", help="Viewer server to run")
+    ap.add_argument("--viewer-args", default="", help="Extra viewer arguments, e.g. \"--tiles\"")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Upload endpoint: fraction of requests dropped")
+    ap.add_argument("--delay", type=float, default=0.0, help="Upload endpoint: seconds added per request")
+    ap.add_argument("--warmup", type=float, default=2.0, help="Seconds to let the tools start before writing")
+    ap.add_argument("--settle", type=float, default=30.0, help="Max seconds to wait for stragglers after writing")
+    ap.add_argument("--json", default=None, help="Also write the results to this JSON file")
+    ap.add_argument("--log-level", default="WARNING", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    args = ap.parse_args(argv)
+    if args.depth == 16 and args.format != "tif":
+        ap.error("--depth 16 needs --format tif")
+    return args
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s: %(message)s")
+    scratch = args.dir or tempfile.mkdtemp(prefix="bench_detector_")
+    frames = os.path.join(scratch, "frames")
+    os.makedirs(frames, exist_ok=True)
+    timeline = Timeline()
+    procs: List[subprocess.Popen] = []
+    server: Optional[BenchUploadServer] = None
+    listener: Optional[EventListener] = None
+    common = ["--dir", frames, "--pattern", f"{PREFIX}_*", "--debounce", str(args.debounce), "--log-level", "WARNING"]
+    try:
+        if args.publisher:
+            server = BenchUploadServer(("127.0.0.1", 0), timeline, args.fail_rate, args.delay)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            endpoint = f"http://127.0.0.1:{server.server_address[1]}/"
+            procs.append(start_tool("watch_and_publish.py",
+                                    common + ["--endpoint", endpoint, "--queue-db", os.path.join(scratch, "queue.sqlite")]
+                                    + shlex.split(args.publisher_args), os.path.join(scratch, "publisher.log")))
+        if args.viewer != "none":
+            port = free_port()
+            procs.append(start_tool(VIEWERS[args.viewer], common + ["--port", str(port)] + shlex.split(args.viewer_args),
+                                    os.path.join(scratch, "viewer.log")))
+            if not wait_http(port, "/history", 20.0):
+                sys.exit(f"Viewer did not start; see {os.path.join(scratch, 'viewer.log')}")
+            listener = EventListener(port, timeline)
+            listener.start()
+            listener.connected.wait(5.0)
+        time.sleep(args.warmup)
+        for proc in procs:
+            if proc.poll() is not None:
+                sys.exit(f"{proc.args[1]} exited early (status {proc.returncode}); logs in {scratch}")
+
+        gen = generate_image.run(frames, args.count, args.rate, args.size, args.format, args.depth, args.noise,
+                                 args.chunks, args.chunk_delay, args.atomic, args.poisson, args.writers,
+                                 prefix=PREFIX, quiet=True, on_write=timeline.on_write)
+
+        # Wait for stragglers: every frame uploaded, and the last frame on the viewer.
+        deadline = time.monotonic() + args.settle
+        while time.monotonic() < deadline:
+            with timeline.lock:
+                uploads_done = not args.publisher or set(timeline.appeared) <= set(timeline.uploaded)
+                viewer_done = args.viewer == "none" or timeline.last_name in timeline.notified
+            if uploads_done and viewer_done:
+                break
+            time.sleep(0.1)
+
+        report = build_report(timeline, gen, args)
+        print_report(report)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        if listener:
+            listener.stop()
+        for proc in procs:
+            stop_tool(proc)
+        if server:
+            server.shutdown()
+            server.server_close()
+        if args.keep or args.dir:
+            print(f"Frames and logs kept in {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
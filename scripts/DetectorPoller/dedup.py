@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Content-hash deduplication for the publish pipeline.
+
+Stable files are hashed (xxh3-128 if xxhash is installed, else blake3, else the
+standard library's blake2b) straight from a memory map. A digest that was already
+published to the same endpoint is skipped, so re-touched files and detectors that
+rewrite identical frames do not cost another upload. Recent digests live in an
+in-memory LRU in front of the `digests` table of the publish queue database, which
+keeps the history across restarts.
+"""
+
+from __future__ import annotations
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from publish_queue import PublishQueue
+
+try:
+    import xxhash
+    HASH_NAME = "xxh3_128"
+    def _new_hasher():
+        return xxhash.xxh3_128()
+except Exception:
+    try:
+        import blake3
+        HASH_NAME = "blake3"
+        def _new_hasher():
+            return blake3.blake3()
+    except Exception:
+        HASH_NAME = "blake2b"
+        def _new_hasher():
+            return hashlib.blake2b(digest_size=16)
+
+def file_digest(path: str, block: int = 4 * 1024 * 1024) -> str:
+    """Streaming content hash of a file, read through mmap in `block` sized slices."""
+    hasher = _new_hasher()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for start in range(0, size, block):
+                        hasher.update(view[start:start + block])
+                finally:
+                    view.release()
+    return f"{HASH_NAME}:{hasher.hexdigest()}"
+
+class Deduplicator:
+    """
+    Decides whether a file's content still needs publishing to `scope` (the endpoint).
+    claim() reserves a digest so concurrent workers do not upload the same content
+    twice; commit() records it as published, release() gives it back after a failure.
+    A copy claimed while its content is still uploading waits on that upload (its queue
+    row stays claimed): commit() marks it skipped, release() returns it to pending.
+    """
+    def __init__(self, publish_queue: PublishQueue, scope: str, capacity: int = 10000):
+        self.queue = publish_queue
+        self.scope = scope
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._in_flight: Set[str] = set()
+        self._waiting: Dict[str, List[int]] = {}  # digest -> queue ids of copies waiting on its upload
+        self.hits = 0
+
+    def _seen(self, digest: str) -> bool:
+        # Called with the lock held.
+        if digest in self._recent:
+            self._recent.move_to_end(digest)
+            return True
+        if self.queue.has_digest(self.scope, digest):
+            self._remember(digest)
+            return True
+        return False
+
+    def _remember(self, digest: str) -> None:
+        self._recent[digest] = None
+        self._recent.move_to_end(digest)
+        while len(self._recent) > self.capacity:
+            self._recent.popitem(last=False)
+
+    def claim(self, path: str, item_id: int) -> Tuple[Optional[str], Optional[bool]]:
+        """
+        Hash `path` (queue row `item_id`). Returns (digest, True) if it should be uploaded,
+        (digest, False) if that content was already published, and (digest, None) if it is
+        being uploaded right now: the row is then settled by that upload's commit()/release().
+        """
+        digest = file_digest(path)
+        with self._lock:
+            if self._seen(digest):
+                self.hits += 1
+                return digest, False
+            if digest in self._in_flight:
+                self._waiting.setdefault(digest, []).append(item_id)
+                return digest, None
+            self._in_flight.add(digest)
+        return digest, True
+
+    def commit(self, digest: str, path: str, size: int) -> None:
+        self.queue.add_digest(self.scope, digest, path, size)
+        with self._lock:
+            self._in_flight.discard(digest)
+            self._remember(digest)
+            waiting = self._waiting.pop(digest, [])
+            self.hits += len(waiting)
+        for item_id in waiting:
+            self.queue.mark_skipped(item_id, f"duplicate content {digest}")
+
+    def release(self, digest: str) -> None:
+        with self._lock:
+            self._in_flight.discard(digest)
+            waiting = self._waiting.pop(digest, [])
+        for item_id in waiting:
+            self.queue.release(item_id)  # re-hashed when claimed again; one of them uploads
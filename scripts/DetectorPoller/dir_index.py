@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Incremental index of the files in a watched folder, ordered by mtime.
+
+Replaces a full os.scandir() per event / poll tick: the index is fed from watchdog
+events (update/remove) and only rescanned by reconcile(), so "latest file" lookups are
+O(log n) no matter how many images the detector folder holds.
+"""
+
+from __future__ import annotations
+import fnmatch
+import heapq
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+def is_match(name: str, patterns: List[str]) -> bool:
+    if not patterns:
+        return True
+    return any(fnmatch.fnmatch(name, p) for p in patterns)
+
+class DirectoryIndex:
+    """
+    path -> (mtime, size) plus a max-heap on mtime with lazy deletion: stale heap
+    entries (file removed or re-stamped) are discarded when they reach the top.
+    With `recursive`, files in sub-folders (not hidden ones) are indexed too; note the
+    cheap maybe_reconcile() check only sees the top folder's mtime, so new files deep
+    in the tree are picked up by the periodic full rescan.
+    """
+    def __init__(self, root: str, patterns: List[str], recursive: bool = False):
+        self.root = root
+        self.patterns = patterns
+        self.recursive = recursive
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[float, int]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._dir_mtime: Optional[float] = None
+        self._last_reconcile = 0.0
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def accepts(self, path: str) -> bool:
+        name = os.path.basename(path)
+        if name.startswith(".") or not is_match(name, self.patterns):
+            return False
+        parent = os.path.dirname(os.path.abspath(path))
+        root = os.path.abspath(self.root)
+        if self.recursive:
+            return parent == root or parent.startswith(root + os.sep)
+        return parent == root
+
+    def update(self, path: str) -> bool:
+        """Refresh one file from disk. Returns True if the index changed."""
+        if not self.accepts(path):
+            return False
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return self.remove(path)
+        with self._lock:
+            if self._entries.get(path) == (st.st_mtime, st.st_size):
+                return False
+            self._entries[path] = (st.st_mtime, st.st_size)
+            heapq.heappush(self._heap, (-st.st_mtime, path))
+            self._maybe_compact()
+            return True
+
+    def remove(self, path: str) -> bool:
+        with self._lock:
+            return self._entries.pop(path, None) is not None
+
+    def stat(self, path: str) -> Optional[Tuple[float, int]]:
+        with self._lock:
+            return self._entries.get(path)
+
+    def latest(self) -> Optional[str]:
+        with self._lock:
+            while self._heap:
+                neg_mtime, path = self._heap[0]
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == -neg_mtime:
+                    return path
+                heapq.heappop(self._heap)
+            return None
+
+    def _maybe_compact(self) -> None:
+        # Called with the lock held; bounds heap growth from repeated updates of the same files.
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(-mtime, p) for p, (mtime, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+
+    def reconcile(self) -> Set[str]:
+        """Full rescan to catch missed events. Returns the paths that were added, changed or removed."""
+        fresh: Dict[str, Tuple[float, int]] = {}
+        try:
+            self._dir_mtime = os.stat(self.root).st_mtime
+        except FileNotFoundError:
+            pass
+        pending = [self.root]
+        while pending:
+            try:
+                entries = list(os.scandir(pending.pop()))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if self.recursive and entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                if not entry.is_file() or not is_match(entry.name, self.patterns):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                fresh[entry.path] = (st.st_mtime, st.st_size)
+        with self._lock:
+            changed = {p for p, v in fresh.items() if self._entries.get(p) != v}
+            changed.update(p for p in self._entries if p not in fresh)
+            self._entries = fresh
+            self._heap = [(-mtime, p) for p, (mtime, _) in fresh.items()]
+            heapq.heapify(self._heap)
+            self._last_reconcile = time.monotonic()
+        return changed
+
+    def maybe_reconcile(self, interval: float) -> Set[str]:
+        """
+        Cheap poll: rescan only if the folder's own mtime changed (files added, removed
+        or renamed) or `interval` seconds passed since the last full rescan (catches
+        in-place rewrites, which do not touch the folder mtime).
+        """
+        try:
+            dir_mtime = os.stat(self.root).st_mtime
+        except FileNotFoundError:
+            return set()
+        if dir_mtime != self._dir_mtime or time.monotonic() - self._last_reconcile >= interval:
+            return self.reconcile()
+        return set()
@@ -1,47 +1,171 @@
 #!/usr/bin/env python3
 """
 Test image generator: writes images to a folder for testing serve_latest_image.py
+and watch_and_publish.py.
+
+Besides the default one-image-every-2-seconds loop it works as a load generator:
+--rate/--count/--poisson set the offered load, --size/--depth/--noise the file size,
+and --chunks/--chunk-delay write each file in pieces with pauses in between, like a
+detector streaming a frame to disk, to exercise the watchers' debounce. --atomic
+writes to a hidden temporary name and renames it into place instead.
+bench_detector.py drives run() in-process to measure end-to-end latency.
+
+Run example (50 frames of 2048x2048 16-bit TIFF at 5/s, each written in 4 pieces):
+  python3 generate_image.py --dir /tmp/det --format tif --depth 16 --size 2048x2048 \
+      --rate 5 --count 50 --chunks 4 --chunk-delay 0.05
 """
 
+import io
 import os
+import random
+import threading
 import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Optional, Tuple
 from PIL import Image, ImageDraw, ImageFont
-import random
 
 def generate_image(path: str, size=(512, 512)):
     """生成一张随机颜色 + 时间戳的图片"""
-    img = Image.new("RGB", size, (random.randint(0,255), random.randint(0,255), random.randint(0,255)))
-    draw = ImageDraw.Draw(img)
-    text = time.strftime("%Y-%m-%d %H:%M:%S")
-    try:
-        font = ImageFont.load_default()
-    except:
-        font = None
-    draw.text((10,10), text, fill=(255,255,255), font=font)
-    img.save(path)
+    fmt = os.path.splitext(path)[1].lstrip(".").lower() or "png"
+    write_file(path, render_image(size, fmt))
     print(f"Generated: {path}")
 
+@lru_cache(maxsize=4)
+def _noise(size: Tuple[int, int]):
+    # Generating noise costs more than encoding; frames share one field and differ by their label.
+    return Image.effect_noise(size, 64)
+
+def render_image(size=(512, 512), fmt: str = "png", depth: int = 8, noise: bool = False, label: str = "") -> bytes:
+    """Encoded image: random colour (or noise) with a timestamp, so every frame has distinct content."""
+    text = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {label}".strip()
+    if depth == 16:
+        # 16-bit greyscale, like most detectors; drawn in mode I, stored as I;16
+        base = _noise(size) if noise else Image.new("L", size, random.randint(0, 255))
+        img = base.convert("I").point(lambda v: v * 256)
+        ImageDraw.Draw(img).text((10, 10), text, fill=65535)
+        img = img.convert("I;16")
+    else:
+        img = Image.new("RGB", size, (random.randint(0,255), random.randint(0,255), random.randint(0,255)))
+        if noise:
+            img = Image.merge("RGB", [_noise(size), _noise(size).transpose(Image.Transpose.ROTATE_180), _noise(size)])
+        draw = ImageDraw.Draw(img)
+        try:
+            font = ImageFont.load_default()
+        except:
+            font = None
+        draw.text((10,10), text, fill=(255,255,255), font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="TIFF" if fmt == "tif" else fmt.upper())
+    return buf.getvalue()
+
+def write_file(path: str, data: bytes, chunks: int = 1, chunk_delay: float = 0.0, atomic: bool = False) -> float:
+    """
+    Write `data` to `path` in `chunks` pieces with `chunk_delay` seconds between them.
+    Returns the time.monotonic() at which `path` appeared in the folder.
+    """
+    target = path
+    if atomic:
+        path = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".part")
+    step = -(-len(data) // max(1, chunks))
+    with open(path, "wb") as f:
+        appeared = time.monotonic()
+        for i, start in enumerate(range(0, len(data), step)):
+            if i and chunk_delay:
+                f.flush()
+                time.sleep(chunk_delay)
+            f.write(data[start:start + step])
+    if atomic:
+        os.replace(path, target)
+        appeared = time.monotonic()
+    return appeared
+
+# on_write(name, appeared, completed, nbytes), times from time.monotonic()
+WriteCallback = Callable[[str, float, float, int], None]
+
+def run(directory: str, count: int = 0, rate: float = 0.5, size: Tuple[int, int] = (512, 512), fmt: str = "png",
+        depth: int = 8, noise: bool = False, chunks: int = 1, chunk_delay: float = 0.0, atomic: bool = False,
+        poisson: bool = False, writers: int = 4, prefix: str = "img", quiet: bool = False,
+        on_write: Optional[WriteCallback] = None, stop: Optional[threading.Event] = None) -> dict:
+    """
+    Write `count` images (0: until `stop` is set) at `rate` per second. Start times follow
+    a fixed schedule (exponential gaps with `poisson`), so slow or chunked writes overlap on
+    up to `writers` threads instead of lowering the offered rate. Returns a summary.
+    """
+    os.makedirs(directory, exist_ok=True)
+    stop = stop or threading.Event()
+    stats = {"files": 0, "bytes": 0, "max_lag": 0.0}
+    lock = threading.Lock()
+
+    def write_one(counter: int, due: float) -> None:
+        lag = time.monotonic() - due  # > 0 when all writers were busy: the offered rate is not met
+        name = f"{prefix}_{time.strftime('%Y%m%d_%H%M%S')}_{counter:05d}.{fmt}"
+        data = render_image(size, fmt, depth, noise, label=f"#{counter}")
+        appeared = write_file(os.path.join(directory, name), data, chunks, chunk_delay, atomic)
+        completed = time.monotonic()
+        with lock:
+            stats["files"] += 1
+            stats["bytes"] += len(data)
+            stats["max_lag"] = max(stats["max_lag"], lag)
+        if on_write:
+            on_write(name, appeared, completed, len(data))
+        if not quiet:
+            print(f"Generated: {os.path.join(directory, name)}")
+
+    started = due = time.monotonic()
+    counter = 0
+    with ThreadPoolExecutor(max_workers=writers, thread_name_prefix="writer") as pool:
+        while not stop.is_set() and (not count or counter < count):
+            delay = due - time.monotonic()
+            if delay > 0 and stop.wait(delay):
+                break
+            pool.submit(write_one, counter, due)
+            counter += 1
+            due += random.expovariate(rate) if poisson else 1.0 / rate
+    stats["seconds"] = time.monotonic() - started
+    return stats
+
+def parse_size(text: str) -> Tuple[int, int]:
+    w, _, h = text.lower().partition("x")
+    return int(w), int(h or w)
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--dir", default=r"D:\debug\test", help="Folder to save images")
     parser.add_argument("--interval", type=float, default=2.0, help="Seconds between images")
+    parser.add_argument("--rate", type=float, default=0.0, help="Images per second (overrides --interval)")
+    parser.add_argument("--count", type=int, default=0, help="Stop after this many images (0: run until Ctrl+C)")
+    parser.add_argument("--poisson", action="store_true", help="Random (exponential) gaps with the same mean rate")
     parser.add_argument("--format", choices=["png","tif"], default="png", help="Image format")
+    parser.add_argument("--size", type=parse_size, default=(512, 512), help="Image size, WxH (default 512x512)")
+    parser.add_argument("--depth", type=int, choices=[8, 16], default=8, help="Bits per pixel (16: greyscale, tif only)")
+    parser.add_argument("--noise", action="store_true", help="Random pixels, so PNGs do not compress to nothing")
+    parser.add_argument("--chunks", type=int, default=1, help="Write each file in this many pieces")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between pieces")
+    parser.add_argument("--atomic", action="store_true", help="Write to a hidden temp name, then rename into place")
+    parser.add_argument("--writers", type=int, default=4, help="Files written concurrently when writes overlap")
+    parser.add_argument("--quiet", action="store_true", help="Only print the summary")
     args = parser.parse_args()
+    if args.depth == 16 and args.format != "tif":
+        parser.error("--depth 16 needs --format tif")
 
-    os.makedirs(args.dir, exist_ok=True)
-
-    counter = 0
+    stop = threading.Event()
     try:
-        while True:
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            filename = f"img_{timestamp}_{counter:03d}.{args.format}"
-            path = os.path.join(args.dir, filename)
-            generate_image(path)
-            counter += 1
-            time.sleep(args.interval)
+        stats = {}
+        thread = threading.Thread(target=lambda: stats.update(run(
+            args.dir, args.count, args.rate or 1.0 / args.interval, args.size, args.format, args.depth, args.noise,
+            args.chunks, args.chunk_delay, args.atomic, args.poisson, args.writers, quiet=args.quiet, stop=stop)))
+        thread.start()
+        while thread.is_alive():
+            thread.join(0.5)
     except KeyboardInterrupt:
+        stop.set()
+        thread.join()
         print("Stopped.")
+    if stats:
+        print(f"Wrote {stats['files']} files ({stats['bytes'] / 1e6:.1f} MB) in {stats['seconds']:.1f}s, "
+              f"{stats['files'] / max(stats['seconds'], 1e-9):.2f}/s; max start lag {stats['max_lag'] * 1000:.0f} ms")
 
 if __name__ == "__main__":
     main()
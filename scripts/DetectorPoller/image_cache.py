@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Bytes-bounded LRU cache for converted image renditions.
+
+Keys identify one rendition of one file version, e.g. (path, mtime, size, "png").
+Entries are evicted least-recently-used first once the total payload exceeds
+`max_bytes`. get_or_create() is single-flight: concurrent requests for a rendition
+that is still being converted wait for that conversion instead of starting their own.
+"""
+
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+class ImageCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._pending: Dict[Hashable, threading.Event] = {}
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: Hashable, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return  # would evict everything else and still not fit
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get_or_create(self, key: Hashable, create: Callable[[], bytes]) -> bytes:
+        while True:
+            with self._lock:
+                data = self._entries.get(key)
+                if data is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                waiter = self._pending.get(key)
+                if waiter is None:
+                    self.misses += 1
+                    done = self._pending[key] = threading.Event()
+                    break
+            # Someone else is converting this rendition; wait, then re-check.
+            waiter.wait()
+        try:
+            data = create()
+            self.put(key, data)
+            return data
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+            done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Watcher, shared state and image conversion behind the latest-image viewers.
+
+serve_latest_image.py (Flask) and serve_latest_image_asgi.py (Starlette/uvicorn)
+are thin web layers over this module: it tracks the newest stable file in a folder,
+keeps the recent-image history, caches converted renditions and holds the viewer page.
+Settings below that are upper-case module globals are set once by setup().
+"""
+
+from __future__ import annotations
+import argparse
+import io
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Deque, List, Optional, Tuple
+
+# Pillow for TIFF->PNG conversion, thumbnails and tiles; pyramid fails to import without it
+try:
+    from pyramid import TilePyramid, make_thumbnail, open_image
+    PIL_AVAILABLE = True
+except Exception:
+    PIL_AVAILABLE = False
+
+# Watchdog for event-driven file watching
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler, FileSystemEvent
+    WATCHDOG_AVAILABLE = True
+except Exception:
+    WATCHDOG_AVAILABLE = False
+    FileSystemEventHandler = object  # so Handler can be defined; it is only used with watchdog
+
+from dir_index import DirectoryIndex
+from image_cache import ImageCache
+from stability import StabilityTracker
+
+WEB_FRIENDLY_EXT = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+
+# ----------------------------- utilities ---------------------------------
+
+def is_web_friendly(path: str) -> bool:
+    ext = os.path.splitext(path)[1].lower()
+    return ext in WEB_FRIENDLY_EXT
+
+def format_time(ts: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+def make_etag(mtime: float, size: int) -> str:
+    return f'"{int(mtime * 1000):x}-{size:x}"'
+
+# ----------------------------- shared state ---------------------------------
+
+@dataclass
+class Latest:
+    path: Optional[str] = None
+    mtime: float = 0.0
+    size: int = 0
+    version: int = 0  # bumped on every change; SSE event id and history id
+
+    @property
+    def etag(self) -> str:
+        return make_etag(self.mtime, self.size)
+
+@dataclass
+class HistoryEntry:
+    id: int  # the LATEST.version this file was published as
+    path: str
+    mtime: float
+    size: int
+
+    @property
+    def etag(self) -> str:
+        return make_etag(self.mtime, self.size)
+
+STATE_LOCK = threading.Lock()
+LATEST = Latest()
+# Notified (under STATE_LOCK) whenever LATEST changes; /events streams wait on it.
+LATEST_CHANGED = threading.Condition(STATE_LOCK)
+SSE_KEEPALIVE = 15.0
+# The last N published images, oldest first (resized from --history in setup)
+HISTORY: Deque[HistoryEntry] = deque(maxlen=50)
+# Called (outside STATE_LOCK, on the tracker thread) after every LATEST change,
+# for web layers that cannot wait on LATEST_CHANGED, e.g. an asyncio event loop.
+LATEST_LISTENERS: List[Callable[[], None]] = []
+
+class Unavailable(Exception):
+    """The requested image cannot be served; `status` is the HTTP status to answer with."""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def latest_info() -> Optional[dict]:
+    """JSON-able description of LATEST. Call with STATE_LOCK held."""
+    if not LATEST.path:
+        return None
+    return {
+        "id": LATEST.version,
+        "name": os.path.basename(LATEST.path),
+        "size": LATEST.size,
+        "mtime_str": format_time(LATEST.mtime),
+        "version": LATEST.etag.strip('"'),
+    }
+
+def history_info(entry: HistoryEntry) -> dict:
+    return {
+        "id": entry.id,
+        "name": os.path.basename(entry.path),
+        "size": entry.size,
+        "mtime_str": format_time(entry.mtime),
+        "version": entry.etag.strip('"'),
+        "image_url": f"/image/{entry.id}",
+        "thumb_url": f"/thumb/{entry.id}" if PIL_AVAILABLE else f"/image/{entry.id}",
+        "download_url": f"/download/{entry.id}",
+    }
+
+# Converted renditions, LRU by total bytes (resized from --cache-mb in setup)
+IMAGE_CACHE = ImageCache()
+# Background conversion of each new latest file, so /image is served from cache
+CONVERT_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="convert")
+# Optional process pool for the PIL work itself; None converts in the calling thread
+CONVERTER: Optional[Executor] = None
+# Serve and decode files through memory maps (off with --no-mmap, see mapped_io.py).
+# Passed to conversions explicitly: CONVERTER workers do not see this module's settings.
+MMAP_ENABLED = True
+
+def render(fn: Callable[..., bytes], *args) -> bytes:
+    """Run a module-level conversion function, in CONVERTER if one is set."""
+    if CONVERTER is None:
+        return fn(*args)
+    return CONVERTER.submit(fn, *args).result()
+
+def convert_image(path: str, fmt: str = "PNG", mapped: bool = True) -> bytes:
+    with open_image(path, mapped=mapped) as img:
+        if img.mode not in ("RGB", "RGBA", "L"):
+            img = img.convert("RGB")
+        buf = io.BytesIO()
+        img.save(buf, format=fmt)
+    return buf.getvalue()
+
+def get_cached_image(path: str, mtime: float, size: int) -> bytes:
+    """Return PNG bytes of this version of the image, converting it only once."""
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"Cannot access {path}")
+    return IMAGE_CACHE.get_or_create((path, mtime, size, "png"), lambda: render(convert_image, path, "PNG", MMAP_ENABLED))
+
+# Downscaled preview size and (optional) tile pyramid, set from the command line.
+# The pyramid keeps its downsampled levels in memory, so tiles are always cut in-process.
+THUMB_SIZE = 1024
+TILES_ENABLED = False
+PYRAMID_LOCK = threading.Lock()
+PYRAMID: Optional[Tuple[tuple, "TilePyramid"]] = None  # (version key, pyramid) of the latest image only
+
+def get_thumbnail(path: str, mtime: float, size: int) -> bytes:
+    return IMAGE_CACHE.get_or_create((path, mtime, size, f"thumb{THUMB_SIZE}"),
+                                     lambda: render(make_thumbnail, path, THUMB_SIZE, MMAP_ENABLED))
+
+def get_pyramid(path: str, mtime: float, size: int) -> "TilePyramid":
+    global PYRAMID
+    key = (path, mtime, size)
+    with PYRAMID_LOCK:
+        if PYRAMID is None or PYRAMID[0] != key:
+            PYRAMID = (key, TilePyramid(path, mapped=MMAP_ENABLED))
+        return PYRAMID[1]
+
+def get_tile(path: str, mtime: float, size: int, level: int, x: int, y: int) -> bytes:
+    return IMAGE_CACHE.get_or_create((path, mtime, size, f"tile/{level}/{x}/{y}"),
+                                     lambda: get_pyramid(path, mtime, size).tile(level, x, y))
+
+def preconvert(path: str, mtime: float, size: int) -> None:
+    """Background work for a new latest file: PNG rendition, thumbnail, and the pyramid's overview levels."""
+    try:
+        started = time.perf_counter()
+        get_thumbnail(path, mtime, size)
+        if not is_web_friendly(path):
+            get_cached_image(path, mtime, size)
+        if TILES_ENABLED:
+            pyramid = get_pyramid(path, mtime, size)
+            for level in range(pyramid.max_level + 1):
+                cols, rows = pyramid.grid(level)
+                if cols * rows > 16:
+                    break
+                for x in range(cols):
+                    for y in range(rows):
+                        get_tile(path, mtime, size, level, x, y)
+        logging.debug("Prepared %s in %.2fs", os.path.basename(path), time.perf_counter() - started)
+    except Exception as e:
+        logging.warning("Background conversion of %s failed: %s", path, e)
+
+def publish_latest(index: DirectoryIndex, path: str, size: int, mtime: float) -> None:
+    """Stability callback: make `path` the served image if it is still the newest file."""
+    if index.latest() != path:
+        return
+    with STATE_LOCK:
+        if LATEST.path == path and LATEST.mtime == mtime:
+            return
+        LATEST.path = path
+        LATEST.mtime = mtime
+        LATEST.size = size
+        LATEST.version += 1
+        # A rewritten file name supersedes its older entries, which could no longer be served.
+        for old in [e for e in HISTORY if e.path == path]:
+            HISTORY.remove(old)
+        HISTORY.append(HistoryEntry(LATEST.version, path, mtime, size))
+        LATEST_CHANGED.notify_all()
+    for listener in LATEST_LISTENERS:
+        listener()
+    logging.info("Latest -> %s (%.0f bytes, %s)", os.path.basename(path), size, format_time(mtime))
+    if PIL_AVAILABLE:
+        CONVERT_POOL.submit(preconvert, path, mtime, size)
+
+def update_latest(index: DirectoryIndex, tracker: StabilityTracker) -> None:
+    """Hand the newest indexed file to the stability tracker; returns immediately."""
+    p = index.latest()
+    if not p:
+        return
+    known = index.stat(p)
+    with STATE_LOCK:
+        if LATEST.path == p and known and LATEST.mtime == known[0]:
+            return
+    tracker.watch(p, partial(publish_latest, index))
+
+# ----------------------------- Watcher ---------------------------------
+
+class Handler(FileSystemEventHandler):
+    def __init__(self, index: DirectoryIndex, tracker: StabilityTracker):
+        super().__init__()
+        self.index = index
+        self.tracker = tracker
+
+    def on_any_event(self, event: FileSystemEvent):
+        if event.is_directory:
+            return
+        if event.event_type == "closed":
+            # inotify IN_CLOSE_WRITE: the writer is done, no need to wait out the full debounce.
+            self.tracker.notify_closed(event.src_path)
+            return
+        # Keep the index current from the event itself; no directory rescan needed.
+        if event.event_type == "deleted":
+            changed = self.index.remove(event.src_path)
+        elif event.event_type == "moved":
+            changed = self.index.remove(event.src_path)
+            changed = self.index.update(event.dest_path) or changed
+        elif event.event_type in ("created", "modified"):
+            changed = self.index.update(event.src_path)
+        else:
+            return
+        if changed:
+            update_latest(self.index, self.tracker)
+
+class Watcher:
+    def __init__(self, index: DirectoryIndex, debounce, poll_interval=0.0, reconcile_interval=60.0):
+        self.index = index
+        self.directory = index.root
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.reconcile_interval = reconcile_interval
+        self.tracker = StabilityTracker(debounce)
+        self.stop_event = threading.Event()
+        self.observer: Optional[Observer] = None
+        self.poll_thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self.tracker.start()
+        if WATCHDOG_AVAILABLE:
+            self.observer = Observer()
+            self.observer.schedule(Handler(self.index, self.tracker), self.directory, recursive=False)
+            self.observer.start()
+            logging.info("Watching %s (event-driven)", self.directory)
+        else:
+            logging.warning("watchdog not available; falling back to polling.")
+            self.poll_interval = self.poll_interval or 1.0
+        if self.poll_interval > 0 or WATCHDOG_AVAILABLE:
+            # Polling fallback, or (with watchdog) a slow periodic reconcile to catch missed events.
+            self.poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
+            self.poll_thread.start()
+            if self.poll_interval > 0:
+                logging.info("Polling %s every %.2fs", self.directory, self.poll_interval)
+
+    def _poll_loop(self):
+        interval = self.poll_interval if self.poll_interval > 0 else self.reconcile_interval
+        while not self.stop_event.wait(interval):
+            if self.index.maybe_reconcile(self.reconcile_interval):
+                update_latest(self.index, self.tracker)
+
+    def stop(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join(timeout=5)
+        if self.poll_thread:
+            self.stop_event.set()
+            self.poll_thread.join(timeout=5)
+        self.tracker.stop()
+
+# ----------------------------- lookups ---------------------------------
+
+def current_latest() -> Tuple[str, float, int, str]:
+    """(path, mtime, size, etag) of the latest image; Unavailable(404) if there is none."""
+    with STATE_LOCK:
+        p, mtime, size, etag = LATEST.path, LATEST.mtime, LATEST.size, LATEST.etag
+    if not p or not os.path.isfile(p):
+        raise Unavailable(404, "No image available")
+    return p, mtime, size, etag
+
+def history_entry(entry_id: Optional[int]) -> Tuple[str, float, int, str]:
+    """
+    Like current_latest() for history entry `entry_id` (the latest image if None).
+    404 if the entry has left the ring buffer, 410 if its file was since removed or rewritten.
+    """
+    if entry_id is None:
+        return current_latest()
+    with STATE_LOCK:
+        entry = next((e for e in HISTORY if e.id == entry_id), None)
+    if entry is None:
+        raise Unavailable(404, "Not in history")
+    try:
+        st = os.stat(entry.path)
+    except OSError:
+        raise Unavailable(410, "File was removed")
+    if st.st_mtime != entry.mtime or st.st_size != entry.size:
+        raise Unavailable(410, "File was rewritten")
+    return entry.path, entry.mtime, entry.size, entry.etag
+
+def history_page(since: int = 0) -> dict:
+    """/history body: entries newer than `since`, newest first."""
+    with STATE_LOCK:
+        items = [history_info(e) for e in reversed(HISTORY) if e.id > since]
+        return {"latest": LATEST.version, "capacity": HISTORY.maxlen, "items": items}
+
+def preview_url() -> str:
+    # Browsers show the image scaled to the page anyway; a thumbnail is a fraction of the bytes.
+    return "/thumb" if PIL_AVAILABLE else "/image"
+
+# ----------------------------- viewer page ---------------------------------
+
+INDEX_HTML = """
+<!doctype html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Latest Image</title>
+<style>
+body { font-family: system-ui, sans-serif; margin:1.2rem; }
+img { max-width: 100%; height:auto; display:block; }
+.meta { color:#555; font-size:0.95rem; margin-bottom:0.8rem; }
+.bar { display:flex; gap:1rem; align-items:center; margin-bottom:0.5rem }
+button { padding:0.35rem 0.7rem; }
+code { background:#f2f2f2; padding:0.15rem 0.35rem; border-radius:6px; }
+#status { font-size:0.85rem; color:#888; }
+#scrub { flex:1; max-width:40rem; }
+</style>
+</head>
+<body>
+<h1>Latest Image</h1>
+<div class="meta">
+  <div id="empty" {% if latest %}hidden{% endif %}>No image found yet.</div>
+  <div id="details" {% if not latest %}hidden{% endif %}>
+    <div>File: <code id="name">{{ latest.name if latest }}</code></div>
+    <div>Size: <span id="size">{{ latest.size if latest }}</span> bytes</div>
+    <div>Modified: <span id="mtime">{{ latest.mtime_str if latest }}</span></div>
+  </div>
+</div>
+<div class="bar">
+  <button onclick="location.reload()">Refresh</button>
+  <a id="full" href="/image" target="_blank" {% if not latest %}hidden{% endif %}>Full resolution</a>
+  <a id="download" href="/download" {% if not latest %}hidden{% endif %}>Download original</a>
+  <span id="status">connecting...</span>
+</div>
+<div class="bar" id="historybar" hidden>
+  <input type="range" id="scrub" min="0" max="0" value="0">
+  <button id="live" disabled>Live</button>
+</div>
+
+<img id="preview" alt="Latest image preview" {% if latest %}src="{{ preview_url }}?v={{ latest.version }}"{% else %}hidden{% endif %}>
+
+<script>
+// The server pushes a `latest` event only when the image changes, so the image is
+// fetched once per change instead of once per viewer per polling interval.
+let current = {{ ((preview_url ~ "?v=" ~ latest.version) if latest else "") | tojson }};
+const previewUrl = {{ preview_url | tojson }};
+function show(info, urls) {
+  document.getElementById('name').textContent = info.name;
+  document.getElementById('size').textContent = info.size;
+  document.getElementById('mtime').textContent = info.mtime_str;
+  document.getElementById('full').href = urls.image;
+  document.getElementById('download').href = urls.download;
+  for (const id of ['details', 'full', 'download', 'preview']) document.getElementById(id).hidden = false;
+  document.getElementById('empty').hidden = true;
+  if (urls.preview !== current) {
+    current = urls.preview;
+    document.getElementById('preview').src = urls.preview;
+  }
+}
+function showLatest(info) {
+  show(info, {image: '/image', download: '/download',
+              preview: previewUrl + '?v=' + encodeURIComponent(info.version)});
+}
+
+// History scrubbing: the slider walks /history (oldest left); the right end follows live.
+let history = [];
+let live = true;
+let latestInfo = null;
+const scrub = document.getElementById('scrub');
+const liveButton = document.getElementById('live');
+async function loadHistory() {
+  const since = history.length ? history[history.length - 1].id : 0;
+  const resp = await fetch('/history?since=' + since);
+  const data = await resp.json();
+  history = history.concat(data.items.reverse()).slice(-data.capacity);
+  scrub.max = Math.max(0, history.length - 1);
+  if (live) scrub.value = scrub.max;
+  document.getElementById('historybar').hidden = history.length < 2;
+}
+function setLive(on) {
+  live = on;
+  liveButton.disabled = on;
+  if (on) {
+    scrub.value = scrub.max;
+    if (latestInfo) showLatest(latestInfo);
+  }
+}
+scrub.addEventListener('input', () => {
+  const entry = history[scrub.value];
+  if (Number(scrub.value) === history.length - 1) return setLive(true);
+  setLive(false);
+  show(entry, {image: entry.image_url, download: entry.download_url, preview: entry.thumb_url});
+});
+liveButton.addEventListener('click', () => setLive(true));
+
+const status = document.getElementById('status');
+const events = new EventSource('/events');
+events.addEventListener('latest', (e) => {
+  latestInfo = JSON.parse(e.data);
+  if (live) showLatest(latestInfo);
+  loadHistory();
+});
+events.onopen = () => { status.textContent = 'live'; };
+events.onerror = () => { status.textContent = 'reconnecting...'; };
+</script>
+</body>
+</html>
+"""
+
+# ----------------------------- CLI ---------------------------------
+
+def build_parser(description: str) -> argparse.ArgumentParser:
+    """Options shared by both servers; each adds its own before parsing."""
+    ap = argparse.ArgumentParser(description=description)
+    ap.add_argument("--dir", default=r"D:\debug\test", help="Folder to monitor.")
+    ap.add_argument("--pattern", action="append", default=[], help="Glob pattern(s), e.g. --pattern '*.tif'")
+    ap.add_argument("--debounce", type=float, default=1.5, help="Seconds file must remain unchanged before use")
+    ap.add_argument("--poll-interval", type=float, default=0.0, help="Enable polling fallback at this interval (seconds)")
+    ap.add_argument("--reconcile-interval", type=float, default=60.0,
+                    help="Full folder rescan at least this often (seconds) to catch missed events")
+    ap.add_argument("--cache-mb", type=float, default=256.0, help="Memory for converted images (MiB)")
+    ap.add_argument("--thumb-size", type=int, default=1024, help="Longest side of /thumb previews (pixels)")
+    ap.add_argument("--history", type=int, default=50,
+                    help="Recent images kept for /history and /image/<id> (their previews share --cache-mb)")
+    ap.add_argument("--tiles", action="store_true", help="Serve a DeepZoom tile pyramid at /tiles.dzi and /tiles/<z>/<x>/<y>")
+    ap.add_argument("--no-mmap", action="store_true",
+                    help="Read files instead of memory-mapping them (for detectors that rewrite files in place)")
+    ap.add_argument("--host", default="127.0.0.1", help="Web server host")
+    ap.add_argument("--port", type=int, default=8080, help="Web server port")
+    ap.add_argument("--log-level", default="INFO", choices=["DEBUG","INFO","WARNING","ERROR"], help="Logging level")
+    return ap
+
+def setup(args) -> Watcher:
+    """Configure logging and the module settings from `args`; returns an unstarted Watcher."""
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s: %(message)s")
+
+    directory = os.path.abspath(args.dir)
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.isdir(directory):
+        logging.error("Directory does not exist: %s", directory)
+        sys.exit(2)
+    patterns = args.pattern or []
+    IMAGE_CACHE.max_bytes = int(args.cache_mb * 1024 * 1024)
+    global THUMB_SIZE, TILES_ENABLED, HISTORY, MMAP_ENABLED
+    THUMB_SIZE = args.thumb_size
+    TILES_ENABLED = args.tiles
+    MMAP_ENABLED = not args.no_mmap
+    HISTORY = deque(maxlen=max(1, args.history))
+
+    # Init index; the watcher's tracker picks the latest file once it is stable
+    index = DirectoryIndex(directory, patterns)
+    index.reconcile()
+    return Watcher(index, args.debounce, args.poll_interval, args.reconcile_interval)
+
+def run(watcher: Watcher, serve: Callable[[], None]) -> None:
+    """Start `watcher`, publish the current latest file, and block in `serve` until it returns."""
+    watcher.start()
+    update_latest(watcher.index, watcher.tracker)
+    try:
+        serve()
+    finally:
+        watcher.stop()
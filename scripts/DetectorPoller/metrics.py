@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Minimal Prometheus-style metrics: labelled counters and gauges rendered in the text
+exposition format, optionally served on /metrics from a background thread. Standard
+library only, so the watcher scripts do not need prometheus_client.
+"""
+
+from __future__ import annotations
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _escape(value: str) -> str:
+    # Label values are quoted strings: backslash, quote and newline must be escaped
+    # (route labels default to folder paths, which on Windows are full of backslashes).
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values: Dict[str, Dict[LabelKey, float]] = {}
+        self._types: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        with self._lock:
+            self._types[name] = kind
+            self._help[name] = text
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._values.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+            self._types.setdefault(name, "counter")
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self._values.setdefault(name, {})[key] = value
+            self._types.setdefault(name, "gauge")
+
+    def get(self, name: str, **labels: str) -> float:
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            return self._values.get(name, {}).get(key, 0.0)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name in sorted(self._values):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._types.get(name, 'untyped')}")
+                for key, value in sorted(self._values[name].items()):
+                    labels = ",".join(f'{k}="{_escape(v)}"' for k, v in key)
+                    shown = int(value) if float(value).is_integer() else round(value, 6)
+                    lines.append(f"{name}{{{labels}}} {shown}" if labels else f"{name} {shown}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, host: str, port: int) -> ThreadingHTTPServer:
+        """Expose render() on http://host:port/metrics from a daemon thread."""
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), _Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logging.info("Metrics on http://%s:%d/metrics", host, port)
+        return server
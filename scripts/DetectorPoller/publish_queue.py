@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Durable, ordered publish queue backed by SQLite.
+
+Every stable file is recorded once (keyed by path + mtime + size) and moves through
+pending -> uploading -> done / failed (or skipped, when dedup finds the same content
+was already published). A second table keeps the digests of published content. Because the queue lives on disk, files seen
+before a crash or restart are still delivered, and uploads interrupted mid-flight
+are put back to pending by recover().
+"""
+
+from __future__ import annotations
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Collection, Dict, Optional
+
+PENDING = "pending"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+@dataclass
+class QueueItem:
+    id: int
+    path: str
+    mtime: float
+    size: int
+    attempts: int
+    route: str = ""
+
+class PublishQueue:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        parent = os.path.dirname(db_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " path TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL,"
+            " state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " enqueued REAL NOT NULL, updated REAL NOT NULL, error TEXT,"
+            " UNIQUE (path, mtime, size))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(files)")}
+        if "route" not in columns:
+            # Queues created before multi-directory routing.
+            self._conn.execute("ALTER TABLE files ADD COLUMN route TEXT NOT NULL DEFAULT ''")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_state ON files (state, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            " scope TEXT NOT NULL, digest TEXT NOT NULL, path TEXT NOT NULL, size INTEGER NOT NULL,"
+            " published REAL NOT NULL, PRIMARY KEY (scope, digest))"
+        )
+        self._conn.commit()
+
+    def recover(self, retry_failed: bool = False) -> int:
+        """Put uploads interrupted by a crash (and optionally failed ones) back to pending."""
+        states = (UPLOADING, FAILED) if retry_failed else (UPLOADING,)
+        with self._lock:
+            cur = self._conn.execute(
+                f"UPDATE files SET state = ?, updated = ? WHERE state IN ({','.join('?' * len(states))})",
+                (PENDING, time.time(), *states))
+            self._conn.commit()
+            if cur.rowcount:
+                self._available.notify_all()
+            return cur.rowcount
+
+    def enqueue(self, path: str, mtime: float, size: int, route: str = "") -> bool:
+        """Record a stable file. Returns False if this exact version was already queued."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO files (path, mtime, size, state, enqueued, updated, route)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, mtime, size, PENDING, now, now, route))
+            self._conn.commit()
+            if cur.rowcount:
+                self._available.notify()
+            return cur.rowcount > 0
+
+    def claim(self, timeout: float = 0.5, exclude: Collection[str] = ()) -> Optional[QueueItem]:
+        """
+        Take the oldest pending file and mark it uploading; waits up to `timeout` for one.
+        Files of the routes in `exclude` (e.g. ones at their concurrency limit) are passed over.
+        """
+        deadline = time.monotonic() + timeout
+        query = "SELECT id, path, mtime, size, attempts, route FROM files WHERE state = ?"
+        if exclude:
+            query += f" AND route NOT IN ({','.join('?' * len(exclude))})"
+        query += " ORDER BY id LIMIT 1"
+        with self._lock:
+            while True:
+                row = self._conn.execute(query, (PENDING, *exclude)).fetchone()
+                if row:
+                    self._conn.execute(
+                        "UPDATE files SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                        (UPLOADING, time.time(), row[0]))
+                    self._conn.commit()
+                    return QueueItem(row[0], row[1], row[2], row[3], row[4] + 1, row[5])
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._available.wait(remaining)
+
+    def wait(self, timeout: float) -> None:
+        """Block until something is enqueued or released, or `timeout` passes."""
+        with self._lock:
+            self._available.wait(timeout)
+
+    def notify(self) -> None:
+        """Wake waiting workers, e.g. when a route drops below its concurrency limit."""
+        with self._lock:
+            self._available.notify_all()
+
+    def _set_state(self, item_id: int, state: str, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute("UPDATE files SET state = ?, error = ?, updated = ? WHERE id = ?",
+                               (state, error, time.time(), item_id))
+            self._conn.commit()
+            if state == PENDING:
+                self._available.notify()
+
+    def mark_done(self, item_id: int) -> None:
+        self._set_state(item_id, DONE)
+
+    def mark_failed(self, item_id: int, error: str) -> None:
+        self._set_state(item_id, FAILED, error)
+
+    def mark_skipped(self, item_id: int, reason: str) -> None:
+        self._set_state(item_id, SKIPPED, reason)
+
+    def release(self, item_id: int) -> None:
+        """Return a claimed item to pending (e.g. on shutdown) without counting it as failed."""
+        self._set_state(item_id, PENDING)
+
+    def has_digest(self, scope: str, digest: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM digests WHERE scope = ? AND digest = ?", (scope, digest)).fetchone()
+        return row is not None
+
+    def add_digest(self, scope: str, digest: str, path: str, size: int) -> None:
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO digests (scope, digest, path, size, published) VALUES (?, ?, ?, ?, ?)",
+                               (scope, digest, path, size, time.time()))
+            self._conn.commit()
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Thumbnails and DeepZoom-style tile pyramids for large detector images (needs Pillow).
+
+Level `max_level` is the full-resolution image and every level below halves it, down
+to a 1x1 level 0 (the DeepZoom layout, so OpenSeadragon and similar viewers can use
+it). The downsampled levels are built once per image version; tiles are cut and
+encoded on request, so a viewer only pays for the tiles it actually looks at.
+
+With tifffile (and numpy) installed, uncompressed TIFFs are decoded from a memory map
+(see open_image) rather than read strip by strip through Pillow, and 16-bit frames are
+stretched to 8 bits a band of rows at a time instead of through a float copy of the frame.
+"""
+
+from __future__ import annotations
+import io
+import math
+from typing import Dict, Tuple
+
+from PIL import Image
+
+try:
+    import numpy as np
+    import tifffile
+    TIFFFILE_AVAILABLE = True
+except Exception:
+    TIFFFILE_AVAILABLE = False
+
+from transforms import to_8bit
+
+TILE_SIZE = 256
+TIFF_EXT = (".tif", ".tiff")
+BAND_ROWS = 256
+
+def _stretch_to_8bit(data):
+    """to_8bit() for a (mapped) greyscale array, working through it in bands of rows."""
+    bands = range(0, data.shape[0], BAND_ROWS)
+    lo = min(data[i:i + BAND_ROWS].min() for i in bands)
+    hi = max(data[i:i + BAND_ROWS].max() for i in bands)
+    scale = 255.0 / (float(hi) - float(lo)) if hi > lo else 0.0
+    out = np.empty(data.shape, np.uint8)
+    for i in bands:
+        out[i:i + BAND_ROWS] = (data[i:i + BAND_ROWS].astype(np.float32) - float(lo)) * scale
+    return out
+
+def open_image(path: str, max_side: int = 0, mapped: bool = True, eight_bit: bool = False):
+    """
+    Pillow image of `path`. With `mapped` and tifffile available, an uncompressed TIFF is
+    wrapped around a memory map of its pixel data instead of being decoded into a copy;
+    with `max_side`, only every n-th row and column is read, so a preview of a huge frame
+    pages in a fraction of the file. `eight_bit` stretches mapped greyscale frames to mode L
+    like to_8bit() does. Anything tifffile cannot map goes through Image.open().
+    """
+    if mapped and TIFFFILE_AVAILABLE and path.lower().endswith(TIFF_EXT):
+        try:
+            data = tifffile.memmap(path, mode="r")
+        except Exception:  # compressed, tiled or otherwise not one contiguous block
+            data = None
+        if data is not None and data.ndim in (2, 3):
+            if max_side:
+                # Keep twice the target size so thumbnail() still has something to filter.
+                step = max(1, max(data.shape[:2]) // (2 * max_side))
+                data = np.ascontiguousarray(data[::step, ::step])
+            if eight_bit and data.ndim == 2 and data.dtype != np.uint8:
+                return Image.fromarray(_stretch_to_8bit(data))
+            try:
+                return Image.fromarray(data)
+            except TypeError:  # no Pillow mode for this dtype/shape
+                pass
+    return Image.open(path)
+
+def encode(img, fmt: str = "JPEG", quality: int = 85) -> bytes:
+    buf = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buf, format=fmt, quality=quality)
+    else:
+        img.save(buf, format=fmt)
+    return buf.getvalue()
+
+def make_thumbnail(path: str, max_side: int, mapped: bool = True) -> bytes:
+    """JPEG preview with the longest side at most `max_side`."""
+    with open_image(path, max_side, mapped, eight_bit=True) as img:
+        img.draft("RGB", (max_side, max_side))
+        img = to_8bit(img)
+        img.thumbnail((max_side, max_side))
+        return encode(img)
+
+class TilePyramid:
+    def __init__(self, path: str, tile_size: int = TILE_SIZE, mapped: bool = True):
+        self.tile_size = tile_size
+        with open_image(path, mapped=mapped, eight_bit=True) as img:
+            level_img = to_8bit(img)
+            if level_img is img:
+                # 8-bit images come back as `img` itself: lazy, or backed by the file's mapping,
+                # which must not outlive this call (the file may be rewritten later).
+                level_img = img.copy()
+        self.width, self.height = level_img.size
+        self.max_level = math.ceil(math.log2(max(self.width, self.height, 1)))
+        self._levels: Dict[int, Image.Image] = {}
+        for level in range(self.max_level, -1, -1):
+            self._levels[level] = level_img
+            if level:
+                level_img = level_img.reduce(2)  # box filter, ceil(w / 2) x ceil(h / 2)
+
+    def level_size(self, level: int) -> Tuple[int, int]:
+        return self._levels[level].size
+
+    def grid(self, level: int) -> Tuple[int, int]:
+        w, h = self.level_size(level)
+        return math.ceil(w / self.tile_size), math.ceil(h / self.tile_size)
+
+    def tile(self, level: int, x: int, y: int) -> bytes:
+        """JPEG bytes of one tile; KeyError if it is outside the pyramid."""
+        if level not in self._levels:
+            raise KeyError(f"no level {level}")
+        cols, rows = self.grid(level)
+        if not (0 <= x < cols and 0 <= y < rows):
+            raise KeyError(f"no tile {x},{y} at level {level}")
+        img = self._levels[level]
+        ts = self.tile_size
+        box = (x * ts, y * ts, min((x + 1) * ts, img.width), min((y + 1) * ts, img.height))
+        return encode(img.crop(box))
+
+    def dzi(self) -> str:
+        return ('<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{self.tile_size}" '
+                f'Overlap="0" Format="jpg"><Size Width="{self.width}" Height="{self.height}"/></Image>\n')
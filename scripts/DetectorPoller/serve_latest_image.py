@@ -4,379 +4,185 @@ Serve the latest image from a folder via web server with automatic refresh.
 
 Run example:
   python3 serve_latest_image.py --dir /data/outgoing --pattern "*.tif" --host 0.0.0.0 --port 8080
+
+This is the Flask version (threaded dev server); serve_latest_image_asgi.py serves
+the same viewer under uvicorn for many concurrent viewers. Watching, state and
+conversion live in latest_state.py.
 """
 
 from __future__ import annotations
-import argparse
-import fnmatch
-import io
+import json
 import logging
 import mimetypes
-import os
-import sys
-import threading
-import time
-from dataclasses import dataclass
-from typing import Optional, List, Tuple
-
-# Pillow for TIFF->PNG conversion
-try:
-    from PIL import Image
-    PIL_AVAILABLE = True
-except Exception:
-    PIL_AVAILABLE = False
+from typing import Optional
 
-# Watchdog for event-driven file watching
-try:
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler, FileSystemEvent
-    WATCHDOG_AVAILABLE = True
-except Exception:
-    WATCHDOG_AVAILABLE = False
+from flask import Flask, Response, abort, make_response, render_template_string, send_file, request
 
-from flask import Flask, abort, make_response, render_template_string, send_file, request
+import latest_state as state
+from latest_state import LATEST, LATEST_CHANGED, STATE_LOCK, is_web_friendly, latest_info
+from mapped_io import MappedFileWrapper
 
 app = Flask(__name__)
 
-WEB_FRIENDLY_EXT = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
-
-# ----------------------------- utilities ---------------------------------
-
-def is_match(name: str, patterns: List[str]) -> bool:
-    if not patterns:
-        return True
-    return any(fnmatch.fnmatch(name, p) for p in patterns)
-
-def latest_file(root: str, patterns: List[str]) -> Optional[str]:
-    latest_path = None
-    latest_mtime = -1.0
-    try:
-        for entry in os.scandir(root):
-            if not entry.is_file():
-                continue
-            if entry.name.startswith("."):
-                continue
-            if not is_match(entry.name, patterns):
-                continue
-            try:
-                st = entry.stat()
-            except FileNotFoundError:
-                continue
-            if st.st_mtime > latest_mtime:
-                latest_mtime = st.st_mtime
-                latest_path = entry.path
-    except FileNotFoundError:
-        return None
-    return latest_path
-
-def file_is_stable(path: str, stable_for: float, check_every: float = 0.4) -> bool:
-    """Return True if size/mtime unchanged for stable_for seconds."""
-    end_time = None
-    last: Optional[Tuple[int, float]] = None
-    while True:
-        try:
-            st = os.stat(path)
-        except FileNotFoundError:
-            return False
-        cur = (st.st_size, st.st_mtime)
-        if cur == last:
-            if end_time is None:
-                end_time = time.time() + stable_for
-            if time.time() >= end_time:
-                return True
-        else:
-            last = cur
-            end_time = None
-        time.sleep(check_every)
-
-def is_web_friendly(path: str) -> bool:
-    ext = os.path.splitext(path)[1].lower()
-    return ext in WEB_FRIENDLY_EXT
-
-def format_time(ts: float) -> str:
-    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
-
-# ----------------------------- shared state ---------------------------------
-
-@dataclass
-class Latest:
-    path: Optional[str] = None
-    mtime: float = 0.0
-    size: int = 0
-
-STATE_LOCK = threading.Lock()
-LATEST = Latest()
-
-# Simple cache for converted images
-IMAGE_CACHE = {}
-
-def get_cached_image(path: str) -> bytes:
-    """Return PNG bytes of the image, using cache if available."""
-    try:
-        mtime = os.path.getmtime(path)
-    except Exception:
-        raise FileNotFoundError(f"Cannot access {path}")
-
-    key = (path, mtime)
-    if key in IMAGE_CACHE:
-        return IMAGE_CACHE[key]
-
-    img = Image.open(path)
-    if img.mode not in ("RGB", "RGBA", "L"):
-        img = img.convert("RGB")
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    buf.seek(0)
-    IMAGE_CACHE.clear()  # Keep only latest
-    IMAGE_CACHE[key] = buf.getvalue()
-    return IMAGE_CACHE[key]
-
-def update_latest_from_dir(directory: str, patterns: List[str], debounce: float) -> None:
-    p = latest_file(directory, patterns)
-    if not p or not os.path.isfile(p):
-        return
-    if not file_is_stable(p, debounce):
-        return
-    try:
-        st = os.stat(p)
-    except FileNotFoundError:
-        return
-    with STATE_LOCK:
-        LATEST.path = p
-        LATEST.mtime = st.st_mtime
-        LATEST.size = st.st_size
-    logging.info("Latest -> %s (%.0f bytes, %s)", os.path.basename(p), st.st_size,
-                 format_time(st.st_mtime))
-
-# ----------------------------- Watcher ---------------------------------
-
-class Handler(FileSystemEventHandler):
-    def __init__(self, directory: str, patterns: List[str], debounce: float):
-        super().__init__()
-        self.directory = directory
-        self.patterns = patterns
-        self.debounce = debounce
-        self._trigger_lock = threading.Lock()
-        self._last_trigger = 0.0
-
-    def on_any_event(self, event: FileSystemEvent):
-        if event.is_directory:
-            return
-        name = os.path.basename(event.src_path)
-        if name.startswith("."):
-            return
-        if not is_match(name, self.patterns):
-            return
-        now = time.time()
-        with self._trigger_lock:
-            if now - self._last_trigger < 0.3:
-                return
-            self._last_trigger = now
-        threading.Thread(target=update_latest_from_dir,
-                         args=(self.directory, self.patterns, self.debounce),
-                         daemon=True).start()
-
-class Watcher:
-    def __init__(self, directory, patterns, debounce, poll_interval=0.0):
-        self.directory = directory
-        self.patterns = patterns
-        self.debounce = debounce
-        self.poll_interval = poll_interval
-        self.stop_event = threading.Event()
-        self.observer: Optional[Observer] = None
-        self.poll_thread: Optional[threading.Thread] = None
-
-    def start(self):
-        if WATCHDOG_AVAILABLE:
-            self.observer = Observer()
-            self.observer.schedule(Handler(self.directory, self.patterns, self.debounce),
-                                   self.directory, recursive=False)
-            self.observer.start()
-            logging.info("Watching %s (event-driven)", self.directory)
-        if self.poll_interval > 0:
-            self.poll_thread = threading.Thread(target=self._poll_loop, daemon=True)
-            self.poll_thread.start()
-            logging.info("Polling %s every %.2fs", self.directory, self.poll_interval)
-
-    def _poll_loop(self):
-        last_seen = None
-        last_mtime = -1.0
-        while not self.stop_event.is_set():
-            p = latest_file(self.directory, self.patterns)
-            if p:
-                try:
-                    m = os.stat(p).st_mtime
-                except FileNotFoundError:
-                    m = -1
-                if p != last_seen or m > last_mtime:
-                    last_seen, last_mtime = p, m
-                    update_latest_from_dir(self.directory, self.patterns, self.debounce)
-            self.stop_event.wait(self.poll_interval)
-
-    def stop(self):
-        if self.observer:
-            self.observer.stop()
-            self.observer.join(timeout=5)
-        if self.poll_thread:
-            self.stop_event.set()
-            self.poll_thread.join(timeout=5)
-
 # ----------------------------- Web App ---------------------------------
 
-INDEX_HTML = """
-<!doctype html>
-<html>
-<head>
-<meta charset="utf-8">
-<title>Latest Image</title>
-<style>
-body { font-family: system-ui, sans-serif; margin:1.2rem; }
-img { max-width: 100%; height:auto; display:block; }
-.meta { color:#555; font-size:0.95rem; margin-bottom:0.8rem; }
-.bar { display:flex; gap:1rem; align-items:center; margin-bottom:0.5rem }
-button { padding:0.35rem 0.7rem; }
-code { background:#f2f2f2; padding:0.15rem 0.35rem; border-radius:6px; }
-</style>
-</head>
-<body>
-<h1>Latest Image</h1>
-<div class="meta">
-{% if latest %}
-  <div>File: <code>{{ latest.name }}</code></div>
-  <div>Size: {{ latest.size }} bytes</div>
-  <div>Modified: {{ latest.mtime_str }}</div>
-{% else %}
-  <div>No image found yet.</div>
-{% endif %}
-</div>
-<div class="bar">
-  <button onclick="forceRefresh()">Refresh</button>
-  <label>Auto-refresh
-    <select id="interval" onchange="setIntervalFromSelect()">
-      <option value="0">Off</option>
-      <option value="1">1s</option>
-      <option value="3" selected>3s</option>
-      <option value="5">5s</option>
-      <option value="10">10s</option>
-    </select>
-  </label>
-  {% if latest %}
-  <a href="/download">Download original</a>
-  {% endif %}
-</div>
+@app.before_request
+def use_mapped_files():
+    # send_file streams through the server's wsgi.file_wrapper: sendfile under gunicorn.
+    # The dev server has none and would read 8 KiB at a time; serve from a mapping instead.
+    if state.MMAP_ENABLED:
+        request.environ.setdefault("wsgi.file_wrapper", MappedFileWrapper)
 
-{% if latest %}
-<img id="preview" src="/image?v={{ latest.version }}" alt="Latest image preview">
-{% endif %}
-
-<script>
-let timer = null;
-function refreshImage() {
-  const img = document.getElementById('preview');
-  if (!img) return;
-  const u = new URL(img.src, window.location);
-  u.searchParams.set('v', Date.now().toString());
-  img.src = u.toString();
-}
-function forceRefresh() { refreshImage(); }
-function setIntervalFromSelect() {
-  const sel = document.getElementById('interval');
-  const s = parseInt(sel.value, 10);
-  if (timer) { clearInterval(timer); timer = null; }
-  if (s > 0) { timer = setInterval(refreshImage, s*1000); }
-}
-setIntervalFromSelect();
-</script>
-</body>
-</html>
-"""
+@app.errorhandler(state.Unavailable)
+def unavailable(e: state.Unavailable):
+    return e.message, e.status
 
 @app.route("/")
 def index():
     with STATE_LOCK:
-        if not LATEST.path:
-            latest = None
-        else:
-            latest = {
-                "name": os.path.basename(LATEST.path),
-                "size": LATEST.size,
-                "mtime_str": format_time(LATEST.mtime),
-                "version": int(LATEST.mtime),
-            }
-    return render_template_string(INDEX_HTML, latest=latest)
+        latest = latest_info()
+    return render_template_string(state.INDEX_HTML, latest=latest, preview_url=state.preview_url())
+
+@app.route("/events")
+def events():
+    """
+    Server-Sent Events: one `latest` event with the current state on connect, then one
+    per change. Viewers fetch /image only when told to, instead of polling it.
+    """
+    def stream():
+        seen = -1
+        yield "retry: 3000\n\n"
+        while True:
+            with LATEST_CHANGED:
+                LATEST_CHANGED.wait_for(lambda: LATEST.version != seen, timeout=state.SSE_KEEPALIVE)
+                changed = LATEST.version != seen
+                seen = LATEST.version
+                info = latest_info()
+            if changed and info:
+                yield f"id: {seen}\nevent: latest\ndata: {json.dumps(info)}\n\n"
+            else:
+                yield ": keepalive\n\n"
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def not_modified(etag: str):
+    """304 response if the client already has `etag`, else None."""
+    if etag.strip('"') not in request.if_none_match:
+        return None
+    resp = make_response("", 304)
+    resp.headers["ETag"] = etag
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def image_response(data: bytes, mimetype: str, etag: str):
+    resp = make_response(data)
+    resp.headers["Content-Type"] = mimetype
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["ETag"] = etag
+    return resp
+
+@app.route("/history")
+def history():
+    """Recent images, newest first. ?since=<id> returns only entries newer than `id`."""
+    return state.history_page(request.args.get("since", default=0, type=int))
 
 @app.route("/image")
-def image():
-    with STATE_LOCK:
-        p = LATEST.path
-        mtime = LATEST.mtime
-    if not p or not os.path.isfile(p):
-        abort(404, "No image available")
+@app.route("/image/<int:entry_id>")
+def image(entry_id: Optional[int] = None):
+    p, mtime, size, etag = state.history_entry(entry_id)
+    # Browsers revalidate with If-None-Match; unchanged images cost a 304, not a transfer.
+    cached = not_modified(etag)
+    if cached:
+        return cached
 
     if is_web_friendly(p):
         guessed = mimetypes.guess_type(p)[0] or "application/octet-stream"
-        resp = make_response(send_file(p, mimetype=guessed, as_attachment=False, conditional=True))
+        resp = make_response(send_file(p, mimetype=guessed, as_attachment=False, conditional=True, etag=False))
     else:
-        if not PIL_AVAILABLE:
+        if not state.PIL_AVAILABLE:
             resp = send_file(p, as_attachment=False)
         else:
             try:
-                data = get_cached_image(p)
+                data = state.get_cached_image(p, mtime, size)
                 resp = make_response(data)
                 resp.headers["Content-Type"] = "image/png"
             except Exception as e:
                 logging.warning("Conversion failed: %s", e)
                 resp = send_file(p, as_attachment=False)
 
-    # Disable caching
-    resp.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    resp.headers["Pragma"] = "no-cache"
-    resp.headers["Expires"] = "0"
-    resp.headers["ETag"] = f"W/{int(mtime)}"
+    # Cacheable, but always revalidated against the current file
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["ETag"] = etag
     return resp
 
 @app.route("/download")
-def download():
-    with STATE_LOCK:
-        p = LATEST.path
-    if not p or not os.path.isfile(p):
-        abort(404, "No file available")
+@app.route("/download/<int:entry_id>")
+def download(entry_id: Optional[int] = None):
+    p = state.history_entry(entry_id)[0]
     return send_file(p, as_attachment=True)
 
+@app.route("/thumb")
+@app.route("/thumb/<int:entry_id>")
+def thumb(entry_id: Optional[int] = None):
+    """Downscaled JPEG preview (--thumb-size) of the latest image or a history entry."""
+    if not state.PIL_AVAILABLE:
+        abort(501, "Pillow is required for thumbnails")
+    p, mtime, size, etag = state.history_entry(entry_id)
+    etag = f'{etag[:-1]}-t{state.THUMB_SIZE}"'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    return image_response(state.get_thumbnail(p, mtime, size), "image/jpeg", etag)
+
+@app.route("/tiles.dzi")
+def tiles_descriptor():
+    """DeepZoom descriptor of the latest image; tiles are at /tiles/<level>/<x>/<y>."""
+    if not (state.PIL_AVAILABLE and state.TILES_ENABLED):
+        abort(404, "Tiles are disabled (start with --tiles)")
+    p, mtime, size, etag = state.current_latest()
+    resp = make_response(state.get_pyramid(p, mtime, size).dzi())
+    resp.headers["Content-Type"] = "application/xml"
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["ETag"] = etag
+    return resp
+
+@app.route("/tiles/<int:level>/<int:x>/<int:y>")
+def tile(level: int, x: int, y: int):
+    """
+    One 256px JPEG tile of the latest image. Viewers should pass ?v=<version> (from
+    /events); a stale version gets 409 so the viewer reloads instead of mixing images.
+    """
+    if not (state.PIL_AVAILABLE and state.TILES_ENABLED):
+        abort(404, "Tiles are disabled (start with --tiles)")
+    p, mtime, size, etag = state.current_latest()
+    wanted = request.args.get("v")
+    if wanted and wanted != etag.strip('"'):
+        abort(409, "Latest image changed")
+    etag = f'{etag[:-1]}-{level}-{x}-{y}"'
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    try:
+        data = state.get_tile(p, mtime, size, level, x, y)
+    except KeyError:
+        abort(404, "No such tile")
+    return image_response(data, "image/jpeg", etag)
+
 # ----------------------------- CLI / main -------------------------------
 
 def parse_args(argv=None):
-    ap = argparse.ArgumentParser(description="Serve latest image from folder via web server")
-    ap.add_argument("--dir", default=r"D:\debug\test", help="Folder to monitor.")
-    ap.add_argument("--pattern", action="append", default=[], help="Glob pattern(s), e.g. --pattern '*.tif'")
-    ap.add_argument("--debounce", type=float, default=1.5, help="Seconds file must remain unchanged before use")
-    ap.add_argument("--poll-interval", type=float, default=0.0, help="Enable polling fallback at this interval (seconds)")
-    ap.add_argument("--host", default="127.0.0.1", help="Web server host")
-    ap.add_argument("--port", type=int, default=8080, help="Web server port")
-    ap.add_argument("--log-level", default="INFO", choices=["DEBUG","INFO","WARNING","ERROR"], help="Logging level")
-    return ap.parse_args(argv)
+    return state.build_parser("Serve latest image from folder via web server").parse_args(argv)
 
 def main():
     args = parse_args()
-    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s: %(message)s")
-
-    directory = os.path.abspath(args.dir)
-    os.makedirs(directory, exist_ok=True)
-    if not os.path.isdir(directory):
-        logging.error("Directory does not exist: %s", directory)
-        sys.exit(2)
-    patterns = args.pattern or []
+    watcher = state.setup(args)
 
-    # Init latest
-    update_latest_from_dir(directory, patterns, args.debounce)
-
-    watcher = Watcher(directory, patterns, args.debounce, args.poll_interval)
-    watcher.start()
-    try:
+    def serve():
         logging.info("Serving on http://%s:%d", args.host, args.port)
         app.run(host=args.host, port=args.port, threaded=True)
-    finally:
-        watcher.stop()
+
+    state.run(watcher, serve)
 
 if __name__ == "__main__":
     main()
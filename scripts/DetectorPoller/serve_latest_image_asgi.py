@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Serve the latest image from a folder as an ASGI app (Starlette under uvicorn).
+
+Run example:
+  python3 serve_latest_image_asgi.py --dir /data/outgoing --pattern "*.tif" --host 0.0.0.0 --port 8080
+
+Same viewer, routes and options as serve_latest_image.py (both sit on latest_state.py),
+built for many concurrent viewers:
+- /events streams are coroutines on one event loop instead of a thread each;
+- Pillow conversions and thumbnails run in a process pool (--convert-processes), so
+  decoding a large TIFF neither holds the GIL nor ties up request threads;
+- raw files go out zero-copy on servers that implement the ASGI pathsend extension,
+  otherwise as memoryview slices of a memory map (mapped_io.MappedFile) rather than
+  FileResponse's 64 KiB reads in worker threads;
+- /metrics reports per-route requests, in-flight requests (open SSE streams are
+  the /events series), bytes sent and time spent, plus image cache usage.
+Needs starlette, uvicorn and jinja2 (pip install starlette uvicorn jinja2).
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import mimetypes
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+from urllib.parse import quote
+
+import uvicorn
+from jinja2 import Environment
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.exceptions import HTTPException
+from starlette.requests import Request
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import latest_state as state
+from latest_state import LATEST, STATE_LOCK, is_web_friendly, latest_info
+from mapped_io import MappedFile
+from metrics import Metrics
+
+METRICS = Metrics()
+METRICS.describe("viewer_requests_total", "counter", "HTTP requests handled, by route and status")
+METRICS.describe("viewer_requests_in_flight", "gauge", "HTTP requests in progress (route=/events: open SSE streams)")
+METRICS.describe("viewer_response_bytes_total", "counter", "Response body bytes sent, by route")
+METRICS.describe("viewer_request_seconds_total", "counter", "Time spent in requests, by route")
+METRICS.describe("viewer_image_cache_bytes", "gauge", "Bytes held by the converted image cache")
+METRICS.describe("viewer_image_cache_hits_total", "counter", "Converted image cache hits")
+METRICS.describe("viewer_image_cache_misses_total", "counter", "Converted image cache misses (conversions)")
+
+PAGE = Environment(autoescape=True).from_string(state.INDEX_HTML)
+
+# ----------------------------- change notification ---------------------------------
+
+class ChangeNotifier:
+    """Wakes /events coroutines when LATEST changes; registered in state.LATEST_LISTENERS."""
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.changed = asyncio.Event()
+        self.closing = False  # set on shutdown; streams end instead of waiting for the next change
+
+    def __call__(self) -> None:
+        # Runs on the tracker thread; hop onto the event loop.
+        self.loop.call_soon_threadsafe(self._fire)
+
+    def close(self) -> None:
+        self.closing = True
+        self.loop.call_soon_threadsafe(self._fire)
+
+    def _fire(self) -> None:
+        # Waiters hold the old event; later waiters get a fresh one.
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+NOTIFIER: Optional[ChangeNotifier] = None
+
+@asynccontextmanager
+async def lifespan(app):
+    global NOTIFIER
+    NOTIFIER = ChangeNotifier(asyncio.get_running_loop())
+    state.LATEST_LISTENERS.append(NOTIFIER)
+    try:
+        yield
+    finally:
+        state.LATEST_LISTENERS.remove(NOTIFIER)
+
+# ----------------------------- connection metrics ---------------------------------
+
+class ConnectionMetrics:
+    """ASGI middleware feeding the viewer_* series in METRICS."""
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+        declared = sent = 0
+        started = time.perf_counter()
+        # The route is only known once the router has run; in flight, tell SSE streams apart.
+        in_flight_route = "/events" if scope["path"] == "/events" else "other"
+        self.metrics.inc("viewer_requests_in_flight", 1, route=in_flight_route)
+
+        async def counting_send(message):
+            nonlocal status, declared, sent
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                for name, value in message.get("headers", ()):
+                    if name.lower() == b"content-length":
+                        declared = int(value)
+            elif message["type"] == "http.response.body":
+                sent += len(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, counting_send)
+        finally:
+            # Label by the matched route template (set by the router), so label values stay bounded.
+            route = getattr(scope.get("route"), "path", "other")
+            self.metrics.inc("viewer_requests_in_flight", -1, route=in_flight_route)
+            self.metrics.inc("viewer_requests_total", route=route, status=str(status))
+            # pathsend responses carry no body messages; count their Content-Length instead.
+            self.metrics.inc("viewer_response_bytes_total", sent or declared, route=route)
+            self.metrics.inc("viewer_request_seconds_total", time.perf_counter() - started, route=route)
+
+# ----------------------------- Web App ---------------------------------
+
+async def unavailable(request: Request, e: state.Unavailable):
+    return PlainTextResponse(e.message, e.status)
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """304 response if the client already has `etag`, else None."""
+    wanted = {t.strip().removeprefix("W/").strip('"') for t in request.headers.get("if-none-match", "").split(",")}
+    if etag.strip('"') not in wanted and "*" not in wanted:
+        return None
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+def image_response(data: bytes, mimetype: str, etag: str) -> Response:
+    return Response(data, media_type=mimetype, headers={"Cache-Control": "no-cache", "ETag": etag})
+
+def file_response(request: Request, path: str, etag: str, download: bool = False) -> Response:
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    headers = {"Cache-Control": "no-cache", "ETag": etag}
+    pathsend = "http.response.pathsend" in request.scope.get("extensions", {})
+    if pathsend or not state.MMAP_ENABLED or "range" in request.headers:
+        # FileResponse handles Range requests and hands pathsend files to the server.
+        return FileResponse(path, media_type=mimetype, filename=os.path.basename(path) if download else None,
+                            headers=headers)
+    body = MappedFile(path)
+    headers["Content-Length"] = str(body.size)
+    headers["Accept-Ranges"] = "bytes"
+    if download:
+        headers["Content-Disposition"] = f"attachment; filename*=utf-8''{quote(os.path.basename(path))}"
+    return StreamingResponse(body, media_type=mimetype, headers=headers)
+
+async def index(request: Request):
+    with STATE_LOCK:
+        latest = latest_info()
+    return HTMLResponse(PAGE.render(latest=latest, preview_url=state.preview_url()))
+
+async def events(request: Request):
+    """Server-Sent Events, as in serve_latest_image.events(), one coroutine per viewer."""
+    async def stream():
+        seen = -1
+        yield "retry: 3000\n\n"
+        while not NOTIFIER.closing:
+            # Take the event before reading the version, so a change in between still wakes us.
+            changed = NOTIFIER.changed
+            with STATE_LOCK:
+                version = LATEST.version
+                info = latest_info()
+            if version != seen:
+                seen = version
+                if info:
+                    yield f"id: {seen}\nevent: latest\ndata: {json.dumps(info)}\n\n"
+                continue
+            try:
+                await asyncio.wait_for(changed.wait(), state.SSE_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def history(request: Request):
+    """Recent images, newest first. ?since=<id> returns only entries newer than `id`."""
+    try:
+        since = int(request.query_params.get("since", 0))
+    except ValueError:
+        since = 0
+    return JSONResponse(state.history_page(since))
+
+async def image(request: Request):
+    p, mtime, size, etag = state.history_entry(request.path_params.get("entry_id"))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    if is_web_friendly(p) or not state.PIL_AVAILABLE:
+        return file_response(request, p, etag)
+    try:
+        # The thread only waits: the conversion itself runs in state.CONVERTER.
+        data = await run_in_threadpool(state.get_cached_image, p, mtime, size)
+    except Exception as e:
+        logging.warning("Conversion failed: %s", e)
+        return file_response(request, p, etag)
+    return image_response(data, "image/png", etag)
+
+async def download(request: Request):
+    p, _, _, etag = state.history_entry(request.path_params.get("entry_id"))
+    return file_response(request, p, etag, download=True)
+
+async def thumb(request: Request):
+    """Downscaled JPEG preview (--thumb-size) of the latest image or a history entry."""
+    if not state.PIL_AVAILABLE:
+        raise HTTPException(501, "Pillow is required for thumbnails")
+    p, mtime, size, etag = state.history_entry(request.path_params.get("entry_id"))
+    etag = f'{etag[:-1]}-t{state.THUMB_SIZE}"'
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    data = await run_in_threadpool(state.get_thumbnail, p, mtime, size)
+    return image_response(data, "image/jpeg", etag)
+
+async def tiles_descriptor(request: Request):
+    """DeepZoom descriptor of the latest image; tiles are at /tiles/<level>/<x>/<y>."""
+    if not (state.PIL_AVAILABLE and state.TILES_ENABLED):
+        raise HTTPException(404, "Tiles are disabled (start with --tiles)")
+    p, mtime, size, etag = state.current_latest()
+    pyramid = await run_in_threadpool(state.get_pyramid, p, mtime, size)
+    return Response(pyramid.dzi(), media_type="application/xml", headers={"Cache-Control": "no-cache", "ETag": etag})
+
+async def tile(request: Request):
+    """One JPEG tile of the latest image; a stale ?v=<version> gets 409 (see serve_latest_image.tile)."""
+    if not (state.PIL_AVAILABLE and state.TILES_ENABLED):
+        raise HTTPException(404, "Tiles are disabled (start with --tiles)")
+    level, x, y = (request.path_params[k] for k in ("level", "x", "y"))
+    p, mtime, size, etag = state.current_latest()
+    wanted = request.query_params.get("v")
+    if wanted and wanted != etag.strip('"'):
+        raise HTTPException(409, "Latest image changed")
+    etag = f'{etag[:-1]}-{level}-{x}-{y}"'
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    try:
+        data = await run_in_threadpool(state.get_tile, p, mtime, size, level, x, y)
+    except KeyError:
+        raise HTTPException(404, "No such tile")
+    return image_response(data, "image/jpeg", etag)
+
+async def metrics(request: Request):
+    stats = state.IMAGE_CACHE.stats()
+    METRICS.set("viewer_image_cache_bytes", stats["bytes"])
+    METRICS.set("viewer_image_cache_hits_total", stats["hits"])
+    METRICS.set("viewer_image_cache_misses_total", stats["misses"])
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+routes = [
+    Route("/", index),
+    Route("/events", events),
+    Route("/history", history),
+    Route("/image", image),
+    Route("/image/{entry_id:int}", image),
+    Route("/download", download),
+    Route("/download/{entry_id:int}", download),
+    Route("/thumb", thumb),
+    Route("/thumb/{entry_id:int}", thumb),
+    Route("/tiles.dzi", tiles_descriptor),
+    Route("/tiles/{level:int}/{x:int}/{y:int}", tile),
+    Route("/metrics", metrics),
+]
+
+app = ConnectionMetrics(Starlette(routes=routes, lifespan=lifespan,
+                                  exception_handlers={state.Unavailable: unavailable}), METRICS)
+
+# ----------------------------- CLI / main -------------------------------
+
+class Server(uvicorn.Server):
+    def handle_exit(self, sig, frame):
+        # uvicorn waits for open connections before exiting; let SSE streams finish first.
+        if NOTIFIER:
+            NOTIFIER.close()
+        super().handle_exit(sig, frame)
+
+def _ignore_sigint():
+    # Conversion workers share the terminal's process group; Ctrl+C is for the server.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def parse_args(argv=None):
+    ap = state.build_parser("Serve latest image from folder via ASGI (uvicorn)")
+    ap.add_argument("--convert-processes", type=int, default=0,
+                    help="Worker processes for image conversion (default: one per CPU)")
+    return ap.parse_args(argv)
+
+def main():
+    args = parse_args()
+    watcher = state.setup(args)
+    if state.PIL_AVAILABLE:
+        # spawn, not fork: the server is multi-threaded by the time conversions start.
+        state.CONVERTER = ProcessPoolExecutor(max_workers=args.convert_processes or None,
+                                              mp_context=multiprocessing.get_context("spawn"),
+                                              initializer=_ignore_sigint)
+
+    def serve():
+        server = Server(uvicorn.Config(app, host=args.host, port=args.port, log_level=args.log_level.lower(),
+                                       timeout_graceful_shutdown=5))
+        try:
+            server.run()
+        except KeyboardInterrupt:
+            pass  # uvicorn re-raises the signal after shutting down, as uvicorn.run() expects
+
+    try:
+        state.run(watcher, serve)
+    finally:
+        if state.CONVERTER:
+            state.CONVERTER.shutdown(wait=False, cancel_futures=True)
+
+if __name__ == "__main__":
+    main()
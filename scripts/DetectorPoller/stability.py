@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Shared, non-blocking file stability tracking.
+
+One scheduler thread watches any number of candidate files (across any number of
+folders) using a timer heap instead of a sleeping thread per file. A file is "stable"
+once its (size, mtime) has not changed for `stable_for` seconds, or for only
+`close_grace` seconds after the writer closed it (inotify IN_CLOSE_WRITE, delivered by
+watchdog as a "closed" event on Linux). The callback then fires once, on the
+scheduler thread, as callback(path, size, mtime) - keep it short or hand work off.
+"""
+
+from __future__ import annotations
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+StableCallback = Callable[[str, int, float], None]
+
+@dataclass
+class _Candidate:
+    callback: StableCallback
+    stable_for: float
+    size: int = -1
+    mtime: float = -1.0
+    since: float = 0.0
+    closed: bool = False
+    next_due: float = 0.0  # due time of the one live heap entry; 0 when none is pending
+
+class StabilityTracker:
+    def __init__(self, stable_for: float, check_every: float = 0.25, close_grace: float = 0.1):
+        self.stable_for = stable_for
+        self.check_every = check_every
+        self.close_grace = close_grace
+        self._candidates: Dict[str, _Candidate] = {}
+        self._timers: List[Tuple[float, int, str]] = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> "StabilityTracker":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout=5)
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._candidates)
+
+    def watch(self, path: str, callback: StableCallback, stable_for: Optional[float] = None) -> None:
+        """
+        Track `path` (again) until stable. Re-watching a tracked file replaces its callback
+        and forgets an earlier close; its clock restarts only when its size or mtime changes.
+        """
+        with self._cond:
+            cand = self._candidates.get(path)
+            if cand is None:
+                cand = self._candidates[path] = _Candidate(callback, self.stable_for if stable_for is None else stable_for)
+            else:
+                cand.callback = callback
+                cand.closed = False
+            if not cand.next_due:
+                self._schedule(cand, path, time.monotonic())
+
+    def notify_closed(self, path: str) -> None:
+        """The writer closed the file; only a short quiet period is still required."""
+        with self._cond:
+            cand = self._candidates.get(path)
+            if cand is None or cand.closed:
+                return
+            cand.closed = True
+            self._schedule(cand, path, time.monotonic())
+
+    def forget(self, path: str) -> None:
+        with self._cond:
+            self._candidates.pop(path, None)
+
+    def _schedule(self, cand: _Candidate, path: str, when: float) -> None:
+        # Called with the condition held. One live timer per file: a pending earlier check
+        # wins, a new earlier one supersedes it (the old heap entry is then skipped in _run).
+        if cand.next_due and cand.next_due <= when:
+            return
+        cand.next_due = when
+        heapq.heappush(self._timers, (when, next(self._seq), path))
+        self._cond.notify()
+
+    def _check(self, path: str, now: float) -> Optional[Tuple[_Candidate, int, float]]:
+        # Called with the condition held. Returns the candidate if it just became stable.
+        cand = self._candidates.get(path)
+        if cand is None:
+            return None
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            del self._candidates[path]
+            return None
+        if (st.st_size, st.st_mtime) != (cand.size, cand.mtime):
+            cand.size, cand.mtime, cand.since = st.st_size, st.st_mtime, now
+        quiet = self.close_grace if cand.closed else cand.stable_for
+        if now - cand.since >= quiet:
+            del self._candidates[path]
+            return cand, st.st_size, st.st_mtime
+        self._schedule(cand, path, min(cand.since + quiet, now + self.check_every))
+        return None
+
+    def _run(self) -> None:
+        while True:
+            ready = []
+            with self._cond:
+                while not self._stop:
+                    if self._timers:
+                        delay = self._timers[0][0] - time.monotonic()
+                        if delay <= 0:
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+                if self._stop:
+                    return
+                now = time.monotonic()
+                while self._timers and self._timers[0][0] <= now:
+                    due, _, path = heapq.heappop(self._timers)
+                    cand = self._candidates.get(path)
+                    if cand is None or due != cand.next_due:
+                        continue  # forgotten, or superseded by an earlier timer
+                    cand.next_due = 0.0
+                    stable = self._check(path, now)
+                    if stable:
+                        ready.append((path, stable))
+            # Callbacks run outside the lock so they may call watch() again.
+            for path, (cand, size, mtime) in ready:
+                try:
+                    cand.callback(path, size, mtime)
+                except Exception:
+                    logging.exception("Stability callback failed for %s", path)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Pre-upload transforms for watch_and_publish.py.
+
+A transform spec is `name` or `name:arg`:
+  zstd[:level]    compress with Zstandard (default level 3)      -> <file>.zst   (needs zstandard)
+  lz4[:level]     compress with LZ4 frame format                 -> <file>.lz4   (needs lz4)
+  png             lossless PNG transcode (keeps 16-bit greyscale) -> <stem>.png   (needs Pillow)
+  webp            lossless WebP transcode (8-bit images only)     -> <stem>.webp  (needs Pillow)
+  preview[:size]  downsampled 8-bit JPEG preview, longest side `size` (default 512),
+                  uploaded alongside the main file                -> <stem>.preview.jpg (needs Pillow)
+
+Payload transforms (everything but preview) apply in the order given, so
+`png` + `zstd` ships <stem>.png.zst. Previews are always made from the original.
+The work runs in a ProcessPoolExecutor, so compression and decoding use other cores
+instead of the upload threads / event loop.
+"""
+
+from __future__ import annotations
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import List, Optional, Tuple
+
+try:
+    import zstandard
+except Exception:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except Exception:
+    lz4_frame = None
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except Exception:
+    PIL_AVAILABLE = False
+
+PREVIEW = "preview"
+REQUIREMENTS = {
+    "zstd": ("zstandard", lambda: zstandard is not None),
+    "lz4": ("lz4", lambda: lz4_frame is not None),
+    "png": ("Pillow", lambda: PIL_AVAILABLE),
+    "webp": ("Pillow", lambda: PIL_AVAILABLE),
+    PREVIEW: ("Pillow", lambda: PIL_AVAILABLE),
+}
+COPY_BLOCK = 1024 * 1024
+
+def parse_spec(spec: str) -> Tuple[str, Optional[int]]:
+    name, _, arg = spec.partition(":")
+    name = name.strip().lower()
+    if name not in REQUIREMENTS:
+        raise ValueError(f"Unknown transform {spec!r}; expected one of {', '.join(REQUIREMENTS)}")
+    package, available = REQUIREMENTS[name]
+    if not available():
+        raise ValueError(f"Transform {name!r} needs {package} (pip install {package.lower()})")
+    try:
+        return name, int(arg) if arg else None
+    except ValueError:
+        raise ValueError(f"Transform argument must be an integer: {spec!r}")
+
+def _stem(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _compress(src: str, dst: str, compressor) -> None:
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        writer = compressor(fout)
+        try:
+            shutil.copyfileobj(fin, writer, COPY_BLOCK)
+        finally:
+            writer.close()
+
+def _zstd(src: str, out_dir: str, level: Optional[int]) -> str:
+    dst = os.path.join(out_dir, os.path.basename(src) + ".zst")
+    cctx = zstandard.ZstdCompressor(level=level or 3, threads=-1)
+    _compress(src, dst, lambda f: cctx.stream_writer(f, closefd=False))
+    return dst
+
+def _lz4(src: str, out_dir: str, level: Optional[int]) -> str:
+    dst = os.path.join(out_dir, os.path.basename(src) + ".lz4")
+    _compress(src, dst, lambda f: lz4_frame.LZ4FrameFile(f, "wb", compression_level=level or 0))
+    return dst
+
+def _png(src: str, out_dir: str, _arg: Optional[int]) -> str:
+    dst = os.path.join(out_dir, _stem(src) + ".png")
+    with Image.open(src) as img:
+        if img.mode not in ("1", "L", "LA", "P", "RGB", "RGBA", "I;16", "I;16B"):
+            raise ValueError(f"PNG cannot hold mode {img.mode} losslessly")
+        if img.mode == "I;16B":
+            img = img.convert("I;16")
+        img.save(dst, format="PNG", optimize=False, compress_level=6)
+    return dst
+
+def _webp(src: str, out_dir: str, _arg: Optional[int]) -> str:
+    dst = os.path.join(out_dir, _stem(src) + ".webp")
+    with Image.open(src) as img:
+        if img.mode not in ("L", "RGB", "RGBA"):
+            raise ValueError(f"WebP cannot hold mode {img.mode} losslessly")
+        img.save(dst, format="WEBP", lossless=True, method=4)
+    return dst
+
+def to_8bit(img):
+    """8-bit L/RGB version of a Pillow image for lossy/preview output (also used by serve_latest_image)."""
+    if img.mode in ("L", "RGB"):
+        return img
+    if img.mode in ("RGBA", "P", "LA", "1"):
+        return img.convert("RGB")
+    # 16-bit / 32-bit greyscale: stretch the actual value range to 0..255.
+    img = img.convert("F")
+    lo, hi = img.getextrema()
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    return img.point(lambda v: (v - lo) * scale).convert("L")
+
+def _preview(src: str, out_dir: str, size: Optional[int]) -> str:
+    dst = os.path.join(out_dir, _stem(src) + ".preview.jpg")
+    with Image.open(src) as img:
+        img.draft("RGB", (size or 512, size or 512))
+        img = to_8bit(img)
+        img.thumbnail((size or 512, size or 512))
+        img.save(dst, format="JPEG", quality=85)
+    return dst
+
+FUNCTIONS = {"zstd": _zstd, "lz4": _lz4, "png": _png, "webp": _webp, PREVIEW: _preview}
+
+def run_transforms(path: str, specs: List[Tuple[str, Optional[int]]], out_dir: str) -> Tuple[str, List[str]]:
+    """
+    Apply `specs` to `path` (runs in a worker process). Returns (main file, extra files).
+    The main file is `path` itself when no payload transform is configured.
+    """
+    work_dir = tempfile.mkdtemp(prefix="t_", dir=out_dir)
+    main, extras = path, []
+    try:
+        for name, arg in specs:
+            if name == PREVIEW:
+                extras.append(_preview(path, work_dir, arg))
+            else:
+                main = FUNCTIONS[name](main, work_dir, arg)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+    if main == path and not extras:
+        os.rmdir(work_dir)
+    return main, extras
+
+class Transformer:
+    """Runs transform specs in a process pool and cleans up their staging files."""
+    def __init__(self, workers: int = 0):
+        self.out_dir = tempfile.mkdtemp(prefix="publish_transform_")
+        # spawn, not fork: the publisher is multi-threaded and forking it can deadlock.
+        self._pool = ProcessPoolExecutor(max_workers=workers or None, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, path: str, specs: List[Tuple[str, Optional[int]]]) -> Future:
+        return self._pool.submit(run_transforms, path, specs, self.out_dir)
+
+    def run(self, path: str, specs: List[Tuple[str, Optional[int]]]) -> Tuple[str, List[str]]:
+        return self.submit(path, specs).result()
+
+    def cleanup(self, source: str, outputs: List[str]) -> None:
+        """Remove the staged outputs of one file (never the source itself)."""
+        for p in outputs:
+            if p != source:
+                shutil.rmtree(os.path.dirname(p), ignore_errors=True)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        shutil.rmtree(self.out_dir, ignore_errors=True)
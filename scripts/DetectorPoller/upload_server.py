@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the upload web service, for testing watch_and_publish.py without
+the real endpoint. Standard library only.
+
+Accepts
+- POST /            multipart/form-data (file in any field) or a raw body with X-Filename
+- POST /uploads     create a resumable upload (Upload-Length, Upload-Name) -> 201 Location
+- HEAD /uploads/ID  current Upload-Offset
+- PATCH /uploads/ID append the body at Upload-Offset (409 if the offset is wrong)
+
+--delay adds a fixed service time per request to simulate a slow endpoint.
+--fail-rate drops that fraction of requests halfway through the body to simulate a
+flaky link; bytes already received by a PATCH are kept, so resumable clients continue.
+
+Run example:
+  python3 upload_server.py --port 8080 --out /tmp/received --fail-rate 0.2
+"""
+
+from __future__ import annotations
+import argparse
+import email.parser
+import email.policy
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+BLOCK = 64 * 1024
+
+@dataclass
+class Upload:
+    name: str
+    length: int
+    path: Optional[str]
+    offset: int = 0
+
+class UploadServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, out_dir: Optional[str], fail_rate: float = 0.0, delay: float = 0.0):
+        super().__init__(address, UploadHandler)
+        self.out_dir = out_dir
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.uploads: Dict[str, Upload] = {}
+        self.received = 0
+        if out_dir:
+            os.makedirs(os.path.join(out_dir, ".partial"), exist_ok=True)
+
+    def completed(self, name: str, size: int) -> None:
+        with self.lock:
+            self.received += 1
+            count = self.received
+        logging.info("Received #%d %s (%d bytes)", count, name, size)
+
+    def store(self, name: str, data: bytes) -> None:
+        if self.out_dir:
+            with open(os.path.join(self.out_dir, os.path.basename(name)), "wb") as f:
+                f.write(data)
+
+class UploadHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: UploadServer
+
+    def log_message(self, fmt, *args):
+        logging.debug("%s - %s", self.address_string(), fmt % args)
+
+    def _reply(self, status: int, headers: Optional[Dict[str, str]] = None, body: bytes = b"") -> None:
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _flaky(self) -> bool:
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        return self.server.fail_rate > 0 and random.random() < self.server.fail_rate
+
+    def _drop(self) -> None:
+        # Simulated network failure: no response, connection closed.
+        self.close_connection = True
+
+    def _read_body(self, length: int, flaky: bool, sink=None) -> Optional[bytes]:
+        """Read `length` bytes (to `sink` if given). Returns None if the read was cut short."""
+        limit = length // 2 if flaky else length
+        chunks = []
+        remaining = limit
+        while remaining > 0:
+            block = self.rfile.read(min(BLOCK, remaining))
+            if not block:
+                return None
+            remaining -= len(block)
+            if sink is not None:
+                sink(block)
+            else:
+                chunks.append(block)
+        return None if flaky else b"".join(chunks)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if self.path.split("?")[0].rstrip("/") == "/uploads":
+            return self._create(length)
+        body = self._read_body(length, self._flaky())
+        if body is None:
+            return self._drop()
+        ctype = self.headers.get("Content-Type", "")
+        name = self.headers.get("X-Filename", "upload.bin")
+        data = body
+        if ctype.startswith("multipart/form-data"):
+            msg = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+                b"Content-Type: " + ctype.encode() + b"\r\n\r\n" + body)
+            for part in msg.iter_parts():
+                if part.get_filename():
+                    name, data = part.get_filename(), part.get_payload(decode=True)
+                    break
+        self.server.store(name, data)
+        self.server.completed(name, len(data))
+        self._reply(200, body=b"ok")
+
+    def _create(self, length: int) -> None:
+        if length:
+            self.rfile.read(length)
+        try:
+            total = int(self.headers["Upload-Length"])
+        except (KeyError, ValueError):
+            return self._reply(400, body=b"Upload-Length required")
+        upload_id = uuid.uuid4().hex
+        partial = os.path.join(self.server.out_dir, ".partial", upload_id) if self.server.out_dir else None
+        if partial:
+            open(partial, "wb").close()
+        with self.server.lock:
+            self.server.uploads[upload_id] = Upload(self.headers.get("Upload-Name", upload_id), total, partial)
+        self._reply(201, {"Location": f"/uploads/{upload_id}"})
+
+    def _upload(self) -> Optional[Upload]:
+        upload_id = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        with self.server.lock:
+            return self.server.uploads.get(upload_id)
+
+    def do_HEAD(self):
+        upload = self._upload()
+        if upload is None:
+            return self._reply(404)
+        self._reply(200, {"Upload-Offset": str(upload.offset), "Upload-Length": str(upload.length)})
+
+    def do_PATCH(self):
+        length = int(self.headers.get("Content-Length", 0))
+        upload = self._upload()
+        if upload is None or int(self.headers.get("Upload-Offset", -1)) != upload.offset:
+            self.rfile.read(length)
+            return self._reply(409 if upload else 404)
+        f = open(upload.path, "ab") if upload.path else None
+
+        def sink(block: bytes) -> None:
+            if f:
+                f.write(block)
+            upload.offset += len(block)
+
+        try:
+            complete = self._read_body(length, self._flaky(), sink) is not None
+        finally:
+            if f:
+                f.close()
+        if not complete:
+            return self._drop()
+        if upload.offset >= upload.length:
+            if upload.path:
+                os.replace(upload.path, os.path.join(self.server.out_dir, os.path.basename(upload.name)))
+            self.server.completed(upload.name, upload.length)
+        self._reply(204, {"Upload-Offset": str(upload.offset)})
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Local stand-in upload server (multipart, raw and resumable).")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--out", default=None, help="Folder to store received files (default: discard).")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests to drop mid-body.")
+    ap.add_argument("--delay", type=float, default=0.0, help="Seconds added to every upload request.")
+    ap.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
+    return ap.parse_args(argv)
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s: %(message)s")
+    server = UploadServer((args.host, args.port), args.out, args.fail_rate, args.delay)
+    logging.info("Upload server on http://%s:%d (fail rate %.0f%%)", args.host, args.port, args.fail_rate * 100)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+HTTP upload client shared by the publish workers.
+
+All workers go through one keep-alive requests.Session whose connection pool is sized
+to the number of workers, so a burst of files does not pay a TCP/TLS handshake each.
+
+Modes
+- multipart:  the original form upload (POST <endpoint>, file in `field_name`).
+- stream:     POST the raw file body straight from disk (never loaded into memory);
+              name and extra fields travel as X-Filename / query parameters.
+- resumable:  tus-style protocol (see upload_server.py). POST <endpoint>/uploads
+              creates an upload and returns its Location; PATCH requests append
+              `chunk_size` bytes at Upload-Offset; on a retry HEAD asks the server how
+              far it got, so a flaky link resumes instead of restarting at byte zero.
+"""
+
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+MODES = ("multipart", "stream", "resumable")
+
+def parse_extra(extra: List[str]) -> Dict[str, str]:
+    """Extra key=value pairs from the command line."""
+    data = {}
+    for kv in extra:
+        if "=" in kv:
+            k, v = kv.split("=", 1)
+            data[k] = v
+    return data
+
+class UploadError(Exception):
+    pass
+
+@dataclass
+class UploadStats:
+    """Throughput / latency counters across all workers."""
+    files: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+    resumed_bytes: int = 0
+    latencies: List[float] = field(default_factory=list)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, size: int, seconds: float, resumed: int = 0) -> None:
+        with self._lock:
+            self.files += 1
+            self.bytes += size
+            self.seconds += seconds
+            self.resumed_bytes += resumed
+            self.latencies.append(seconds)
+            del self.latencies[:-1000]
+
+    def summary(self) -> str:
+        with self._lock:
+            if not self.files:
+                return "no uploads"
+            ordered = sorted(self.latencies)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            rate = self.bytes / self.seconds / 1e6 if self.seconds else 0.0
+            return (f"{self.files} files, {self.bytes / 1e6:.1f} MB, {rate:.1f} MB/s per upload, "
+                    f"p50 {p50:.2f}s, p95 {p95:.2f}s, {self.resumed_bytes / 1e6:.1f} MB skipped by resume")
+
+class Uploader:
+    def __init__(self, endpoint: str, field_name: str = "file", token: Optional[str] = None,
+                 extra: Optional[List[str]] = None, timeout: float = 30.0, mode: str = "multipart",
+                 pool_size: int = 2, chunk_size: int = 4 * 1024 * 1024):
+        if mode not in MODES:
+            raise ValueError(f"Unknown upload mode {mode!r}; expected one of {MODES}")
+        self.endpoint = endpoint
+        self.field_name = field_name
+        self.extra = parse_extra(extra or [])
+        self.timeout = timeout
+        self.mode = mode
+        self.chunk_size = chunk_size
+        self.stats = UploadStats()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if token:
+            self.session.headers["Authorization"] = f"Bearer {token}"
+        # (path, mtime, size) -> upload URL, so retries of the same file resume
+        self._resumable: Dict[Tuple[str, float, int], str] = {}
+        self._resumable_lock = threading.Lock()
+
+    def close(self) -> None:
+        self.session.close()
+
+    def upload(self, path: str) -> requests.Response:
+        """Upload one file in the configured mode. Raises on HTTP errors."""
+        size = os.path.getsize(path)
+        started = time.perf_counter()
+        resumed = 0
+        if self.mode == "multipart":
+            resp = self._multipart(path)
+        elif self.mode == "stream":
+            resp = self._stream(path)
+        else:
+            resp, resumed = self._resumable_upload(path)
+        if not 200 <= resp.status_code < 300:
+            raise UploadError(f"HTTP {resp.status_code}, body={resp.text[:500]}")
+        self.stats.record(size - resumed, time.perf_counter() - started, resumed)
+        return resp
+
+    def _multipart(self, path: str) -> requests.Response:
+        with open(path, "rb") as f:
+            files = {self.field_name: (os.path.basename(path), f)}
+            return self.session.post(self.endpoint, data=self.extra, files=files, timeout=self.timeout)
+
+    def _stream(self, path: str) -> requests.Response:
+        headers = {"Content-Type": "application/octet-stream", "X-Filename": os.path.basename(path)}
+        with open(path, "rb") as f:
+            # A file object is sent with Content-Length and read in blocks, never held in memory.
+            return self.session.post(self.endpoint, params=self.extra, data=f, headers=headers,
+                                     timeout=self.timeout)
+
+    def _resumable_upload(self, path: str) -> Tuple[requests.Response, int]:
+        st = os.stat(path)
+        key = (path, st.st_mtime, st.st_size)
+        with self._resumable_lock:
+            location = self._resumable.get(key)
+        offset = 0
+        if location:
+            head = self.session.head(location, timeout=self.timeout)
+            if head.status_code == 200:
+                offset = int(head.headers.get("Upload-Offset", 0))
+                logging.info("Resuming %s at byte %d of %d", path, offset, st.st_size)
+            else:
+                location = None
+        if not location:
+            headers = {"Upload-Length": str(st.st_size), "Upload-Name": os.path.basename(path)}
+            resp = self.session.post(urljoin(self.endpoint.rstrip("/") + "/", "uploads"), params=self.extra,
+                                     headers=headers, timeout=self.timeout)
+            if resp.status_code != 201 or "Location" not in resp.headers:
+                return resp, 0
+            location = urljoin(resp.url, resp.headers["Location"])
+            with self._resumable_lock:
+                self._resumable[key] = location
+        resumed = offset
+        resp = None
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while True:
+                chunk = f.read(self.chunk_size)
+                if not chunk and resp is not None:
+                    break
+                headers = {"Upload-Offset": str(offset), "Content-Type": "application/offset+octet-stream"}
+                resp = self.session.patch(location, data=chunk, headers=headers, timeout=self.timeout)
+                if resp.status_code not in (200, 204):
+                    return resp, resumed
+                offset = int(resp.headers.get("Upload-Offset", offset + len(chunk)))
+                if offset >= st.st_size:
+                    break
+        if offset < st.st_size:
+            raise UploadError(f"{path} shrank during upload ({offset} of {st.st_size} bytes sent)")
+        with self._resumable_lock:
+            self._resumable.pop(key, None)
+        return resp, resumed
@@ -1,29 +1,60 @@
 #!/usr/bin/env python3
 """
-Watch a folder for new/updated files and publish the latest one to a web service.
+Watch a folder for new/updated files and publish every one of them to a web service.
 
 Features
 - Event-driven via watchdog (fast, low CPU).
 - Optional polling fallback (--poll-interval).
-- Debounce to ensure files are fully written before upload.
+- Debounce to ensure files are fully written before upload; one shared scheduler thread
+  tracks every candidate file (no sleeping thread per file) and honours inotify
+  close_write events where watchdog reports them.
 - Pattern filter (e.g., *.tif).
 - Retries with exponential backoff.
-- Only publishes the LATEST file present at trigger time.
+- Durable, ordered publish queue (SQLite): every stable file is uploaded, none are
+  dropped during bursts, and pending uploads survive restarts.
+- N concurrent upload workers (--workers) sharing one keep-alive connection pool.
+- Upload modes (--upload-mode): multipart form, raw streamed body, or resumable
+  chunked upload that continues where a dropped connection left off.
+- Many folders in one process (--config): each with its own patterns, debounce,
+  endpoint, recursion and upload concurrency, sharing one observer, one stability
+  tracker, one publish queue and one upload worker pool.
+- --async: asyncio claim -> hash -> upload pipeline with bounded queues between the
+  stages (backpressure instead of unbounded buffering) and Prometheus-style per-stage
+  counters (--metrics-port).
+- Optional pre-upload transforms (--transform): zstd / lz4 compression, lossless
+  PNG / WebP transcoding and a downsampled preview uploaded alongside, run in a
+  process pool.
+- Content-hash dedup: a file whose content was already published to the endpoint
+  is skipped (--no-dedup to disable).
 """
 
 from __future__ import annotations
 import argparse
+import asyncio
 import fnmatch
+import json
 import logging
 import os
-import queue
 import sys
 import threading
 import time
-from dataclasses import dataclass
-from typing import Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Dict, Optional, List, Set, Tuple
 
-import requests
+from dedup import HASH_NAME, Deduplicator
+from dir_index import DirectoryIndex
+from metrics import Metrics
+from publish_queue import PublishQueue, QueueItem
+from stability import StabilityTracker
+from transforms import Transformer, parse_spec
+from uploader import MODES, Uploader, UploadError
+
+try:
+    import yaml
+except Exception:
+    yaml = None
 
 try:
     from watchdog.observers import Observer
@@ -31,6 +62,7 @@ try:
     WATCHDOG_AVAILABLE = True
 except Exception:
     WATCHDOG_AVAILABLE = False
+    FileSystemEventHandler = object  # so Handler can be defined; it is only used with watchdog
 
 # ----------------------------- helpers ---------------------------------
 
@@ -39,76 +71,17 @@ def is_match(name: str, patterns: List[str]) -> bool:
         return True
     return any(fnmatch.fnmatch(name, p) for p in patterns)
 
-def file_is_stable(path: str, stable_for: float, check_every: float = 0.5) -> bool:
-    """
-    Returns True when a file hasn't changed size/mtime for `stable_for` seconds.
-    """
-    end_time = None
-    last: Optional[Tuple[int, float]] = None
-    while True:
-        try:
-            st = os.stat(path)
-        except FileNotFoundError:
-            return False
-        current = (st.st_size, st.st_mtime)
-        if last == current:
-            if end_time is None:
-                end_time = time.time() + stable_for
-            if time.time() >= end_time:
-                return True
-        else:
-            last = current
-            end_time = None
-        time.sleep(check_every)
-
-def latest_file(root: str, patterns: List[str]) -> Optional[str]:
-    latest_path = None
-    latest_mtime = -1.0
-    try:
-        for entry in os.scandir(root):
-            if not entry.is_file():
-                continue
-            name = entry.name
-            if name.startswith("."):
-                continue
-            if not is_match(name, patterns):
-                continue
-            try:
-                mtime = entry.stat().st_mtime
-            except FileNotFoundError:
-                continue
-            if mtime > latest_mtime:
-                latest_mtime = mtime
-                latest_path = entry.path
-    except FileNotFoundError:
-        return None
-    return latest_path
-
-def post_file(endpoint: str, path: str, field_name: str, token: Optional[str], extra: List[str], timeout: float) -> requests.Response:
-    headers = {}
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    data = {}
-    # extra key=value pairs
-    for kv in extra:
-        if "=" in kv:
-            k, v = kv.split("=", 1)
-            data[k] = v
-    with open(path, "rb") as f:
-        files = {field_name: (os.path.basename(path), f)}
-        resp = requests.post(endpoint, headers=headers, data=data, files=files, timeout=timeout)
-    return resp
-
-def retry_post(endpoint: str, path: str, field_name: str, token: Optional[str], extra: List[str], timeout: float, attempts: int, base_delay: float) -> bool:
+def retry_post(uploader: Uploader, path: str, attempts: int, base_delay: float) -> bool:
     delay = base_delay
     for i in range(1, attempts + 1):
         try:
-            resp = post_file(endpoint, path, field_name, token, extra, timeout)
-            if 200 <= resp.status_code < 300:
-                logging.info("Uploaded %s -> %s (status %s)", path, endpoint, resp.status_code)
-                return True
-            else:
-                logging.warning("Upload failed (attempt %d/%d): HTTP %s, body=%s", i, attempts, resp.status_code, resp.text[:500])
+            started = time.perf_counter()
+            resp = uploader.upload(path)
+            elapsed = time.perf_counter() - started
+            logging.info("Uploaded %s -> %s (status %s, %.2fs)", path, uploader.endpoint, resp.status_code, elapsed)
+            return True
+        except UploadError as e:
+            logging.warning("Upload failed (attempt %d/%d): %s", i, attempts, e)
         except Exception as e:
             logging.warning("Upload error (attempt %d/%d): %s", i, attempts, e)
         if i < attempts:
@@ -130,123 +103,552 @@ class Config:
     attempts: int
     backoff: float
     extra: List[str]
+    upload_mode: str = "multipart"
+    chunk_size: int = 4 * 1024 * 1024
+    dedup: bool = True
+    dedup_cache: int = 10000
+    name: str = ""
+    recursive: bool = False
+    concurrency: int = 0  # max uploads in flight for this folder; 0 = up to --workers
+    transforms: List[Tuple[str, Optional[int]]] = field(default_factory=list)
 
 class PublishWorker:
     """
-    Receives "trigger" events and, after a short coalescing window, publishes the latest file.
+    Receives per-file events for one or more watched folders ("routes", one Config each),
+    lets the shared stability tracker decide when each file is fully written, records it
+    in the durable publish queue and uploads queued files with one pool of `workers`
+    threads. A route never has more than its `concurrency` uploads in flight.
     """
-    def __init__(self, cfg: Config, coalesce_window: float = 0.75):
-        self.cfg = cfg
-        self.coalesce_window = coalesce_window
-        self._q: "queue.Queue[float]" = queue.Queue()
+    def __init__(self, routes: List[Config], publish_queue: PublishQueue, workers: int = 2, check_every: float = 0.25,
+                 transform_workers: int = 0):
+        self.routes: Dict[str, Config] = {cfg.name: cfg for cfg in routes}
+        self.queue = publish_queue
+        self.tracker = StabilityTracker(routes[0].debounce, check_every=check_every)
+        self.uploaders: Dict[str, Uploader] = {}
+        self.dedups: Dict[str, Deduplicator] = {}
+        for cfg in routes:
+            pool = min(workers, cfg.concurrency) if cfg.concurrency else workers
+            self.uploaders[cfg.name] = Uploader(cfg.endpoint, cfg.field_name, cfg.token, cfg.extra, cfg.timeout,
+                                                mode=cfg.upload_mode, pool_size=pool, chunk_size=cfg.chunk_size)
+            if cfg.dedup:
+                self.dedups[cfg.name] = Deduplicator(publish_queue, cfg.endpoint, cfg.dedup_cache)
+        # Pre-upload transforms run in a process pool, created only if a folder uses them.
+        self.transformer = Transformer(transform_workers) if any(cfg.transforms for cfg in routes) else None
+        self._active: Dict[str, int] = {name: 0 for name in self.routes}
+        self._active_lock = threading.Lock()
         self._stop = threading.Event()
-        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._threads = [threading.Thread(target=self._upload_loop, daemon=True) for _ in range(max(1, workers))]
 
     def start(self):
-        self._thread.start()
+        recovered = self.queue.recover()
+        if recovered:
+            logging.info("Re-queued %d uploads interrupted by a previous run.", recovered)
+        self.tracker.start()
+        for t in self._threads:
+            t.start()
 
     def stop(self):
         self._stop.set()
-        # Nudge queue so the thread wakes up
-        try:
-            self._q.put_nowait(time.time())
-        except queue.Full:
-            pass
-        self._thread.join(timeout=5)
+        self.tracker.stop()
+        for t in self._threads:
+            t.join(timeout=5)
+        for name, uploader in self.uploaders.items():
+            logging.info("Upload stats [%s]: %s", name, uploader.stats.summary())
+            uploader.close()
+        if self.transformer:
+            self.transformer.close()
+        for name, dedup in self.dedups.items():
+            logging.info("Dedup [%s]: %d duplicate uploads skipped (%s).", name, dedup.hits, HASH_NAME)
 
-    def trigger(self):
-        try:
-            self._q.put_nowait(time.time())
-        except queue.Full:
-            pass
+    def trigger(self, path: str, cfg: Config):
+        self.tracker.watch(path, partial(self._on_stable, cfg.name), stable_for=cfg.debounce)
+
+    def closed(self, path: str):
+        self.tracker.notify_closed(path)
+
+    def _on_stable(self, route: str, path: str, size: int, mtime: float):
+        if self.queue.enqueue(path, mtime, size, route):
+            logging.debug("Queued %s [%s]", path, route)
 
-    def _run(self):
-        last_trigger_time: Optional[float] = None
+    def _route_for(self, item: QueueItem) -> Optional[Config]:
+        cfg = self.routes.get(item.route)
+        if cfg is None:
+            # Rows queued before routing existed (or by a since-removed route): match by folder.
+            for candidate in self.routes.values():
+                if os.path.abspath(item.path).startswith(candidate.directory + os.sep):
+                    return candidate
+        return cfg
+
+    def _claim(self) -> Optional[QueueItem]:
+        with self._active_lock:
+            busy = [name for name, cfg in self.routes.items()
+                    if cfg.concurrency and self._active[name] >= cfg.concurrency]
+            item = self.queue.claim(timeout=0, exclude=busy)
+            if item is not None and item.route in self._active:
+                self._active[item.route] += 1
+        return item
+
+    def _finish(self, item: QueueItem):
+        with self._active_lock:
+            if item.route in self._active:
+                self._active[item.route] -= 1
+        self.queue.notify()
+
+    def _log_transform(self, item: QueueItem, main: str, extras: List[str]):
+        if main != item.path:
+            size = os.path.getsize(main)
+            logging.info("Transformed %s -> %s: %d -> %d bytes (%.1fx)", os.path.basename(item.path),
+                         os.path.basename(main), item.size, size, item.size / size if size else 0.0)
+
+    def _upload_loop(self):
         while not self._stop.is_set():
+            item = self._claim()
+            if item is None:
+                self.queue.wait(0.5)
+                continue
             try:
-                t = self._q.get(timeout=0.2)
-                last_trigger_time = t
-                # Coalesce multiple triggers close in time
-                while True:
-                    try:
-                        t2 = self._q.get(timeout=self.coalesce_window)
-                        last_trigger_time = t2
-                    except queue.Empty:
-                        break
-                # Act on the latest file
-                path = latest_file(self.cfg.directory, self.cfg.patterns)
-                if not path:
-                    logging.debug("No matching files found yet.")
+                self._publish(item)
+            except Exception as e:
+                logging.exception("Publishing %s failed.", item.path)
+                self.queue.mark_failed(item.id, f"error: {e}")
+            finally:
+                self._finish(item)
+
+    def _publish(self, item: QueueItem):
+        cfg = self._route_for(item)
+        if cfg is None:
+            self.queue.mark_failed(item.id, f"no route for {item.route or item.path}")
+            logging.warning("Skipping %s: not under any watched folder.", item.path)
+            return
+        if not os.path.isfile(item.path):
+            self.queue.mark_failed(item.id, "file disappeared before upload")
+            logging.warning("Skipping %s: file disappeared before upload.", item.path)
+            return
+        dedup = self.dedups.get(cfg.name)
+        digest = None
+        if dedup:
+            try:
+                digest, fresh = dedup.claim(item.path, item.id)
+            except OSError as e:
+                self.queue.mark_failed(item.id, f"cannot hash: {e}")
+                logging.warning("Skipping %s: cannot hash (%s).", item.path, e)
+                return
+            if fresh is None:
+                logging.info("Holding %s: same content is being uploaded.", item.path)
+                return
+            if not fresh:
+                self.queue.mark_skipped(item.id, f"duplicate content {digest}")
+                logging.info("Skipped %s: same content already published.", item.path)
+                return
+        committed = False
+        try:
+            main, extras = item.path, []
+            if cfg.transforms:
+                try:
+                    main, extras = self.transformer.run(item.path, cfg.transforms)
+                    self._log_transform(item, main, extras)
+                except Exception as e:
+                    logging.warning("Transform of %s failed (%s); uploading the original.", item.path, e)
+            ok = False
+            try:
+                ok = retry_post(self.uploaders[cfg.name], main, cfg.attempts, cfg.backoff)
+                for extra in extras if ok else []:
+                    if not retry_post(self.uploaders[cfg.name], extra, cfg.attempts, cfg.backoff):
+                        logging.warning("Could not upload %s for %s.", os.path.basename(extra), item.path)
+            finally:
+                if self.transformer:
+                    self.transformer.cleanup(item.path, [main, *extras])
+            if ok:
+                self.queue.mark_done(item.id)
+                if digest:
+                    dedup.commit(digest, item.path, item.size)
+                    committed = True
+            else:
+                self.queue.mark_failed(item.id, f"gave up after {cfg.attempts} attempts")
+                logging.error("Giving up uploading %s after %d attempts.", item.path, cfg.attempts)
+        finally:
+            # Any exit without a commit frees the digest, or later copies would be skipped as duplicates.
+            if digest and not committed:
+                dedup.release(digest)
+
+class AsyncPublishWorker(PublishWorker):
+    """
+    Same inputs as PublishWorker, but claimed files flow through an asyncio pipeline on
+    its own event loop thread:
+
+        claim (SQLite queue) -> hash / dedup -> upload
+
+    joined by bounded asyncio queues. When the endpoint slows down the upload queue
+    fills, hashing blocks on it, the hash queue fills and claiming stops, so the
+    backlog stays in the durable SQLite queue instead of piling up in memory. Blocking
+    work (SQLite, hashing, HTTP through the pooled Uploader) runs in a thread pool;
+    retry backoff is an asyncio sleep, so a slow retry does not hold a thread.
+    Per-stage Prometheus-style counters go to `metrics`.
+
+    On stop, uploads already under way get `drain_timeout` seconds to finish; claimed
+    files that never reached the upload stage go back to pending for the next run.
+    """
+    drain_timeout = 5.0
+
+    def __init__(self, routes: List[Config], publish_queue: PublishQueue, workers: int = 2,
+                 check_every: float = 0.25, transform_workers: int = 0, queue_size: int = 0,
+                 metrics: Optional[Metrics] = None):
+        super().__init__(routes, publish_queue, workers, check_every, transform_workers)
+        self._threads = []  # the event loop thread replaces the upload threads
+        self.workers = max(1, workers)
+        self.hash_workers = min(4, self.workers)
+        self.queue_size = queue_size or 2 * self.workers
+        self.metrics = metrics or Metrics()
+        self.metrics.describe("publish_stage_items_total", "counter", "Files leaving each pipeline stage, by outcome.")
+        self.metrics.describe("publish_stage_seconds_total", "counter", "Time spent working in each stage.")
+        self.metrics.describe("publish_backpressure_seconds_total", "counter",
+                              "Time a stage waited for room in the next stage's queue.")
+        self.metrics.describe("publish_upload_bytes_total", "counter", "Bytes uploaded (after transforms).")
+        self.metrics.describe("publish_queue_depth", "gauge", "Items waiting between stages.")
+        self._executor = ThreadPoolExecutor(max_workers=self.workers + self.hash_workers + 2,
+                                            thread_name_prefix="publish")
+        self._inflight: Dict[int, QueueItem] = {}
+        self._uploading: Set[int] = set()  # ids whose upload has started
+        self._busy: Set["asyncio.Task"] = set()  # uploader tasks working on an item
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._stopping: Optional[asyncio.Event] = None
+
+    def start(self):
+        super().start()
+        self._loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self._loop.run_until_complete, args=(self._run(),), daemon=True)
+        self._loop_thread.start()
+
+    def stop(self):
+        if self._loop and self._loop_thread:
+            self._loop.call_soon_threadsafe(self._request_stop)
+            self._loop_thread.join(timeout=self.drain_timeout + 5)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        super().stop()
+
+    def _request_stop(self):
+        if self._stopping:
+            self._stopping.set()
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _put(self, q: "asyncio.Queue", entry, stage: str):
+        if q.full():
+            started = time.perf_counter()
+            await q.put(entry)
+            self.metrics.inc("publish_backpressure_seconds_total", time.perf_counter() - started, stage=stage)
+        else:
+            q.put_nowait(entry)
+
+    def _count(self, stage: str, item: QueueItem, outcome: str, seconds: float = 0.0):
+        self.metrics.inc("publish_stage_items_total", stage=stage, route=item.route, outcome=outcome)
+        if seconds:
+            self.metrics.inc("publish_stage_seconds_total", seconds, stage=stage, route=item.route)
+
+    def _done(self, item: QueueItem):
+        self._inflight.pop(item.id, None)
+        self._uploading.discard(item.id)
+        self._finish(item)
+
+    async def _run(self):
+        self._stopping = asyncio.Event()
+        hash_q: "asyncio.Queue" = asyncio.Queue(self.queue_size)
+        upload_q: "asyncio.Queue" = asyncio.Queue(self.queue_size)
+        tasks = [asyncio.create_task(self._feeder(hash_q)), asyncio.create_task(self._gauges(hash_q, upload_q))]
+        tasks += [asyncio.create_task(self._hasher(hash_q, upload_q)) for _ in range(self.hash_workers)]
+        uploaders = [asyncio.create_task(self._uploader(upload_q)) for _ in range(self.workers)]
+        await self._stopping.wait()
+        for t in tasks:
+            t.cancel()
+        # Idle uploaders stop now; busy ones finish their current file (bounded) and then return.
+        busy = [t for t in uploaders if t in self._busy]
+        for t in uploaders:
+            if t not in busy:
+                t.cancel()
+        if busy:
+            await asyncio.wait(busy, timeout=self.drain_timeout)
+        for t in uploaders:
+            t.cancel()
+        await asyncio.gather(*tasks, *uploaders, return_exceptions=True)
+        # Claimed files that never started uploading go back to pending for the next run. One cut
+        # off mid-upload may have reached the endpoint: it stays "uploading" for recover() to retry.
+        for item in list(self._inflight.values()):
+            if item.id not in self._uploading:
+                self.queue.release(item.id)
+            self._done(item)
+
+    async def _gauges(self, hash_q: "asyncio.Queue", upload_q: "asyncio.Queue"):
+        while True:
+            self.metrics.set("publish_queue_depth", hash_q.qsize(), queue="hash")
+            self.metrics.set("publish_queue_depth", upload_q.qsize(), queue="upload")
+            await asyncio.sleep(1.0)
+
+    async def _feeder(self, out: "asyncio.Queue"):
+        while True:
+            item = await self._call(self._claim)
+            if item is None:
+                await self._call(self.queue.wait, 0.5)
+                continue
+            self._inflight[item.id] = item
+            self._count("claim", item, "ok")
+            await self._put(out, item, "claim")
+
+    async def _hasher(self, inq: "asyncio.Queue", out: "asyncio.Queue"):
+        while True:
+            item = await inq.get()
+            cfg = self._route_for(item)
+            if cfg is None or not os.path.isfile(item.path):
+                reason = "file disappeared before upload" if cfg else f"no route for {item.route or item.path}"
+                await self._call(self.queue.mark_failed, item.id, reason)
+                logging.warning("Skipping %s: %s.", item.path, reason)
+                self._count("hash", item, "failed")
+                self._done(item)
+                continue
+            dedup = self.dedups.get(cfg.name)
+            digest = None
+            if dedup:
+                started = time.perf_counter()
+                try:
+                    digest, fresh = await self._call(dedup.claim, item.path, item.id)
+                except OSError as e:
+                    await self._call(self.queue.mark_failed, item.id, f"cannot hash: {e}")
+                    logging.warning("Skipping %s: cannot hash (%s).", item.path, e)
+                    self._count("hash", item, "failed", time.perf_counter() - started)
+                    self._done(item)
                     continue
-                # Wait until stable
-                if not file_is_stable(path, stable_for=self.cfg.debounce):
-                    logging.debug("File %s disappeared or unstable.", path)
+                if fresh is None:
+                    logging.info("Holding %s: same content is being uploaded.", item.path)
+                    self._count("hash", item, "held", time.perf_counter() - started)
+                    self._done(item)
                     continue
-                # Upload
-                ok = retry_post(
-                    endpoint=self.cfg.endpoint,
-                    path=path,
-                    field_name=self.cfg.field_name,
-                    token=self.cfg.token,
-                    extra=self.cfg.extra,
-                    timeout=self.cfg.timeout,
-                    attempts=self.cfg.attempts,
-                    base_delay=self.cfg.backoff,
-                )
-                if not ok:
-                    logging.error("Giving up uploading %s after %d attempts.", path, self.cfg.attempts)
-            except queue.Empty:
-                pass
+                if not fresh:
+                    await self._call(self.queue.mark_skipped, item.id, f"duplicate content {digest}")
+                    logging.info("Skipped %s: same content already published.", item.path)
+                    self._count("hash", item, "duplicate", time.perf_counter() - started)
+                    self._done(item)
+                    continue
+                self._count("hash", item, "ok", time.perf_counter() - started)
+            await self._put(out, (item, cfg, digest), "hash")
+
+    async def _uploader(self, inq: "asyncio.Queue"):
+        task = asyncio.current_task()
+        while not self._stopping.is_set():
+            item, cfg, digest = await inq.get()
+            self._busy.add(task)
+            dedup = self.dedups.get(cfg.name)
+            committed = ok = False
+            started = time.perf_counter()
+            try:
+                main, extras = item.path, []
+                if cfg.transforms:
+                    try:
+                        main, extras = await asyncio.wrap_future(self.transformer.submit(item.path, cfg.transforms))
+                        self._log_transform(item, main, extras)
+                        self._count("transform", item, "ok", time.perf_counter() - started)
+                    except Exception as e:
+                        logging.warning("Transform of %s failed (%s); uploading the original.", item.path, e)
+                        self._count("transform", item, "failed", time.perf_counter() - started)
+                started = time.perf_counter()
+                self._uploading.add(item.id)
+                try:
+                    ok = await self._upload_with_retry(cfg, main)
+                    for extra in extras if ok else []:
+                        if await self._upload_with_retry(cfg, extra):
+                            self.metrics.inc("publish_upload_bytes_total", os.path.getsize(extra), route=item.route)
+                        else:
+                            logging.warning("Could not upload %s for %s.", os.path.basename(extra), item.path)
+                    sent = os.path.getsize(main) if ok else 0
+                finally:
+                    if self.transformer:
+                        self.transformer.cleanup(item.path, [main, *extras])
+                if ok:
+                    await self._call(self.queue.mark_done, item.id)
+                    if digest:
+                        await self._call(dedup.commit, digest, item.path, item.size)
+                        committed = True
+                    self.metrics.inc("publish_upload_bytes_total", sent, route=item.route)
+                else:
+                    await self._call(self.queue.mark_failed, item.id, f"gave up after {cfg.attempts} attempts")
+                    logging.error("Giving up uploading %s after %d attempts.", item.path, cfg.attempts)
+            except Exception as e:
+                ok = False
+                logging.exception("Publishing %s failed.", item.path)
+                await self._call(self.queue.mark_failed, item.id, f"error: {e}")
+            finally:
+                # Any exit without a commit (shutdown included) frees the digest for later copies.
+                if digest and not committed:
+                    dedup.release(digest)
+                self._busy.discard(task)
+            self._count("upload", item, "ok" if ok else "failed", time.perf_counter() - started)
+            self._done(item)
+
+    async def _upload_with_retry(self, cfg: Config, path: str) -> bool:
+        uploader = self.uploaders[cfg.name]
+        delay = cfg.backoff
+        for i in range(1, cfg.attempts + 1):
+            try:
+                started = time.perf_counter()
+                resp = await self._call(uploader.upload, path)
+                logging.info("Uploaded %s -> %s (status %s, %.2fs)", path, uploader.endpoint, resp.status_code,
+                             time.perf_counter() - started)
+                return True
+            except UploadError as e:
+                logging.warning("Upload failed (attempt %d/%d): %s", i, cfg.attempts, e)
+            except Exception as e:
+                logging.warning("Upload error (attempt %d/%d): %s", i, cfg.attempts, e)
+            if i < cfg.attempts:
+                self.metrics.inc("publish_stage_items_total", stage="upload", route=cfg.name, outcome="retry")
+                await asyncio.sleep(delay)
+                delay *= 2
+        return False
 
 # ----------------------------- watchers --------------------------------
 
 class Handler(FileSystemEventHandler):
-    def __init__(self, worker: PublishWorker, patterns: List[str]):
+    def __init__(self, worker: PublishWorker, cfg: Config):
         super().__init__()
         self.worker = worker
-        self.patterns = patterns
+        self.cfg = cfg
 
     def on_any_event(self, event: FileSystemEvent):
         # Trigger only for files that match the pattern; directories are ignored.
-        if event.is_directory:
+        if event.is_directory or event.event_type == "deleted":
             return
-        name = os.path.basename(event.src_path)
+        # For moves/renames the interesting file is the destination.
+        path = getattr(event, "dest_path", "") or event.src_path
+        name = os.path.basename(path)
         if name.startswith("."):
             return
-        if not is_match(name, self.patterns):
+        if not is_match(name, self.cfg.patterns):
             return
-        logging.debug("FS event: %s -> %s", event.event_type, event.src_path)
-        self.worker.trigger()
+        logging.debug("FS event: %s -> %s", event.event_type, path)
+        if event.event_type == "closed":
+            # inotify IN_CLOSE_WRITE: the writer is done, no need to wait out the full debounce.
+            self.worker.closed(path)
+        elif event.event_type in ("created", "modified", "moved"):
+            self.worker.trigger(path, self.cfg)
 
-def start_watchdog(path: str, worker: PublishWorker, patterns: List[str]) -> Observer:
+def start_watchdog(routes: List[Config], worker: PublishWorker) -> Observer:
+    """One observer (one inotify instance) for every watched folder."""
     observer = Observer()
-    handler = Handler(worker, patterns)
-    observer.schedule(handler, path, recursive=False)
+    for cfg in routes:
+        observer.schedule(Handler(worker, cfg), cfg.directory, recursive=cfg.recursive)
+        logging.info("Watching %s%s with watchdog (event-driven) -> %s", cfg.directory,
+                     " recursively" if cfg.recursive else "", cfg.endpoint)
     observer.start()
-    logging.info("Watching %s with watchdog (event-driven).", path)
     return observer
 
-def polling_loop(path: str, worker: PublishWorker, patterns: List[str], interval: float, stop_event: threading.Event):
-    logging.info("Polling %s every %.2fs.", path, interval)
-    last_seen: Optional[str] = None
-    last_mtime = -1.0
-    while not stop_event.is_set():
-        p = latest_file(path, patterns)
-        if p:
-            try:
-                mtime = os.stat(p).st_mtime
-            except FileNotFoundError:
-                mtime = -1
-            if p != last_seen or mtime > last_mtime:
-                last_seen, last_mtime = p, mtime
-                worker.trigger()
-        stop_event.wait(interval)
+def polling_loop(routes: List[Config], worker: PublishWorker, interval: float, reconcile_interval: float,
+                 stop_event: threading.Event):
+    """
+    Polling fallback for all folders on one thread. Each tick costs one stat() per folder;
+    a full rescan only runs when a folder changed or every `reconcile_interval` seconds.
+    """
+    indexes = [(DirectoryIndex(cfg.directory, cfg.patterns, cfg.recursive), cfg) for cfg in routes]
+    for index, _ in indexes:
+        logging.info("Polling %s every %.2fs (full rescan at most every %.0fs).", index.root, interval, reconcile_interval)
+        # Files already present at startup are not published; only ones that appear or change afterwards.
+        index.reconcile()
+    while not stop_event.wait(interval):
+        for index, cfg in indexes:
+            for p in index.maybe_reconcile(reconcile_interval):
+                worker.trigger(p, cfg)
+
+# ----------------------------- config ----------------------------------
+
+# Per-folder settings a --config file may set (globally under `defaults:` or per entry
+# under `directories:`); they mirror the command line flags.
+ROUTE_KEYS = {"name", "dir", "pattern", "recursive", "debounce", "endpoint", "field_name", "timeout",
+              "attempts", "backoff", "token_env", "extra", "upload_mode", "chunk_size", "dedup", "concurrency",
+              "transform"}
+SETTINGS_KEYS = {"workers", "queue_db", "poll_interval", "reconcile_interval", "defaults", "directories"}
+
+def make_route(args, overrides: Optional[Dict[str, Any]] = None) -> Config:
+    """Build one folder's Config from the command line, with `overrides` from a config file on top."""
+    opts = {
+        "dir": args.dir, "pattern": args.pattern, "recursive": args.recursive, "debounce": args.debounce,
+        "endpoint": args.endpoint, "field_name": args.field_name, "timeout": args.timeout,
+        "attempts": args.attempts, "backoff": args.backoff, "token_env": args.token_env, "extra": args.extra,
+        "upload_mode": args.upload_mode, "chunk_size": args.chunk_size, "dedup": not args.no_dedup,
+        "concurrency": args.concurrency, "transform": args.transform,
+    }
+    opts.update(overrides or {})
+    unknown = set(opts) - ROUTE_KEYS
+    if unknown:
+        raise ValueError(f"Unknown directory setting(s): {', '.join(sorted(unknown))}")
+    if opts["upload_mode"] not in MODES:
+        raise ValueError(f"Unknown upload_mode {opts['upload_mode']!r}; expected one of {MODES}")
+    patterns = opts["pattern"] or []  # empty => accept all files
+    transforms = opts["transform"] or []
+    directory = os.path.abspath(os.path.expanduser(opts["dir"]))
+    return Config(
+        directory=directory,
+        patterns=[patterns] if isinstance(patterns, str) else list(patterns),
+        debounce=float(opts["debounce"]),
+        endpoint=opts["endpoint"],
+        field_name=opts["field_name"],
+        token=os.environ.get(opts["token_env"]) or None,
+        timeout=float(opts["timeout"]),
+        attempts=int(opts["attempts"]),
+        backoff=float(opts["backoff"]),
+        extra=list(opts["extra"]),
+        upload_mode=opts["upload_mode"],
+        chunk_size=int(float(opts["chunk_size"]) * 1024 * 1024),
+        dedup=bool(opts["dedup"]),
+        dedup_cache=args.dedup_cache,
+        name=opts.get("name") or directory,
+        recursive=bool(opts["recursive"]),
+        concurrency=int(opts["concurrency"]),
+        transforms=[parse_spec(t) for t in ([transforms] if isinstance(transforms, str) else transforms)],
+    )
+
+def load_routes(path: str, args) -> Tuple[List[Config], Dict[str, Any]]:
+    """
+    Read a YAML (needs PyYAML) or JSON config:
+
+        workers: 4
+        defaults: {endpoint: "http://host/upload", debounce: 1.0}
+        directories:
+          - {dir: /data/det1, pattern: ["*.tif"], recursive: true, concurrency: 2}
+          - {dir: /data/det2, endpoint: "http://other/upload"}
+
+    Returns the routes and the remaining top-level settings.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.lower().endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise ValueError("PyYAML is required for YAML configs (pip install pyyaml), or use JSON.")
+            data = yaml.safe_load(f) or {}
+        else:
+            data = json.load(f)
+    unknown = set(data) - SETTINGS_KEYS
+    if unknown:
+        raise ValueError(f"Unknown config key(s): {', '.join(sorted(unknown))}")
+    defaults = data.get("defaults") or {}
+    entries = data.get("directories") or []
+    if not entries:
+        raise ValueError(f"{path} lists no directories")
+    routes = [make_route(args, {**defaults, **entry}) for entry in entries]
+    names = [cfg.name for cfg in routes]
+    if len(set(names)) != len(names):
+        raise ValueError("Directory names must be unique")
+    settings = {k: v for k, v in data.items() if k not in ("defaults", "directories")}
+    return routes, settings
 
 # ----------------------------- main ------------------------------------
 
 def parse_args(argv: Optional[List[str]] = None):
-    ap = argparse.ArgumentParser(description="Publish the latest file from a folder to a web service when new files appear.")
+    ap = argparse.ArgumentParser(description="Watch one folder (or several, with --config) and publish every stable file "
+                                             "to a web service through a durable queue, with optional dedup and "
+                                             "pre-upload transforms.")
     ap.add_argument("--dir", default=r"D:\debug\test", help="Folder to monitor.")
+    ap.add_argument("--config", default=None,
+                    help="YAML/JSON file listing several folders to watch; command line flags act as defaults.")
+    ap.add_argument("--recursive", action="store_true", help="Also watch sub-folders.")
+    ap.add_argument("--concurrency", type=int, default=0,
+                    help="Max uploads in flight per folder (default: up to --workers).")
     ap.add_argument("--endpoint", default="http://127.0.0.1:8080", help="Web service URL to POST the file to.")
     ap.add_argument("--field-name", default="file", help="Form field name for file upload (default: file).")
     ap.add_argument("--pattern", action="append", default=[], help="Glob pattern(s) to include (e.g., --pattern '*.tif'). Repeatable.")
@@ -258,31 +660,59 @@ def parse_args(argv: Optional[List[str]] = None):
     ap.add_argument("--extra", action="append", default=[], help="Extra form fields as key=value (repeatable).")
     ap.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"])
     ap.add_argument("--poll-interval", type=float, default=0.0, help="If >0, enable polling fallback at this interval (seconds).")
+    ap.add_argument("--reconcile-interval", type=float, default=30.0,
+                    help="With polling, force a full folder rescan at least this often (seconds).")
+    ap.add_argument("--workers", type=int, default=2, help="Concurrent upload workers.")
+    ap.add_argument("--queue-db", default=None, help="SQLite publish queue (default: <dir>/.publish_queue.sqlite).")
+    ap.add_argument("--upload-mode", choices=MODES, default="multipart",
+                    help="multipart form POST, raw streamed POST, or resumable chunked upload.")
+    ap.add_argument("--chunk-size", type=float, default=4.0, help="Resumable upload chunk size (MiB).")
+    ap.add_argument("--no-dedup", action="store_true", help="Upload every stable file, even if its content was already published.")
+    ap.add_argument("--dedup-cache", type=int, default=10000, help="Recent digests kept in memory (older ones are looked up in the queue DB).")
+    ap.add_argument("--transform", action="append", default=[],
+                    help="Pre-upload transform, repeatable: zstd[:level], lz4[:level], png, webp, preview[:size].")
+    ap.add_argument("--transform-workers", type=int, default=0,
+                    help="Processes for transforms (default: one per CPU).")
+    ap.add_argument("--async", dest="use_async", action="store_true",
+                    help="Run claim -> hash -> upload as an asyncio pipeline with bounded queues.")
+    ap.add_argument("--queue-size", type=int, default=0,
+                    help="With --async, items buffered between stages (default: 2 x workers).")
+    ap.add_argument("--metrics-port", type=int, default=0,
+                    help="With --async, serve Prometheus-style counters on this port at /metrics.")
+    ap.add_argument("--retry-failed", action="store_true", help="Re-queue files that failed in previous runs.")
     return ap.parse_args(argv)
 
 def main():
     args = parse_args()
     logging.basicConfig(level=getattr(logging, args.log_level), format="%(asctime)s %(levelname)s: %(message)s")
-    directory = os.path.abspath(args.dir)
-    if not os.path.isdir(directory):
-        logging.error("Directory does not exist: %s", directory)
+    try:
+        if args.config:
+            routes, settings = load_routes(args.config, args)
+        else:
+            routes, settings = [make_route(args)], {}
+    except (OSError, ValueError) as e:
+        logging.error("Invalid configuration: %s", e)
         sys.exit(2)
-    token = os.environ.get(args.token_env) or None
-    patterns = args.pattern or []  # empty => accept all files
-    cfg = Config(
-        directory=directory,
-        patterns=patterns,
-        debounce=args.debounce,
-        endpoint=args.endpoint,
-        field_name=args.field_name,
-        token=token,
-        timeout=args.timeout,
-        attempts=args.attempts,
-        backoff=args.backoff,
-        extra=args.extra,
-    )
+    for cfg in routes:
+        if not os.path.isdir(cfg.directory):
+            logging.error("Directory does not exist: %s", cfg.directory)
+            sys.exit(2)
+    workers = int(settings.get("workers", args.workers))
+    poll_interval = float(settings.get("poll_interval", args.poll_interval))
+    reconcile_interval = float(settings.get("reconcile_interval", args.reconcile_interval))
+    queue_db = args.queue_db or settings.get("queue_db") or os.path.join(routes[0].directory, ".publish_queue.sqlite")
 
-    worker = PublishWorker(cfg)
+    publish_queue = PublishQueue(queue_db)
+    if args.retry_failed:
+        publish_queue.recover(retry_failed=True)
+    if args.use_async:
+        metrics = Metrics()
+        if args.metrics_port:
+            metrics.serve("0.0.0.0", args.metrics_port)
+        worker = AsyncPublishWorker(routes, publish_queue, workers=workers, transform_workers=args.transform_workers,
+                                    queue_size=args.queue_size, metrics=metrics)
+    else:
+        worker = PublishWorker(routes, publish_queue, workers=workers, transform_workers=args.transform_workers)
     worker.start()
 
     # Event-driven if available
@@ -292,14 +722,15 @@ def main():
 
     try:
         if WATCHDOG_AVAILABLE:
-            observer = start_watchdog(directory, worker, patterns)
+            observer = start_watchdog(routes, worker)
         else:
             logging.warning("watchdog not available; falling back to polling.")
+            poll_interval = poll_interval or 1.0
         # Optional polling (either as fallback or alongside watchdog for safety)
-        if args.poll_interval and args.poll_interval > 0:
+        if poll_interval > 0:
             poll_thread = threading.Thread(
                 target=polling_loop,
-                args=(directory, worker, patterns, args.poll_interval, stop_poll),
+                args=(routes, worker, poll_interval, reconcile_interval, stop_poll),
                 daemon=True,
             )
             poll_thread.start()
@@ -311,6 +742,7 @@ def main():
         logging.info("Stopping...")
     finally:
         worker.stop()
+        logging.info("Queue state: %s", publish_queue.counts())
         if observer:
             observer.stop()
             observer.join(timeout=5)